@@ -1,12 +1,27 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_swagger_ui import get_swaggerui_blueprint
-from indextts.infer_v2 import IndexTTS2
+from indextts.utils.background_model import BackgroundModel
+from indextts.utils.wav_stream import wav_header, pcm16_bytes
 import os
 import uuid
 import json
 
 app = Flask(__name__)
-tts = IndexTTS2(cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=True, use_cuda_kernel=False, use_deepspeed=False)
+
+
+def load_tts():
+    from indextts.infer_v2 import IndexTTS2
+
+    model = IndexTTS2(cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=True, use_cuda_kernel=False, use_deepspeed=False)
+    # 多个请求并发时，GPT 解码合并为连续批处理（INDEXTTS_MAX_BATCH_SIZE > 1 时启用）
+    max_batch_size = int(os.environ.get("INDEXTTS_MAX_BATCH_SIZE", "1"))
+    if max_batch_size > 1:
+        model.enable_continuous_batching(max_batch_size=max_batch_size)
+    return model
+
+
+# 模型在后台线程加载，加载期间 /health 可立即响应，其他请求等待模型就绪
+tts = BackgroundModel(load_tts, name="IndexTTS2")
 
 # Swagger UI 配置
 SWAGGER_URL = '/docs'
@@ -191,6 +206,41 @@ def swagger_spec():
                         }
                     }
                 }
+            },
+            "/tts/stream": {
+                "post": {
+                    "summary": "流式语音合成",
+                    "description": "参数与 /tts 相同，每合成完一个分句即通过 chunked 传输返回对应音频，降低首包延迟。"
+                                   "format=wav 时返回长度未知的流式 WAV 头（RIFF/data 大小为 0xFFFFFFFF），"
+                                   "format=pcm 时返回 16-bit 小端单声道裸 PCM，采样率见 X-Sample-Rate 响应头。"
+                                   "安装 flask-sock 后还可通过 WebSocket /tts/ws 获取同样的 PCM 数据。",
+                    "requestBody": {
+                        "required": True,
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "required": ["text", "spk_audio_prompt"],
+                                    "properties": {
+                                        "text": {"type": "string", "example": "你好，这是IndexTTS2的流式合成测试。"},
+                                        "spk_audio_prompt": {"type": "string", "example": "examples/voice_01.wav"},
+                                        "format": {"type": "string", "enum": ["wav", "pcm"], "default": "wav"}
+                                    }
+                                }
+                            }
+                        }
+                    },
+                    "responses": {
+                        "200": {
+                            "description": "分块返回的音频流",
+                            "content": {
+                                "audio/wav": {"schema": {"type": "string", "format": "binary"}},
+                                "audio/L16": {"schema": {"type": "string", "format": "binary"}}
+                            }
+                        },
+                        "400": {"description": "请求参数错误"}
+                    }
+                }
             }
         },
         "components": {
@@ -210,6 +260,8 @@ def swagger_spec():
 
 @app.route('/health', methods=['GET'])
 def health():
+    if not tts.ready:
+        return jsonify({"status": "failed" if tts.error is not None else "loading"}), 503
     return jsonify({"status": "ok"})
 
 @app.route('/tts', methods=['POST'])
@@ -245,5 +297,72 @@ def synthesize():
     
     return send_file(output_path, mimetype='audio/wav')
 
+
+SAMPLING_RATE = 22050
+
+
+def _stream_pcm(data):
+    """逐个分句合成，产出 16-bit PCM 字节块（含分句间静音）"""
+    for wav in tts.infer(
+        spk_audio_prompt=data.get('spk_audio_prompt'),
+        text=data.get('text'),
+        output_path=None,
+        emo_audio_prompt=data.get('emo_audio_prompt'),
+        emo_alpha=data.get('emo_alpha', 1.0),
+        emo_vector=data.get('emo_vector'),
+        use_emo_text=data.get('use_emo_text', False),
+        emo_text=data.get('emo_text'),
+        use_random=data.get('use_random', False),
+        stream_return=True,
+    ):
+        if wav is not None and wav.numel() > 0:
+            yield pcm16_bytes(wav)
+
+
+@app.route('/tts/stream', methods=['POST'])
+def synthesize_stream():
+    data = request.json
+    audio_format = data.get('format', 'wav')
+
+    if not data.get('text') or not data.get('spk_audio_prompt'):
+        return jsonify({"error": "text and spk_audio_prompt required"}), 400
+    if audio_format not in ('wav', 'pcm'):
+        return jsonify({"error": "format must be 'wav' or 'pcm'"}), 400
+
+    def generate():
+        if audio_format == 'wav':
+            yield wav_header(SAMPLING_RATE)
+        yield from _stream_pcm(data)
+
+    mimetype = 'audio/wav' if audio_format == 'wav' else f'audio/L16;rate={SAMPLING_RATE};channels=1'
+    headers = {"X-Sample-Rate": str(SAMPLING_RATE), "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+# WebSocket 流式接口（可选，需要 flask-sock）
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+    print(">> flask-sock not installed, WebSocket endpoint /tts/ws disabled")
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/tts/ws')
+    def synthesize_ws(ws):
+        """
+        客户端发送与 /tts 相同的 JSON 请求；服务端先回复一条 JSON 文本描述音频格式，
+        然后每个分句发送一个二进制 PCM 帧，最后发送 {"event": "end"}。
+        """
+        data = json.loads(ws.receive())
+        if not data.get('text') or not data.get('spk_audio_prompt'):
+            ws.send(json.dumps({"error": "text and spk_audio_prompt required"}))
+            return
+        ws.send(json.dumps({"sample_rate": SAMPLING_RATE, "channels": 1, "format": "pcm_s16le"}))
+        for chunk in _stream_pcm(data):
+            ws.send(chunk)
+        ws.send(json.dumps({"event": "end"}))
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8002)
+    app.run(host='0.0.0.0', port=8002, threaded=True)
@@ -6,20 +6,27 @@ import os
 import uuid
 from flask import Flask, request, jsonify, send_file
 from flask_swagger_ui import get_swaggerui_blueprint
-from indextts.infer_v2 import IndexTTS2
+from indextts.utils.background_model import BackgroundModel
 from speaker_cache_manager import SpeakerCacheManager
 
 app = Flask(__name__)
 
-# 初始化TTS模型
-print(">> Loading IndexTTS2 model...")
-tts = IndexTTS2(
-    cfg_path='checkpoints/config.yaml',
-    model_dir='checkpoints',
-    use_fp16=True,
-    use_cuda_kernel=True
-)
-print(">> Model loaded successfully")
+def load_tts():
+    from indextts.infer_v2 import IndexTTS2
+
+    print(">> Loading IndexTTS2 model...")
+    model = IndexTTS2(
+        cfg_path='checkpoints/config.yaml',
+        model_dir='checkpoints',
+        use_fp16=True,
+        use_cuda_kernel=True
+    )
+    print(">> Model loaded successfully")
+    return model
+
+
+# 初始化TTS模型：后台线程加载，加载期间 /health 可立即响应，其他请求等待模型就绪
+tts = BackgroundModel(load_tts, name="IndexTTS2")
 
 # 初始化缓存管理器
 cache_manager = SpeakerCacheManager()
@@ -188,22 +195,10 @@ def upload_speaker():
             speaker_id = result["speaker_id"]
             audio_path = cache_manager.get_speaker_audio(speaker_id)
             
-            # 调用TTS提取embedding（不生成音频）
-            _ = tts.infer(
-                text="预热",  # 短文本预热
-                spk_audio_prompt=audio_path,
-                output_path=None  # 不保存音频
-            )
-            
-            # 缓存embedding到磁盘
-            embeddings = {
-                "spk_cond": tts.cache_spk_cond,
-                "s2mel_style": tts.cache_s2mel_style,
-                "s2mel_prompt": tts.cache_s2mel_prompt,
-                "mel": tts.cache_mel
-            }
-            cache_manager.cache_embedding(speaker_id, embeddings)
-            result["message"] = "Speaker uploaded and embedding cached successfully"
+            # 注册voice pack：一次性计算全部说话人条件特征（不生成音频），保存为safetensors
+            pack_path = tts.enroll_voice(audio_path, cache_manager.voice_pack_path(speaker_id))
+            cache_manager.register_voice_pack(speaker_id, pack_path)
+            result["message"] = "Speaker uploaded and voice pack cached successfully"
         
         return jsonify(result)
     
@@ -242,21 +237,17 @@ def synthesize_cached():
     if not text or not speaker_id:
         return jsonify({"error": "text and speaker_id required"}), 400
     
-    # 从磁盘加载embedding
-    embeddings = cache_manager.load_embedding(speaker_id)
-    if embeddings is None:
-        return jsonify({"error": f"Speaker {speaker_id} not found or embedding not cached"}), 404
-    
-    # 将embedding加载到GPU
-    device = tts.device
-    tts.cache_spk_cond = embeddings["spk_cond"].to(device)
-    tts.cache_s2mel_style = embeddings["s2mel_style"].to(device)
-    tts.cache_s2mel_prompt = embeddings["s2mel_prompt"].to(device)
-    tts.cache_mel = embeddings["mel"].to(device)
-    
-    # 获取音频路径（用于标记缓存有效）
-    audio_path = cache_manager.get_speaker_audio(speaker_id)
-    tts.cache_spk_audio_prompt = audio_path
+    # 优先使用voice pack（safetensors，由 infer() 直接加载）
+    spk_prompt = cache_manager.get_voice_pack(speaker_id)
+    if spk_prompt is None:
+        # 从磁盘加载embedding（旧版本的pickle缓存）
+        embeddings = cache_manager.load_embedding(speaker_id)
+        if embeddings is None:
+            return jsonify({"error": f"Speaker {speaker_id} not found or embedding not cached"}), 404
+        
+        # 将embedding加载到GPU（注册到TTS模型的条件缓存）
+        spk_prompt = cache_manager.get_speaker_audio(speaker_id)
+        tts.set_spk_conditioning(spk_prompt, embeddings)
     
     # 生成音频
     os.makedirs("/app/outputs", exist_ok=True)
@@ -264,7 +255,7 @@ def synthesize_cached():
     
     tts.infer(
         text=text,
-        spk_audio_prompt=audio_path,  # 会直接使用缓存
+        spk_audio_prompt=spk_prompt,  # 会直接使用缓存
         output_path=output_path,
         emo_vector=emo_vector,
         emo_alpha=emo_alpha
@@ -302,6 +293,11 @@ def synthesize():
 @app.route('/health', methods=['GET'])
 def health():
     """健康检查"""
+    if not tts.ready:
+        return jsonify({
+            "status": "failed" if tts.error is not None else "loading",
+            "cached_speakers": len(cache_manager.list_speakers())
+        }), 503
     return jsonify({
         "status": "healthy",
         "cached_speakers": len(cache_manager.list_speakers())
@@ -6,20 +6,28 @@ import os
 import uuid
 from flask import Flask, request, jsonify, send_file
 from flask_swagger_ui import get_swaggerui_blueprint
-from indextts.infer_v2 import IndexTTS2
+from indextts.utils.background_model import BackgroundModel
+from indextts.utils.cond_cache import audio_content_key
 from speaker_cache_manager import SpeakerCacheManager
 
 app = Flask(__name__)
 
-# 初始化TTS模型
-print(">> Loading IndexTTS2 model...")
-tts = IndexTTS2(
-    cfg_path='checkpoints/config.yaml',
-    model_dir='checkpoints',
-    use_fp16=True,
-    use_cuda_kernel=True
-)
-print(">> Model loaded successfully")
+def load_tts():
+    from indextts.infer_v2 import IndexTTS2
+
+    print(">> Loading IndexTTS2 model...")
+    model = IndexTTS2(
+        cfg_path='checkpoints/config.yaml',
+        model_dir='checkpoints',
+        use_fp16=True,
+        use_cuda_kernel=True
+    )
+    print(">> Model loaded successfully")
+    return model
+
+
+# 初始化TTS模型：后台线程加载，加载期间 /health 可立即响应，其他请求等待模型就绪
+tts = BackgroundModel(load_tts, name="IndexTTS2")
 
 # 初始化缓存管理器
 cache_manager = SpeakerCacheManager()
@@ -119,23 +127,11 @@ def upload_speaker():
             speaker_id = result["speaker_id"]
             audio_path = cache_manager.get_speaker_audio(speaker_id)
             
-            # 调用TTS提取embedding（不生成音频）
-            # 这会自动缓存到TTS模型的内存中
-            _ = tts.infer(
-                text="预热",
-                spk_audio_prompt=audio_path,
-                output_path=None
-            )
-            
-            # 同时保存到磁盘（用于容器重启后恢复）
-            embeddings = {
-                "spk_cond": tts.cache_spk_cond,
-                "s2mel_style": tts.cache_s2mel_style,
-                "s2mel_prompt": tts.cache_s2mel_prompt,
-                "mel": tts.cache_mel
-            }
-            cache_manager.cache_embedding(speaker_id, embeddings)
-            result["message"] = "Speaker uploaded and embedding cached (memory + disk)"
+            # 注册voice pack：一次性计算全部说话人条件特征（不生成音频）
+            # 同时写入TTS模型的内存缓存，并保存为safetensors（容器重启或新节点只需读取一次文件）
+            pack_path = tts.enroll_voice(audio_path, cache_manager.voice_pack_path(speaker_id))
+            cache_manager.register_voice_pack(speaker_id, pack_path)
+            result["message"] = "Speaker uploaded and voice pack cached (memory + disk)"
         
         return jsonify(result)
     
@@ -156,13 +152,7 @@ def delete_speaker(speaker_id):
     """删除说话人缓存"""
     success = cache_manager.delete_speaker(speaker_id)
     if success:
-        # 同时清空TTS模型的内存缓存（如果是当前speaker）
-        if tts.cache_spk_audio_prompt and speaker_id in str(tts.cache_spk_audio_prompt):
-            tts.cache_spk_cond = None
-            tts.cache_s2mel_style = None
-            tts.cache_s2mel_prompt = None
-            tts.cache_mel = None
-            tts.cache_spk_audio_prompt = None
+        # 说话人在TTS模型内存缓存中的条目会按LRU自然淘汰
         return jsonify({"message": f"Speaker {speaker_id} deleted successfully"})
     else:
         return jsonify({"error": "Speaker not found"}), 404
@@ -192,14 +182,18 @@ def synthesize_cached():
     if audio_path is None:
         return jsonify({"error": f"Speaker {speaker_id} not found"}), 404
     
+    # 优先使用voice pack：内存缓存未命中时由 infer() 直接从safetensors加载（一次文件读取）
+    spk_prompt = cache_manager.get_voice_pack(speaker_id) or audio_path
+    
     # 检查TTS模型的内存缓存是否有效
-    cache_valid = (
-        tts.cache_spk_cond is not None and 
-        tts.cache_spk_audio_prompt == audio_path
-    )
+    cache_valid = ("spk", audio_content_key(audio_path)) in tts.cond_cache
     
-    if not cache_valid:
-        # 内存缓存失效，从磁盘加载
+    if cache_valid:
+        print(f">> Using in-memory cache for speaker {speaker_id}")
+    elif spk_prompt != audio_path:
+        print(f">> Loading speaker {speaker_id} from voice pack...")
+    else:
+        # 旧版本的pickle磁盘缓存
         print(f">> Loading speaker {speaker_id} from disk cache...")
         embeddings = cache_manager.load_embedding(speaker_id)
         
@@ -207,15 +201,8 @@ def synthesize_cached():
             return jsonify({"error": f"Speaker {speaker_id} embedding not cached"}), 404
         
         # 加载到GPU显存
-        device = tts.device
-        tts.cache_spk_cond = embeddings["spk_cond"].to(device)
-        tts.cache_s2mel_style = embeddings["s2mel_style"].to(device)
-        tts.cache_s2mel_prompt = embeddings["s2mel_prompt"].to(device)
-        tts.cache_mel = embeddings["mel"].to(device)
-        tts.cache_spk_audio_prompt = audio_path
+        tts.set_spk_conditioning(audio_path, embeddings)
         print(f">> Speaker {speaker_id} loaded to GPU memory")
-    else:
-        print(f">> Using in-memory cache for speaker {speaker_id}")
     
     # 生成音频（使用内存缓存）
     os.makedirs("/app/outputs", exist_ok=True)
@@ -223,7 +210,7 @@ def synthesize_cached():
     
     tts.infer(
         text=text,
-        spk_audio_prompt=audio_path,  # 会直接使用内存缓存
+        spk_audio_prompt=spk_prompt,  # 会直接使用内存缓存
         output_path=output_path,
         emo_vector=emo_vector,
         emo_alpha=emo_alpha
@@ -261,10 +248,17 @@ def synthesize():
 @app.route('/health', methods=['GET'])
 def health():
     """健康检查"""
+    if not tts.ready:
+        return jsonify({
+            "status": "failed" if tts.error is not None else "loading",
+            "cached_speakers": len(cache_manager.list_speakers())
+        }), 503
     return jsonify({
         "status": "healthy",
         "cached_speakers": len(cache_manager.list_speakers()),
-        "memory_cache_active": tts.cache_spk_cond is not None
+        "memory_cache_active": len(tts.cond_cache) > 0,
+        "memory_cache": tts.cond_cache.stats(),
+        "gpt_prefix_cache": tts.gpt.prefix_cache.stats() if tts.gpt.prefix_cache is not None else None
     })
 
 
@@ -3,21 +3,31 @@ API Server with RAM Cache Support
 支持内存缓存的API服务器
 """
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional, List
 import uvicorn
-import torch
-import torchaudio
 import uuid
 from pathlib import Path
+from indextts.utils.background_model import BackgroundModel
 from speaker_cache_ram import SpeakerCacheRAM
 
 app = FastAPI(title="IndexTTS2 API with RAM Cache", version="2.1")
 
-# 全局变量
-tts = None
-cache_manager = None
+
+def load_tts():
+    from indextts.infer_v2 import IndexTTS2
+
+    print("🚀 Initializing IndexTTS2 with RAM Cache...")
+    model = IndexTTS2(device="cuda")
+    print("✅ IndexTTS2 with RAM Cache initialized")
+    return model
+
+
+# 模型在后台线程加载，加载期间 /health 可立即响应，其他请求等待模型就绪
+tts = BackgroundModel(load_tts, name="IndexTTS2")
+cache_manager = SpeakerCacheRAM(cache_dir="/app/outputs/speaker_cache")
+print(f"📊 Cache stats: {cache_manager.get_cache_stats()}")
 
 
 class TTSRequest(BaseModel):
@@ -41,34 +51,19 @@ class UploadSpeakerRequest(BaseModel):
     speaker_name: Optional[str] = None
 
 
-@app.on_event("startup")
-async def startup_event():
-    global tts, cache_manager
-    
-    print("🚀 Initializing IndexTTS2 with RAM Cache...")
-    
-    from indextts.infer_v2 import IndexTTS2
-    tts = IndexTTS2(device="cuda")
-    
-    cache_manager = SpeakerCacheRAM(cache_dir="/app/outputs/speaker_cache")
-    
-    print("✅ IndexTTS2 with RAM Cache initialized")
-    print(f"📊 Cache stats: {cache_manager.get_cache_stats()}")
-
-
+# 使用模型的接口定义为同步函数：FastAPI 在线程池中执行，等待模型加载和推理时不阻塞事件循环
 @app.post("/tts")
-async def synthesize(request: TTSRequest):
+def synthesize(request: TTSRequest):
     """标准TTS接口（支持禁用缓存）"""
+    import torch
+    import torchaudio
+
     if not request.spk_audio_prompt:
         raise HTTPException(status_code=400, detail="spk_audio_prompt is required")
     
     # 如果禁用缓存，清空IndexTTS2的内部缓存
     if request.disable_cache:
-        tts.cache_spk_cond = None
-        tts.cache_s2mel_style = None
-        tts.cache_s2mel_prompt = None
-        tts.cache_spk_audio_prompt = None
-        tts.cache_mel = None
+        tts.cond_cache.clear()
         torch.cuda.empty_cache()
     
     audio = tts.infer(
@@ -89,18 +84,17 @@ async def synthesize(request: TTSRequest):
 
 
 @app.post("/tts_cached")
-async def synthesize_cached(request: TTSCachedRequest):
+def synthesize_cached(request: TTSCachedRequest):
     """使用内存缓存的TTS接口"""
+    import torchaudio
+
     # 从内存获取embedding
     cached_emb = cache_manager.get_embedding(request.speaker_id)
     
     if cached_emb:
         # 从内存加载embedding到IndexTTS2
-        tts.cache_spk_cond = cached_emb["spk_cond"]
-        tts.cache_s2mel_style = cached_emb["s2mel_style"]
-        tts.cache_s2mel_prompt = cached_emb["s2mel_prompt"]
-        tts.cache_mel = cached_emb["mel"]
-        tts.cache_spk_audio_prompt = cached_emb["audio_path"]
+        audio_path = cached_emb["audio_path"]
+        tts.set_spk_conditioning(audio_path, cached_emb)
         print(f"[RAM Cache] Loaded {request.speaker_id} from memory")
     else:
         # 首次使用，需要提取embedding
@@ -108,52 +102,15 @@ async def synthesize_cached(request: TTSCachedRequest):
         if not audio_path:
             raise HTTPException(status_code=404, detail=f"Speaker {request.speaker_id} not found")
         
-        # 提取embedding
-        audio, sr = tts._load_and_cut_audio(audio_path, 15, False)
-        audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-        audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
-        
-        inputs = tts.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
-        input_features = inputs["input_features"].to(tts.device)
-        attention_mask = inputs["attention_mask"].to(tts.device)
-        spk_cond_emb = tts.get_emb(input_features, attention_mask)
-        
-        _, S_ref = tts.semantic_codec.quantize(spk_cond_emb)
-        ref_mel = tts.mel_fn(audio_22k.to(spk_cond_emb.device).float())
-        ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
-        feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
-                                                 num_mel_bins=80,
-                                                 dither=0,
-                                                 sample_frequency=16000)
-        feat = feat - feat.mean(dim=0, keepdim=True)
-        style = tts.campplus_model(feat.unsqueeze(0))
-        
-        prompt_condition = tts.s2mel.models['length_regulator'](S_ref,
-                                                                ylens=ref_target_lengths,
-                                                                n_quantizers=3,
-                                                                f0=None)[0]
-        
-        # 缓存到内存
-        embedding_dict = {
-            "spk_cond": spk_cond_emb,
-            "s2mel_style": style,
-            "s2mel_prompt": prompt_condition,
-            "mel": ref_mel,
-            "audio_path": audio_path
-        }
+        # 提取embedding（同时缓存到IndexTTS2）
+        embedding_dict = dict(tts.get_spk_conditioning(audio_path))
+        embedding_dict["audio_path"] = audio_path
         cache_manager.cache_embedding(request.speaker_id, embedding_dict)
-        
-        # 设置到IndexTTS2
-        tts.cache_spk_cond = spk_cond_emb
-        tts.cache_s2mel_style = style
-        tts.cache_s2mel_prompt = prompt_condition
-        tts.cache_mel = ref_mel
-        tts.cache_spk_audio_prompt = audio_path
     
     # 合成语音
     audio = tts.infer(
         text=request.text,
-        spk_audio_prompt=tts.cache_spk_audio_prompt,
+        spk_audio_prompt=audio_path,
         emo_vector=request.emo_vector,
         emo_alpha=request.emo_alpha
     )
@@ -198,6 +155,11 @@ async def get_cache_stats():
 
 @app.get("/health")
 async def health_check():
+    if not tts.ready:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "failed" if tts.error is not None else "loading", "cache_type": "RAM"},
+        )
     return {"status": "healthy", "cache_type": "RAM"}
 
 
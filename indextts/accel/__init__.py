@@ -1,8 +1,10 @@
-from .accel_engine import AccelInferenceEngine  # noqa: F401
+from .accel_engine import AccelInferenceEngine, GenerationRequest  # noqa: F401
 from .attention import (  # noqa: F401
+    ATTENTION_BACKENDS,
     Attention,
     get_forward_context,
     reset_forward_context,
+    resolve_attention_backend,
     set_forward_context,
 )
 from .gpt2_accel import GPT2AccelAttention, GPT2AccelModel  # noqa: F401
@@ -4,10 +4,14 @@ from typing import List, Optional
 import torch
 from torch import nn
 
+from indextts.utils.fused_sampling import mark_seen, process_logits, seen_from_ids
+
 from .attention import (
+    Attention,
     ForwardContext,
     get_forward_context,
     reset_forward_context,
+    resolve_attention_backend,
     set_forward_context,
 )
 from .kv_manager import KVCacheManager, Seq
@@ -18,19 +22,90 @@ class Sampler(nn.Module):
         super().__init__()
 
     @torch.compile
-    def forward(self, logits: torch.Tensor, temperatures: torch.Tensor):
-        temperatures = temperatures.to(logits.device).clamp(min=1e-8)
-        greedy_mask = temperatures < 1e-5
-        temp_for_scaling = torch.where(greedy_mask, 1.0, temperatures)
-        scaled_logits = logits / temp_for_scaling.unsqueeze(-1)
-        probs = torch.softmax(scaled_logits, dim=-1, dtype=torch.float32)
-        q = torch.empty_like(probs)
-        q.exponential_()
-        sampled_tokens = probs.div_(q).argmax(dim=-1)
-        greedy_tokens = logits.argmax(dim=-1)
+    def forward(
+        self,
+        logits: torch.Tensor,
+        temperatures: torch.Tensor,
+        top_k: Optional[torch.Tensor] = None,
+        top_p: Optional[torch.Tensor] = None,
+        repetition_penalty: Optional[torch.Tensor] = None,
+        seen: Optional[torch.Tensor] = None,
+    ):
+        """
+        Args:
+            temperatures: [batch_size], 0 for greedy rows
+            top_k, top_p, repetition_penalty: [batch_size] per-sequence values, None to skip the step
+            seen: [batch_size, vocab_size] bool bitmap of the tokens the repetition penalty applies to
+        """
+        greedy_mask = temperatures <= 0
+        scores = process_logits(
+            logits.float(),
+            seen=seen,
+            repetition_penalty=repetition_penalty,
+            temperature=torch.where(greedy_mask, 1.0, temperatures),
+            top_k=top_k,
+            top_p=top_p,
+        )
+        probs = torch.softmax(scores, dim=-1)
+        sampled_tokens = probs.div_(
+            torch.empty_like(probs).exponential_(1).clamp_min_(1e-10)
+        ).argmax(dim=-1)
+        greedy_tokens = scores.argmax(dim=-1)
         return torch.where(greedy_mask, greedy_tokens, sampled_tokens)
 
 
+class GenerationRequest:
+    """
+    A single sequence decoded by `AccelInferenceEngine`, see `add_requests()` and `step()`.
+    """
+
+    def __init__(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int = 100,
+        temperature: float = 1.0,
+        top_k: int = 0,
+        top_p: float = 1.0,
+        repetition_penalty: float = 1.0,
+        stop_tokens: Optional[List[int]] = None,
+        prompt_embeddings: Optional[torch.Tensor] = None,
+        prefix_kv: Optional[torch.Tensor] = None,
+        return_hidden_states: bool = False,
+    ):
+        """
+        Args:
+            prompt_ids: prompt token ids; placeholders ending with start_mel_token for a TTS prompt
+            max_new_tokens: Maximum number of tokens to generate
+            temperature: Sampling temperature, 0 for greedy decoding
+            top_k: Top-k sampling, 0 to disable
+            top_p: Nucleus sampling threshold, 1.0 to disable
+            repetition_penalty: Penalty of the tokens already in the sequence (prompt ids included, as in HF
+                `generate()`), 1.0 to disable
+            stop_tokens: List of token IDs that stop generation, they are not added to `generated`
+            prompt_embeddings: TTS: unpadded `[cond][text][start_mel]` embeddings [len(prompt_ids), hidden_size]
+            prefix_kv: TTS: [2, num_layers, P, num_heads, head_dim] KV of the first P prompt tokens
+            return_hidden_states: keep the last-layer hidden state (before lm_head) that produced each token
+        """
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k or 0
+        self.top_p = top_p if top_p is not None else 1.0
+        self.repetition_penalty = repetition_penalty or 1.0
+        self.stop_tokens = set(stop_tokens or ())
+        self.prompt_embeddings = prompt_embeddings
+        self.prefix_kv = prefix_kv
+        self.return_hidden_states = return_hidden_states
+        self.generated: List[int] = []
+        self.hidden_states: List[torch.Tensor] = []
+        self.seq: Optional[Seq] = None
+        self.finish_reason: Optional[str] = None  # "stop", "length" or "aborted"
+
+    @property
+    def finished(self) -> bool:
+        return self.finish_reason is not None
+
+
 class AccelInferenceEngine:
     def __init__(
         self,
@@ -42,8 +117,15 @@ class AccelInferenceEngine:
         block_size: int = 256,
         num_blocks: int = 128,
         use_cuda_graph: bool = True,
+        attention_backend: Optional[str] = None,
+        max_graph_batch_size: int = 8,
     ):
         """
+        Sequences are decoded together in a running batch: `add_requests()` prefills new ones between two
+        `step()` calls, each `step()` generates one token for every running sequence, and a sequence leaves
+        the batch (and frees its KV blocks) as soon as it finishes. `generate()` drives that loop for one batch.
+        The engine is not thread-safe, a server-side batcher should call it from a single thread.
+
         Args:
             model: The GPT transformer model (should have accel attention)
             lm_head: Language model head for generating logits
@@ -53,12 +135,24 @@ class AccelInferenceEngine:
             block_size: KV cache block size
             num_blocks: Total number of KV cache blocks
             use_cuda_graph: Whether to use CUDA Graph for decode optimization
+            attention_backend: "flash" or "sdpa" (pure PyTorch, also runs on CPU), None to pick "flash"
+                when the model is on CUDA and flash_attn is installed; see `set_attention_backend()`
+            max_graph_batch_size: Largest decode batch replayed from a CUDA graph, larger batches run eagerly
         """
         self.model = model
         self.lm_head = lm_head
         self.block_size = block_size
         self.num_blocks = num_blocks
-        self.use_cuda_graph = use_cuda_graph and torch.cuda.is_available()
+        self.device = next(model.parameters()).device
+        self.attention_backend = resolve_attention_backend(attention_backend, self.device)
+        if self.attention_backend == "flash" and block_size % 256 != 0:
+            raise ValueError("the flash attention backend needs a block_size multiple of 256")
+        # the captured graphs use the Triton KV store, which skips padded slots without host syncs
+        self.use_cuda_graph = (
+            use_cuda_graph
+            and self.device.type == "cuda"
+            and self.attention_backend == "flash"
+        )
         self.hidden_size = (
             model.config.hidden_size
             if hasattr(model, "config")
@@ -70,16 +164,52 @@ class AccelInferenceEngine:
             head_dim=head_dim,
             block_size=block_size,
             num_blocks=num_blocks,
-            dtype=torch.float16,  # Force fp16 for FlashAttention
+            # FlashAttention needs fp16, the reference backend keeps the model dtype
+            dtype=(
+                torch.float16
+                if self.attention_backend == "flash"
+                else next(model.parameters()).dtype
+            ),
+            device=self.device,
         )
         self.kv_manager.wire_kv_cache_to_model(model)
+        self._apply_attention_backend()
         self.sampler = Sampler()
-        self.current_sequences = []
+        self.running: List[GenerationRequest] = []
+        # [len(running), vocab_size] bool, tokens seen by every running sequence (for the repetition penalty)
+        self._seen = None
+        self._tts_mode = False
+        self.tts_mel_embedding = None
+        self.tts_text_pos_embedding = None
+        self.max_graph_batch_size = max_graph_batch_size
         self.graphs = {}
         self.graph_vars = None
         self.graph_pool = None
         self.graph_captured = False
 
+    def _apply_attention_backend(self):
+        for module in self.model.modules():
+            if isinstance(module, Attention):
+                module.backend = self.attention_backend
+
+    def set_attention_backend(self, backend: str):
+        """
+        Switch the attention implementation at runtime, e.g. to check the FlashAttention path against the
+        "sdpa" reference on the same KV cache. CUDA graphs are only replayed with the "flash" backend.
+        """
+        backend = resolve_attention_backend(backend, self.device)
+        if backend == "flash" and self.kv_manager.kv_cache.dtype != torch.float16:
+            raise ValueError("the KV cache was allocated for the sdpa backend, it is not fp16")
+        self.attention_backend = backend
+        self._apply_attention_backend()
+
+    def _to_device(self, data, dtype: torch.dtype) -> torch.Tensor:
+        if self.device.type == "cuda":
+            return torch.tensor(data, dtype=dtype, pin_memory=True).to(
+                self.device, non_blocking=True
+            )
+        return torch.tensor(data, dtype=dtype, device=self.device)
+
     def _prepare_prefill(self, requests: List[Seq]):
         input_ids = []
         positions = []
@@ -111,21 +241,11 @@ class AccelInferenceEngine:
                     slot_idx = block_id * self.block_size + block_offset
                     slot_mapping.append(slot_idx)
 
-        input_ids = torch.tensor(input_ids, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        positions = torch.tensor(positions, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        cu_seqlens_q = torch.tensor(
-            cu_seqlens_q, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        cu_seqlens_k = torch.tensor(
-            cu_seqlens_k, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        slot_mapping = torch.tensor(
-            slot_mapping, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        input_ids = self._to_device(input_ids, torch.int64)
+        positions = self._to_device(positions, torch.int64)
+        cu_seqlens_q = self._to_device(cu_seqlens_q, torch.int32)
+        cu_seqlens_k = self._to_device(cu_seqlens_k, torch.int32)
+        slot_mapping = self._to_device(slot_mapping, torch.int32)
 
         block_tables = None
         if cu_seqlens_k[-1] > cu_seqlens_q[-1]:
@@ -134,9 +254,7 @@ class AccelInferenceEngine:
             for req in requests:
                 table = req.block_table + [-1] * (max_len - len(req.block_table))
                 block_tables_list.append(table)
-            block_tables = torch.tensor(
-                block_tables_list, dtype=torch.int32, pin_memory=True
-            ).cuda(non_blocking=True)
+            block_tables = self._to_device(block_tables_list, torch.int32)
 
         set_forward_context(
             True,
@@ -164,8 +282,9 @@ class AccelInferenceEngine:
             input_ids.append(req.last_token)
 
             pos = len(req) - 1
-            if hasattr(self, "_tts_mode") and self._tts_mode:
-                pos = pos - (self._tts_prompt_len - 1)
+            if self._tts_mode:
+                # mel positions as in GPT2InferenceModel: start_mel_token at 0, the k-th generated code at k + 1
+                pos = len(req) - req.num_prompt_tokens + 1
             positions.append(pos)
 
             context_lens.append(len(req))
@@ -173,27 +292,17 @@ class AccelInferenceEngine:
                 req.block_table[-1] * self.block_size + req.last_block_num_tokens - 1
             )
 
-        input_ids = torch.tensor(input_ids, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        positions = torch.tensor(positions, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        slot_mapping = torch.tensor(
-            slot_mapping, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        context_lens = torch.tensor(
-            context_lens, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        input_ids = self._to_device(input_ids, torch.int64)
+        positions = self._to_device(positions, torch.int64)
+        slot_mapping = self._to_device(slot_mapping, torch.int32)
+        context_lens = self._to_device(context_lens, torch.int32)
 
         max_len = max(len(req.block_table) for req in requests)
         block_tables_list = []
         for req in requests:
             table = req.block_table + [-1] * (max_len - len(req.block_table))
             block_tables_list.append(table)
-        block_tables = torch.tensor(
-            block_tables_list, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        block_tables = self._to_device(block_tables_list, torch.int32)
 
         assert block_tables.dim() == 2, (
             f"block_tables must be 2D, got shape {block_tables.shape}"
@@ -211,17 +320,59 @@ class AccelInferenceEngine:
 
         return input_ids, positions
 
-    def _prepare_sample(self, requests: List[Seq], temperature: float):
-        temperatures = [temperature] * len(requests)
-        temperatures = torch.tensor(
-            temperatures, dtype=torch.float32, pin_memory=True
-        ).cuda(non_blocking=True)
-        return temperatures
+    def _sample(
+        self,
+        logits: torch.Tensor,
+        requests: List[GenerationRequest],
+        seen: torch.Tensor,
+    ):
+        """Per-sequence sampling of [batch_size, vocab_size] logits, see `Sampler`."""
+        use_penalty = any(r.repetition_penalty != 1.0 for r in requests)
+        if not use_penalty and all(r.temperature <= 0 for r in requests):
+            return logits.argmax(dim=-1)
+
+        vocab_size = logits.size(-1)
+        temperatures = self._to_device([r.temperature for r in requests], torch.float32)
+        top_k = top_p = repetition_penalty = None
+        if any(0 < r.top_k < vocab_size for r in requests):
+            top_k = self._to_device([r.top_k for r in requests], torch.int64)
+        if any(r.top_p < 1.0 for r in requests):
+            top_p = self._to_device([r.top_p for r in requests], torch.float32)
+        if use_penalty:
+            repetition_penalty = self._to_device(
+                [r.repetition_penalty for r in requests], torch.float32
+            )
+        return self.sampler(
+            logits,
+            temperatures,
+            top_k=top_k,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            seen=seen if use_penalty else None,
+        )
+
+    def _compute_logits(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        if self.lm_head is None:
+            return self.model.compute_logits(hidden_states)  # [batch_size, vocab_size]
+        lm_head_dtype = next(self.lm_head.parameters()).dtype
+        if hidden_states.dtype != lm_head_dtype:
+            hidden_states = hidden_states.to(lm_head_dtype)
+        return self.lm_head(hidden_states)  # [batch_size, vocab_size]
+
+    def _graph_batch_sizes(self) -> List[int]:
+        # 1, 2, 4, 8, then every multiple of 8 up to max_graph_batch_size
+        max_bs = max(self.max_graph_batch_size, 1)
+        sizes = [bs for bs in (1, 2, 4) if bs < max_bs] + list(range(8, max_bs + 1, 8))
+        if not sizes or sizes[-1] != max_bs:
+            sizes.append(max_bs)
+        return sizes
 
     def _capture_cuda_graphs(self, tts_mel_embedding=None, tts_text_pos_embedding=None):
         print("Capturing CUDA graphs for decode optimization...")
-        max_bs = 8  # Support up to batch size 8
-        max_num_blocks = (2048 + self.block_size - 1) // self.block_size
+        self.graph_bs = self._graph_batch_sizes()
+        max_bs = self.graph_bs[-1]
+        # a sequence never holds more than all the blocks
+        max_num_blocks = self.num_blocks
         model_dtype = next(self.model.parameters()).dtype
         input_ids = torch.ones(max_bs, dtype=torch.int64, device="cuda")
         positions = torch.ones(max_bs, dtype=torch.int64, device="cuda")
@@ -237,8 +388,6 @@ class AccelInferenceEngine:
             max_bs, self.hidden_size, dtype=model_dtype, device="cuda"
         )
 
-        self.graph_bs = [1, 2, 4, 8]
-
         use_tts = tts_mel_embedding is not None and tts_text_pos_embedding is not None
 
         for bs in reversed(self.graph_bs):
@@ -318,9 +467,9 @@ class AccelInferenceEngine:
         tts_text_pos_embedding: Optional[torch.nn.Module] = None,
     ) -> torch.Tensor:
         bs = input_ids.size(0)
-        use_tts_embedding = hasattr(self, "_tts_mode") and self._tts_mode
+        use_tts_embedding = self._tts_mode
 
-        if not self.use_cuda_graph or not self.graphs:
+        if not self.use_cuda_graph or not self.graphs or self.attention_backend != "flash":
             if use_tts_embedding:
                 assert tts_mel_embedding is not None
                 assert tts_text_pos_embedding is not None
@@ -375,14 +524,233 @@ class AccelInferenceEngine:
 
         return graph_vars["outputs"][:bs]
 
+    @property
+    def num_running(self) -> int:
+        return len(self.running)
+
+    @property
+    def num_free_blocks(self) -> int:
+        """KV blocks not held by any sequence (some still cache released prompts and can be reused)."""
+        return len(self.kv_manager.free_block_ids)
+
+    def _blocks_to_finish(self, request: GenerationRequest) -> int:
+        # blocks for the prompt and all max_new_tokens, minus the ones a running sequence already holds
+        total = -(-(len(request.prompt_ids) + request.max_new_tokens) // self.block_size)
+        held = len(request.seq.block_table) if request.seq is not None else 0
+        return max(total - held, 0)
+
+    def can_add(self, requests: List[GenerationRequest]) -> bool:
+        """
+        Whether `add_requests(requests)` and decoding every running and new sequence up to its `max_new_tokens`
+        fit in the free KV blocks, so that a batcher can hold requests back instead of running out of blocks
+        mid-decode. Conservative: shared prompt blocks and early stops are not counted.
+        """
+        needed = sum(self._blocks_to_finish(r) for r in self.running)
+        needed += sum(self._blocks_to_finish(r) for r in requests)
+        return needed <= self.num_free_blocks
+
+    def add_requests(
+        self,
+        requests: List[GenerationRequest],
+        tts_mel_embedding: Optional[torch.nn.Module] = None,
+        tts_text_pos_embedding: Optional[torch.nn.Module] = None,
+    ) -> List[GenerationRequest]:
+        """
+        Prefill new sequences and add them to the running decode batch, between two `step()` calls.
+        Their prompts are prefilled together and every sequence samples its first token here.
+
+        Args:
+            requests: sequences to start, either all TTS prompts (`prompt_embeddings`) or all token ids,
+                the same kind as the running ones
+            tts_mel_embedding: TTS: mel_embedding layer, embeds the generated codes
+            tts_text_pos_embedding: TTS: mel position embedding layer (`text_pos_embedding` of the HF model)
+
+        Returns:
+            the requests that already finished on their first token
+        """
+        if not requests:
+            return []
+        tts_mode = requests[0].prompt_embeddings is not None
+        if any((r.prompt_embeddings is not None) != tts_mode for r in requests) or (
+            self.running and tts_mode != self._tts_mode
+        ):
+            raise ValueError("TTS (prompt_embeddings) and token id requests cannot share a decode batch")
+        if tts_mode:
+            if tts_mel_embedding is None or tts_text_pos_embedding is None:
+                raise ValueError("TTS requests need tts_mel_embedding and tts_text_pos_embedding")
+            self.tts_mel_embedding = tts_mel_embedding
+            self.tts_text_pos_embedding = tts_text_pos_embedding
+        self._tts_mode = tts_mode
+
+        # the capture writes into the first KV block, so only while no sequence holds blocks
+        if (
+            self.use_cuda_graph
+            and self.attention_backend == "flash"
+            and not self.graph_captured
+            and not self.running
+        ):
+            print(
+                f"[CAPTURE] use_cuda_graph={self.use_cuda_graph}, graph_captured={self.graph_captured}",
+                file=sys.stderr,
+                flush=True,
+            )
+            self._capture_cuda_graphs(
+                tts_mel_embedding=self.tts_mel_embedding,
+                tts_text_pos_embedding=self.tts_text_pos_embedding,
+            )
+            self.graph_captured = True
+            print(
+                f"[CAPTURE] Completed! graphs={list(self.graphs.keys())}",
+                file=sys.stderr,
+                flush=True,
+            )
+
+        sequences = []
+        try:
+            for request in requests:
+                block_hashes = None
+                if tts_mode:
+                    # the placeholder ids say nothing about the prompt: identify its blocks by content
+                    block_hashes = KVCacheManager.compute_embedding_block_hashes(
+                        request.prompt_embeddings, self.block_size
+                    )
+                seq = Seq(request.prompt_ids, block_size=self.block_size, block_hashes=block_hashes)
+                sequences.append(seq)
+                self.kv_manager.allocate(seq)
+                if request.prefix_kv is not None and seq.num_cached_tokens < request.prefix_kv.size(2):
+                    self.kv_manager.load_prefix(seq, request.prefix_kv)
+
+            prefill_ids, prefill_pos = self._prepare_prefill(sequences)
+            if tts_mode:
+                # only the tokens whose KV is not cached yet, packed as [1, total_tokens, hidden_dim]
+                full_embeddings = torch.cat(
+                    [
+                        request.prompt_embeddings[seq.num_cached_tokens :]
+                        for request, seq in zip(requests, sequences)
+                    ]
+                ).unsqueeze(0)
+
+                model_dtype = next(self.model.parameters()).dtype
+                if full_embeddings.dtype != model_dtype:
+                    full_embeddings = full_embeddings.to(model_dtype)
+
+                hidden_states = self.model(
+                    inputs_embeds=full_embeddings, return_dict=True
+                ).last_hidden_state
+            else:
+                hidden_states = self.model(
+                    input_ids=prefill_ids.unsqueeze(0),
+                    position_ids=prefill_pos.unsqueeze(0),
+                    return_dict=True,
+                ).last_hidden_state
+        except BaseException:
+            # nothing was admitted: release the blocks, the uncached ones were never written
+            for seq in sequences:
+                self.kv_manager.deallocate(seq, discard_uncached=True)
+            raise
+        finally:
+            reset_forward_context()
+
+        last_indices = []
+        total = 0
+        for seq in sequences:
+            total += len(seq) - seq.num_cached_tokens
+            last_indices.append(total - 1)
+        last_hidden = hidden_states[0, last_indices]  # [num_requests, hidden_size]
+
+        for request, seq in zip(requests, sequences):
+            request.seq = seq
+        self.running.extend(requests)
+        return self._sample_and_retire(last_hidden, start=len(self.running) - len(requests))
+
+    def step(self) -> List[GenerationRequest]:
+        """
+        Generate one token for every running sequence.
+
+        Returns:
+            the requests that finished in this step, their KV blocks are already released
+        """
+        if not self.running:
+            return []
+        requests = self.running
+        decode_ids, decode_pos = self._prepare_decode([r.seq for r in requests])
+
+        context = get_forward_context()
+        hidden_states = self._run_decode_with_graph(
+            decode_ids,
+            decode_pos,
+            context,
+            tts_mel_embedding=self.tts_mel_embedding,
+            tts_text_pos_embedding=self.tts_text_pos_embedding,
+        )
+        reset_forward_context()
+        if any(r.return_hidden_states for r in requests):
+            # the CUDA graph output buffer is overwritten by the next replay
+            hidden_states = hidden_states.clone()
+        return self._sample_and_retire(hidden_states, start=0)
+
+    def abort(self, request: GenerationRequest):
+        """Remove a sequence from the running batch and release its KV blocks."""
+        if request in self.running:
+            request.finish_reason = "aborted"
+            self._release([request])
+
+    def _release(self, requests: List[GenerationRequest]):
+        keep = [i for i, r in enumerate(self.running) if r not in requests]
+        if self._seen is not None:
+            self._seen = self._seen.index_select(0, self._to_device(keep, torch.int64))
+        self.running = [self.running[i] for i in keep]
+        for request in requests:
+            self.kv_manager.remove_seq(request.seq)
+
+    def _sample_and_retire(
+        self, hidden_states: torch.Tensor, start: int
+    ) -> List[GenerationRequest]:
+        """Sample the next token of `self.running[start:]` from their [n, hidden_size] hidden states."""
+        requests = self.running[start:]
+        logits = self._compute_logits(hidden_states)
+        num_seen = 0 if self._seen is None else self._seen.size(0)
+        if num_seen < len(self.running):
+            # the prompt ids of the new sequences count as seen, as in HF generate()
+            prompts = [r.prompt_ids for r in self.running[num_seen:]]
+            max_len = max(len(ids) for ids in prompts)
+            ids = self._to_device([ids + ids[-1:] * (max_len - len(ids)) for ids in prompts], torch.int64)
+            seen = seen_from_ids(ids, logits.size(-1))
+            self._seen = seen if self._seen is None else torch.cat([self._seen, seen])
+        seen = self._seen[start:]
+
+        next_tokens = self._sample(logits, requests, seen)
+        mark_seen(seen, next_tokens)
+        next_tokens = next_tokens.tolist()
+
+        finished = []
+        for i, (request, token_id) in enumerate(zip(requests, next_tokens)):
+            if request.return_hidden_states:
+                request.hidden_states.append(hidden_states[i])
+            if token_id in request.stop_tokens:
+                request.finish_reason = "stop"
+            else:
+                request.generated.append(token_id)
+                request.seq.append_token(token_id)
+                self.kv_manager.append_to_seq(request.seq)
+                if len(request.generated) >= request.max_new_tokens:
+                    request.finish_reason = "length"
+            if request.finished:
+                finished.append(request)
+
+        if finished:
+            self._release(finished)
+        return finished
+
     def generate(
         self,
         input_ids: torch.Tensor,
         max_new_tokens: int = 100,
         temperature: float = 1.0,
-        top_k: int = 50,
+        top_k: int = 0,
         top_p: float = 1.0,
         stop_tokens: Optional[List[int]] = None,
+        repetition_penalty: float = 1.0,
         attention_mask: Optional[torch.Tensor] = None,
         tts_embeddings: Optional[
             torch.Tensor
@@ -391,6 +759,9 @@ class AccelInferenceEngine:
         tts_text_pos_embedding: Optional[
             torch.nn.Module
         ] = None,  # TTS: text_pos_embedding layer
+        return_hidden_states: bool = False,
+        prefix_kv=None,  # TTS: per-layer (k, v) of the leading conditioning tokens, [1, H, P, D] each
+        num_return_sequences: int = 1,
     ) -> torch.Tensor:
         """
         Generate tokens.
@@ -398,37 +769,25 @@ class AccelInferenceEngine:
         Args:
             input_ids: Input token IDs [batch_size, seq_len]
             max_new_tokens: Maximum number of tokens to generate
-            temperature: Sampling temperature
-            top_k: Top-k sampling
+            temperature: Sampling temperature, 0 for greedy decoding
+            top_k: Top-k sampling, 0 to disable
             top_p: Nucleus sampling threshold
             stop_tokens: List of token IDs that stop generation
+            repetition_penalty: Penalty of the tokens already in the sequence, 1.0 to disable
+            return_hidden_states: Also return the last-layer hidden states (before lm_head)
+                that produced each generated token
+            prefix_kv: KV of the first P tokens of every (unpadded) TTS prompt, e.g. from
+                `UnifiedVoice.get_prefix_kv()`. It is copied into the KV cache and prefill skips those tokens.
+            num_return_sequences: sequences sampled per prompt, returned next to each other as in HF
+                `generate()`; the copies share the prompt KV blocks
 
         Returns:
-            Generated token IDs [batch_size, total_len]
+            Generated token IDs [batch_size * num_return_sequences, total_len], and hidden states
+            [batch_size * num_return_sequences, num_steps, hidden_size] if return_hidden_states
         """
         batch_size = input_ids.size(0)
         device = input_ids.device
 
-        self._tts_mode = tts_embeddings is not None
-        self._tts_prompt_len = input_ids.size(1) if self._tts_mode else 0
-
-        if self.use_cuda_graph and not self.graph_captured:
-            print(
-                f"[CAPTURE] use_cuda_graph={self.use_cuda_graph}, graph_captured={self.graph_captured}",
-                file=sys.stderr,
-                flush=True,
-            )
-            self._capture_cuda_graphs(
-                tts_mel_embedding=tts_mel_embedding,
-                tts_text_pos_embedding=tts_text_pos_embedding,
-            )
-            self.graph_captured = True
-            print(
-                f"[CAPTURE] Completed! graphs={list(self.graphs.keys())}",
-                file=sys.stderr,
-                flush=True,
-            )
-
         if tts_embeddings is not None:
             actual_seq_len = tts_embeddings.size(1) + 1  # embeddings + start_mel_token
         else:
@@ -446,190 +805,75 @@ class AccelInferenceEngine:
         else:
             seq_lens = [actual_seq_len] * batch_size
 
-        sequences = []
-        for i in range(batch_size):
-            seq_len = seq_lens[i]
-            token_ids = [1] * seq_len
-            if tts_embeddings is not None and seq_len > 0:
-                token_ids[-1] = input_ids[i, -1].item() if input_ids.size(1) > 0 else 1
-            else:
-                token_ids = input_ids[i].tolist()
-            req = Seq(token_ids)
-            self.kv_manager.allocate(req)
-            sequences.append(req)
-
-        self.current_sequences = sequences
-
-        prefill_ids, prefill_pos = self._prepare_prefill(sequences)
+        if prefix_kv is not None and tts_embeddings is not None:
+            # [layers, 2, 1, H, P, D] -> [2, layers, P, H, D]
+            prefix_kv = torch.stack([torch.stack(layer) for layer in prefix_kv])[:, :, 0].permute(1, 0, 3, 2, 4)
+        else:
+            prefix_kv = None
 
-        if (
-            tts_embeddings is not None
-            and tts_mel_embedding is not None
-            and tts_text_pos_embedding is not None
-        ):
+        prompt_embeddings = [None] * batch_size
+        if tts_embeddings is not None:
             start_token_id = input_ids[0, -1] if input_ids.size(1) > 0 else 8192
 
             start_emb = tts_mel_embedding(
-                torch.tensor([[start_token_id]], device="cuda")
+                torch.tensor([[start_token_id]], device=self.device)
             )  # [1, 1, hidden_dim]
 
-            start_pos = torch.tensor(
-                [[tts_embeddings.size(1)]], device="cuda", dtype=torch.long
-            )
+            start_pos = torch.zeros((1, 1), device=self.device, dtype=torch.long)
             pos_emb = tts_text_pos_embedding.emb(start_pos)
             start_emb = start_emb + pos_emb
-            start_emb = start_emb.repeat(batch_size, 1, 1)
-
-            if is_varlen_batch:
-                valid_embeddings = []
-                for i in range(batch_size):
-                    emb_len = seq_lens[i] - 1
-                    padding_len = tts_embeddings.size(1) - emb_len
-                    valid_emb = tts_embeddings[i, padding_len:].unsqueeze(
-                        0
-                    )  # [1, emb_len, hidden_dim]
-                    valid_embeddings.append(
-                        torch.cat([valid_emb, start_emb[i : i + 1]], dim=1)
-                    )
-                full_embeddings = torch.cat(
-                    valid_embeddings, dim=1
-                )  # [1, total_tokens, hidden_dim]
-            else:
-                full_embeddings = torch.cat(
-                    [tts_embeddings, start_emb], dim=1
-                )  # [batch_size, seq_len, hidden_dim]
-
-            model_dtype = next(self.model.parameters()).dtype
-            if full_embeddings.dtype != model_dtype:
-                full_embeddings = full_embeddings.to(model_dtype)
 
-            hidden_states = self.model(
-                inputs_embeds=full_embeddings, return_dict=True
-            ).last_hidden_state
-
-        else:
-            hidden_states = self.model(
-                input_ids=input_ids, attention_mask=attention_mask, return_dict=True
-            ).last_hidden_state
-
-        if is_varlen_batch:
-            context = get_forward_context()
-            cu_seqlens = context.cu_seqlens_q.cpu().tolist()
-            last_hidden = torch.stack(
-                [hidden_states[0, cu_seqlens[i + 1] - 1] for i in range(batch_size)]
-            )
-        else:
-            last_hidden = hidden_states[:, -1, :]  # [batch_size, hidden_size]
-
-        reset_forward_context()
-
-        if self.lm_head is not None:
-            if last_hidden.dtype != next(self.lm_head.parameters()).dtype:
-                last_hidden = last_hidden.to(next(self.lm_head.parameters()).dtype)
-            logits = self.lm_head(last_hidden)  # [batch_size, vocab_size]
-        else:
-            logits = self.model.compute_logits(last_hidden)  # [batch_size, vocab_size]
-
-        temperatures = self._prepare_sample(sequences, temperature)
-        if temperature > 0:
-            first_token = self.sampler(logits, temperatures)
-        else:
-            first_token = torch.argmax(logits, dim=-1)
-
-        first_token_list = first_token.tolist()
-
-        generated_tokens = [[] for _ in range(batch_size)]
-        is_finished = [False] * batch_size
-
-        for i, token_id in enumerate(first_token_list):
-            if stop_tokens and token_id in stop_tokens:
-                is_finished[i] = True
-            else:
-                generated_tokens[i].append(token_id)
-                sequences[i].append_token(token_id)
-                self.kv_manager.append_to_seq(sequences[i])
-
-        if all(is_finished):
-            for req in sequences:
-                self.kv_manager.remove_seq(req)
-            self.current_sequences = []
-
-            output_ids = []
+            # unpadded [cond][text][start_mel] embeddings of every row
             for i in range(batch_size):
-                full_sequence = input_ids[i].tolist() + generated_tokens[i]
-                output_ids.append(full_sequence)
-
-            output = torch.tensor(output_ids, dtype=torch.long, device=device)
-            return output
-
-        remaining_tokens = max_new_tokens - 1
-
-        for step in range(remaining_tokens):
-            decode_ids, decode_pos = self._prepare_decode(sequences)
-
-            context = get_forward_context()
-            hidden_states = self._run_decode_with_graph(
-                decode_ids,
-                decode_pos,
-                context,
-                tts_mel_embedding=tts_mel_embedding,
-                tts_text_pos_embedding=tts_text_pos_embedding,
-            )
-
-            # Get logits
-            if self.lm_head is not None:
-                logits = self.lm_head(hidden_states)  # [batch_size, vocab_size]
-            else:
-                logits = self.model.compute_logits(
-                    hidden_states
-                )  # [batch_size, vocab_size]
-
-            reset_forward_context()
+                padding_len = tts_embeddings.size(1) - (seq_lens[i] - 1)
+                prompt_embeddings[i] = torch.cat(
+                    [tts_embeddings[i, padding_len:], start_emb[0]], dim=0
+                )  # [seq_len, hidden_dim]
 
-            temperatures = self._prepare_sample(sequences, temperature)
-            if temperature > 0:
-                next_token = self.sampler(logits, temperatures)
+        requests = []
+        for i in range(batch_size):
+            if tts_embeddings is not None:
+                token_ids = [1] * seq_lens[i]
+                token_ids[-1] = input_ids[i, -1].item() if input_ids.size(1) > 0 else 1
             else:
-                next_token = torch.argmax(logits, dim=-1)
-            next_token_list = next_token.tolist()
-
-            for i, token_id in enumerate(next_token_list):
-                if is_finished[i]:
-                    continue
-                elif stop_tokens and token_id in stop_tokens:
-                    is_finished[i] = True
-                else:
-                    sequences[i].append_token(token_id)
-                    self.kv_manager.append_to_seq(sequences[i])
-                    generated_tokens[i].append(token_id)
-
-            if all(is_finished):
-                break
+                token_ids = input_ids[i].tolist()
+            for _ in range(num_return_sequences):
+                requests.append(
+                    GenerationRequest(
+                        token_ids,
+                        max_new_tokens=max_new_tokens,
+                        temperature=temperature,
+                        top_k=top_k,
+                        top_p=top_p,
+                        repetition_penalty=repetition_penalty,
+                        stop_tokens=stop_tokens,
+                        prompt_embeddings=prompt_embeddings[i],
+                        prefix_kv=prefix_kv,
+                        return_hidden_states=return_hidden_states,
+                    )
+                )
 
-        for req in sequences:
-            self.kv_manager.remove_seq(req)
-        self.current_sequences = []
+        self.add_requests(
+            requests,
+            tts_mel_embedding=tts_mel_embedding,
+            tts_text_pos_embedding=tts_text_pos_embedding,
+        )
+        try:
+            while not all(request.finished for request in requests):
+                self.step()
+        finally:
+            for request in requests:
+                self.abort(request)
 
         pad_token = stop_tokens[0] if stop_tokens else 0
 
-        if is_varlen_batch:
-            max_prompt_len = attention_mask.size(1)
-            output_ids = []
-
-            for i in range(batch_size):
-                padding_len = max_prompt_len - seq_lens[i]
-                initial_tokens = sequences[i].token_ids[
-                    : sequences[i].num_prompt_tokens
-                ]
-                padded_prompt = [pad_token] * padding_len + initial_tokens
-                full_sequence = padded_prompt + generated_tokens[i]
-                output_ids.append(full_sequence)
-        else:
-            output_ids = [
-                sequences[i].token_ids[: sequences[i].num_prompt_tokens]
-                + generated_tokens[i]
-                for i in range(batch_size)
-            ]
+        output_ids = []
+        for j, request in enumerate(requests):
+            full_sequence = request.prompt_ids + request.generated
+            if is_varlen_batch:
+                padding_len = attention_mask.size(1) - seq_lens[j // num_return_sequences]
+                full_sequence = [pad_token] * padding_len + full_sequence
+            output_ids.append(full_sequence)
 
         max_length = max(len(seq) for seq in output_ids)
         padded_output_ids = [
@@ -638,22 +882,16 @@ class AccelInferenceEngine:
 
         output = torch.tensor(padded_output_ids, dtype=torch.long, device=device)
 
-        assert output.size(0) == batch_size, (
-            f"Output batch size mismatch: {output.size(0)} != {batch_size}"
+        assert output.size(0) == batch_size * num_return_sequences, (
+            f"Output batch size mismatch: {output.size(0)} != {batch_size * num_return_sequences}"
         )
 
+        if return_hidden_states:
+            # sequences that stopped early are zero padded to the longest one
+            num_steps = max(len(request.hidden_states) for request in requests)
+            hidden = requests[0].hidden_states[0]
+            hidden_states = hidden.new_zeros(len(requests), num_steps, hidden.size(-1))
+            for j, request in enumerate(requests):
+                hidden_states[j, : len(request.hidden_states)] = torch.stack(request.hidden_states)
+            return output, hidden_states
         return output
-
-
-class Sampler(nn.Module):
-    def __init__(self):
-        super().__init__()
-
-    @torch.compile
-    def forward(self, logits: torch.Tensor, temperatures: torch.Tensor):
-        logits = logits.float().div_(temperatures.unsqueeze(dim=1))
-        probs = torch.softmax(logits, dim=-1)
-        sample_tokens = probs.div_(
-            torch.empty_like(probs).exponential_(1).clamp_min_(1e-10)
-        ).argmax(dim=-1)
-        return sample_tokens
\ No newline at end of file
@@ -1,11 +1,23 @@
 from dataclasses import dataclass
 
 import torch
-import triton
-import triton.language as tl
-from flash_attn import flash_attn_varlen_func, flash_attn_with_kvcache
+import torch.nn.functional as F
 from torch import nn
 
+try:
+    import triton
+    import triton.language as tl
+except ImportError:
+    triton = None
+try:
+    from flash_attn import flash_attn_varlen_func, flash_attn_with_kvcache
+except ImportError:
+    flash_attn_varlen_func = flash_attn_with_kvcache = None
+
+# "flash": FlashAttention + Triton KV store, CUDA only, fp16 KV cache and block_size a multiple of 256.
+# "sdpa": pure PyTorch reference (scaled_dot_product_attention over the gathered pages), runs on any device.
+ATTENTION_BACKENDS = ("flash", "sdpa")
+
 
 @dataclass
 class ForwardContext:
@@ -54,36 +66,57 @@ def reset_forward_context():
     _FORWARD_CONTEXT = ForwardContext()
 
 
-@triton.jit
-def store_kvcache_kernel(
-    key_ptr,
-    key_stride,
-    value_ptr,
-    value_stride,
-    k_cache_ptr,
-    v_cache_ptr,
-    slot_mapping_ptr,
-    D: tl.constexpr,
-):
-    BLOCK_SIZE: tl.constexpr = 2048
-    idx = tl.program_id(0)
-    slot = tl.load(slot_mapping_ptr + idx)
-    if slot == -1:
-        return
-    d_offset = 0
-    while d_offset < D:
-        cur_block_size = min(BLOCK_SIZE, D - d_offset)
-        key_offsets = idx * key_stride + d_offset + tl.arange(0, BLOCK_SIZE)
-        value_offsets = idx * value_stride + d_offset + tl.arange(0, BLOCK_SIZE)
-        cache_offsets = slot * D + d_offset + tl.arange(0, BLOCK_SIZE)
-
-        mask = tl.arange(0, BLOCK_SIZE) < cur_block_size
-        key = tl.load(key_ptr + key_offsets, mask=mask, other=0.0)
-        value = tl.load(value_ptr + value_offsets, mask=mask, other=0.0)
-        tl.store(k_cache_ptr + cache_offsets, key, mask=mask)
-        tl.store(v_cache_ptr + cache_offsets, value, mask=mask)
-
-        d_offset += BLOCK_SIZE
+def flash_backend_available():
+    return triton is not None and flash_attn_varlen_func is not None and torch.cuda.is_available()
+
+
+def resolve_attention_backend(backend=None, device=None):
+    """
+    Pick the attention backend: `backend` if given, otherwise "flash" on CUDA when flash_attn and Triton are
+    installed, else "sdpa".
+    """
+    if backend is None:
+        on_cuda = device is None or torch.device(device).type == "cuda"
+        return "flash" if on_cuda and flash_backend_available() else "sdpa"
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f"unknown attention backend {backend!r}, expected one of {ATTENTION_BACKENDS}")
+    if backend == "flash" and not flash_backend_available():
+        raise ImportError("the flash attention backend needs CUDA, flash_attn and triton")
+    return backend
+
+
+if triton is not None:
+
+    @triton.jit
+    def store_kvcache_kernel(
+        key_ptr,
+        key_stride,
+        value_ptr,
+        value_stride,
+        k_cache_ptr,
+        v_cache_ptr,
+        slot_mapping_ptr,
+        D: tl.constexpr,
+    ):
+        BLOCK_SIZE: tl.constexpr = 2048
+        idx = tl.program_id(0)
+        slot = tl.load(slot_mapping_ptr + idx)
+        if slot == -1:
+            return
+        d_offset = 0
+        while d_offset < D:
+            cur_block_size = min(BLOCK_SIZE, D - d_offset)
+            key_offsets = idx * key_stride + d_offset + tl.arange(0, BLOCK_SIZE)
+            value_offsets = idx * value_stride + d_offset + tl.arange(0, BLOCK_SIZE)
+            cache_offsets = slot * D + d_offset + tl.arange(0, BLOCK_SIZE)
+
+            mask = tl.arange(0, BLOCK_SIZE) < cur_block_size
+            key = tl.load(key_ptr + key_offsets, mask=mask, other=0.0)
+            value = tl.load(value_ptr + value_offsets, mask=mask, other=0.0)
+            tl.store(k_cache_ptr + cache_offsets, key, mask=mask)
+            tl.store(v_cache_ptr + cache_offsets, value, mask=mask)
+
+            d_offset += BLOCK_SIZE
 
 
 def store_kvcache(
@@ -104,6 +137,96 @@ def store_kvcache(
     )
 
 
+def store_kvcache_torch(
+    key: torch.Tensor,
+    value: torch.Tensor,
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    slot_mapping: torch.Tensor,
+):
+    """Reference `store_kvcache`: scatter [N, H, D] keys/values into the paged cache, slot -1 is skipped."""
+    slots = slot_mapping.long()
+    valid = slots >= 0
+    if not bool(valid.all()):
+        slots, key, value = slots[valid], key[valid], value[valid]
+    num_heads, head_dim = k_cache.shape[-2:]
+    k_cache.view(-1, num_heads, head_dim).index_copy_(0, slots, key.to(k_cache.dtype))
+    v_cache.view(-1, num_heads, head_dim).index_copy_(0, slots, value.to(v_cache.dtype))
+
+
+def _gather_pages(cache: torch.Tensor, block_table: torch.Tensor, length: int):
+    """[num_blocks, block_size, H, D] pages of one sequence -> its first `length` tokens [length, H, D]."""
+    block_size = cache.size(1)
+    num_blocks = (length + block_size - 1) // block_size
+    pages = cache.index_select(0, block_table[:num_blocks].long())
+    return pages.reshape(-1, *cache.shape[2:])[:length]
+
+
+def varlen_attention_sdpa(q, k, v, cu_seqlens_q, cu_seqlens_k, scale, block_tables=None):
+    """
+    Reference `flash_attn_varlen_func(causal=True)`: causal attention of packed variable-length sequences.
+    The queries of each sequence are its last tokens, so query i attends to keys [0, k_len - q_len + i].
+
+    Args:
+        q: [total_q, H, D]
+        k, v: [total_k, H, D] packed keys/values, or the paged caches [num_blocks, block_size, H, D]
+            when `block_tables` is given
+        block_tables: [batch, max_blocks] block ids of every sequence, -1 padded
+    Returns:
+        [total_q, H, D]
+    """
+    cu_q = cu_seqlens_q.tolist()
+    cu_k = cu_seqlens_k.tolist()
+    outputs = []
+    for i in range(len(cu_q) - 1):
+        q_len, k_len = cu_q[i + 1] - cu_q[i], cu_k[i + 1] - cu_k[i]
+        if block_tables is not None:
+            keys = _gather_pages(k, block_tables[i], k_len)
+            values = _gather_pages(v, block_tables[i], k_len)
+        else:
+            keys, values = k[cu_k[i] : cu_k[i + 1]], v[cu_k[i] : cu_k[i + 1]]
+        query = q[cu_q[i] : cu_q[i + 1]]
+        # [L, H, D] -> [H, L, D]
+        query, keys, values = (
+            t.transpose(0, 1).to(q.dtype) for t in (query, keys, values)
+        )
+        q_pos = torch.arange(k_len - q_len, k_len, device=q.device)
+        mask = q_pos[:, None] >= torch.arange(k_len, device=q.device)[None, :]
+        o = F.scaled_dot_product_attention(query, keys, values, attn_mask=mask, scale=scale)
+        outputs.append(o.transpose(0, 1))
+    return torch.cat(outputs)
+
+
+def paged_decode_attention_sdpa(q, k_cache, v_cache, context_lens, block_tables, scale):
+    """
+    Reference `flash_attn_with_kvcache`: one query token per sequence over its paged KV.
+
+    Args:
+        q: [batch, H, D]
+        k_cache, v_cache: [num_blocks, block_size, H, D]
+        context_lens: [batch] number of cached tokens of every sequence, including the query token
+        block_tables: [batch, max_blocks] block ids, -1 padded
+    Returns:
+        [batch, H, D]
+    """
+    batch, max_blocks = block_tables.shape
+    block_size = k_cache.size(1)
+    table = block_tables.long().clamp(min=0)
+    # [batch, max_blocks * block_size, H, D] -> [batch, H, T, D]
+    keys = k_cache[table].reshape(batch, max_blocks * block_size, *k_cache.shape[2:]).transpose(1, 2)
+    values = v_cache[table].reshape(batch, max_blocks * block_size, *v_cache.shape[2:]).transpose(1, 2)
+    positions = torch.arange(max_blocks * block_size, device=q.device)
+    mask = positions[None, :] < context_lens.to(q.device).long()[:, None]
+    o = F.scaled_dot_product_attention(
+        q.unsqueeze(2),
+        keys.to(q.dtype),
+        values.to(q.dtype),
+        attn_mask=mask[:, None, None, :],
+        scale=scale,
+    )
+    return o.squeeze(2)
+
+
 class Attention(nn.Module):
     def __init__(
         self,
@@ -111,15 +234,20 @@ class Attention(nn.Module):
         head_dim: int,
         scale: float,
         num_kv_heads: int,
+        backend: str = "flash",
     ):
         super().__init__()
         self.num_heads = num_heads
         self.head_dim = head_dim
         self.scale = scale
         self.num_kv_heads = num_kv_heads
+        self.backend = backend
         self.k_cache = self.v_cache = torch.tensor([])
 
     def forward(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
+        if self.backend == "sdpa":
+            return self._forward_sdpa(q, k, v)
+
         context = get_forward_context()
         k_cache, v_cache = self.k_cache, self.v_cache
 
@@ -152,3 +280,26 @@ class Attention(nn.Module):
                 causal=True,
             )
         return o
+
+    def _forward_sdpa(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
+        context = get_forward_context()
+        k_cache, v_cache = self.k_cache, self.v_cache
+
+        if k_cache.numel() and v_cache.numel() and context.slot_mapping is not None:
+            store_kvcache_torch(k, v, k_cache, v_cache, context.slot_mapping)
+
+        if context.is_prefill:
+            if context.block_tables is not None:
+                k, v = k_cache, v_cache
+            return varlen_attention_sdpa(
+                q,
+                k,
+                v,
+                context.cu_seqlens_q,
+                context.cu_seqlens_k,
+                self.scale,
+                block_tables=context.block_tables,
+            )
+        return paged_decode_attention_sdpa(
+            q, k_cache, v_cache, context.context_lens, context.block_tables, self.scale
+        )
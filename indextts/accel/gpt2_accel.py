@@ -76,8 +76,8 @@ class GPT2AccelAttention(nn.Module):
         k_flat = key.transpose(1, 2).contiguous().view(-1, num_heads, head_dim)
         v_flat = value.transpose(1, 2).contiguous().view(-1, num_heads, head_dim)
 
-        # ensure fp16
-        if q_flat.device.type == "cuda" and q_flat.dtype != torch.float16:
+        # FlashAttention needs fp16
+        if self.accel_attn.backend == "flash" and q_flat.dtype != torch.float16:
             orig_dtype = q_flat.dtype
             q_flat = q_flat.to(torch.float16)
             k_flat = k_flat.to(torch.float16)
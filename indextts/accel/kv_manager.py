@@ -1,11 +1,14 @@
 import hashlib
-import pickle
-from collections import deque
+from array import array
+from collections import OrderedDict
 from copy import copy
 from typing import Dict, List, Optional, Set
 
 import torch
 
+# 128-bit digests: collisions are negligible, so a hash hit identifies the block content
+BLOCK_HASH_SIZE = 16
+
 
 class KVCacheBlock:
     def __init__(self, block_id: int):
@@ -29,7 +32,20 @@ class KVCacheBlock:
 
 
 class Seq:
-    def __init__(self, token_ids: List[int], block_size: int = 256):
+    def __init__(
+        self,
+        token_ids: List[int],
+        block_size: int = 256,
+        block_hashes: Optional[List[bytes]] = None,
+    ):
+        """
+        Args:
+            token_ids: prompt token ids (placeholders when the prompt is given as embeddings)
+            block_hashes: chained content hashes of the full prompt blocks, e.g. from
+                `KVCacheManager.compute_embedding_block_hashes()`, used instead of hashing `token_ids`.
+                When given, blocks filled during decoding are never shared, since their placeholder ids
+                do not identify their content.
+        """
         self.token_ids = copy(token_ids)
         self.last_token = token_ids[-1] if token_ids else 0
         self.num_tokens = len(self.token_ids)
@@ -37,6 +53,7 @@ class Seq:
         self.num_cached_tokens = 0
         self.block_table: List[int] = []
         self.block_size = block_size
+        self.block_hashes = block_hashes
 
     def __len__(self):
         return self.num_tokens
@@ -77,6 +94,7 @@ class KVCacheManager:
         block_size: int,
         num_blocks: int,
         dtype: torch.dtype,
+        device=None,
     ):
         self.num_layers = num_layers
         self.num_heads = num_heads
@@ -87,11 +105,16 @@ class KVCacheManager:
 
         self.blocks: List[KVCacheBlock] = [KVCacheBlock(i) for i in range(num_blocks)]
         self.block_hash_to_id: Dict[bytes, int] = {}
-        self.free_block_ids: deque = deque(range(num_blocks))
+        # ordered by release time: new blocks are taken from the front, so freed blocks keep their
+        # cached KV (and stay reusable through block_hash_to_id) for as long as possible
+        self.free_block_ids: OrderedDict = OrderedDict.fromkeys(range(num_blocks))
         self.used_block_ids: Set[int] = set()
 
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        cache_dtype = torch.float16 if device == "cuda" else dtype
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            cache_dtype = torch.float16 if device == "cuda" else dtype
+        else:
+            cache_dtype = dtype
         self.kv_cache = torch.empty(
             2,
             num_layers,
@@ -107,25 +130,82 @@ class KVCacheManager:
     def compute_block_hash(
         cls, token_ids: List[int], parent_hash: Optional[bytes] = None
     ) -> bytes:
-        hash_input = []
+        digest = hashlib.blake2b(digest_size=BLOCK_HASH_SIZE)
         if parent_hash is not None:
-            hash_input.append(parent_hash)
-        hash_input.extend(token_ids)
-        input_bytes = pickle.dumps(tuple(hash_input), protocol=pickle.HIGHEST_PROTOCOL)
-        return hashlib.sha256(input_bytes).digest()
+            digest.update(parent_hash)
+        digest.update(array("q", token_ids).tobytes())
+        return digest.digest()
+
+    @classmethod
+    def compute_embedding_block_hashes(
+        cls,
+        embeddings: torch.Tensor,
+        block_size: int,
+        parent_hash: Optional[bytes] = None,
+    ) -> List[bytes]:
+        """
+        Chained content hashes of the full blocks of a prompt given as embeddings.
+
+        Args:
+            embeddings: [seq_len, hidden_size] prompt embeddings, without padding
+            parent_hash: optional caller-supplied key mixed into the first block, e.g. a model version
+
+        Returns:
+            one hash per full block; the trailing partial block is never shared
+        """
+        num_full_blocks = embeddings.size(0) // block_size
+        if num_full_blocks == 0:
+            return []
+        # one device-to-host copy of the raw bytes of the full blocks
+        data = (
+            embeddings[: num_full_blocks * block_size]
+            .detach()
+            .contiguous()
+            .view(torch.uint8)
+            .reshape(num_full_blocks, -1)
+            .cpu()
+            .numpy()
+        )
+        header = f"{embeddings.dtype}:{embeddings.size(-1)}".encode()
+        hashes = []
+        for i in range(num_full_blocks):
+            digest = hashlib.blake2b(header, digest_size=BLOCK_HASH_SIZE)
+            if parent_hash is not None:
+                digest.update(parent_hash)
+            digest.update(data[i].tobytes())
+            parent_hash = digest.digest()
+            hashes.append(parent_hash)
+        return hashes
 
     def _allocate_block(self, block_id: int) -> KVCacheBlock:
         block = self.blocks[block_id]
         assert block.ref_cnt == 0
+        if (
+            block.block_hash is not None
+            and self.block_hash_to_id.get(block.block_hash) == block_id
+        ):
+            # the cached content is about to be overwritten
+            del self.block_hash_to_id[block.block_hash]
         block.reset()
-        self.free_block_ids.remove(block_id)
+        del self.free_block_ids[block_id]
         self.used_block_ids.add(block_id)
         return block
 
+    def _allocate_free_block(self) -> KVCacheBlock:
+        if not self.free_block_ids:
+            raise RuntimeError("KV cache is out of blocks")
+        return self._allocate_block(next(iter(self.free_block_ids)))
+
     def _deallocate_block(self, block_id: int):
         assert self.blocks[block_id].ref_cnt == 0
         self.used_block_ids.remove(block_id)
-        self.free_block_ids.append(block_id)
+        self.free_block_ids[block_id] = None
+
+    def _cached_block_id(self, block_hash: bytes) -> Optional[int]:
+        block_id = self.block_hash_to_id.get(block_hash)
+        if block_id is None or self.blocks[block_id].block_hash != block_hash:
+            return None
+        return block_id
 
     def allocate(self, sequence: Seq):
         assert not sequence.block_table, "Sequence already has allocated blocks"
@@ -135,40 +215,62 @@ class KVCacheManager:
 
         for i in range(sequence.num_blocks):
             token_ids = sequence.get_block_tokens(i)
-            block_hash = (
-                self.compute_block_hash(token_ids, parent_hash)
-                if len(token_ids) == self.block_size
-                else None
-            )
-            block_id = self.block_hash_to_id.get(block_hash) if block_hash else None
+            if len(token_ids) < self.block_size:
+                block_hash = None
+            elif sequence.block_hashes is not None:
+                block_hash = (
+                    sequence.block_hashes[i] if i < len(sequence.block_hashes) else None
+                )
+            else:
+                block_hash = self.compute_block_hash(token_ids, parent_hash)
 
-            if block_id is None or self.blocks[block_id].token_ids != token_ids:
+            # keep at least one token to prefill, it produces the logits of the first new token
+            reusable = (
+                block_hash is not None
+                and not cache_miss
+                and (i + 1) * self.block_size < sequence.num_tokens
+            )
+            block_id = self._cached_block_id(block_hash) if reusable else None
+            if block_id is None:
+                # everything after the first miss has to be recomputed
                 cache_miss = True
-
-            if cache_miss:
-                block_id = self.free_block_ids[0]
-                block = self._allocate_block(block_id)
+                block = self._allocate_free_block()
             else:
                 sequence.num_cached_tokens += self.block_size
-                if block_id is not None and block_id in self.used_block_ids:
-                    block = self.blocks[block_id]
+                block = self.blocks[block_id]
+                if block_id in self.used_block_ids:
                     block.ref_cnt += 1
                 else:
-                    block_id = self.free_block_ids[0]
-                    block = self._allocate_block(block_id)
+                    # released earlier but its KV is still intact
+                    self._allocate_block(block_id)
 
             if block_hash is not None:
                 block.update(block_hash, token_ids)
-                self.block_hash_to_id[block_hash] = block_id
+                self.block_hash_to_id[block_hash] = block.block_id
                 parent_hash = block_hash
 
-            sequence.block_table.append(block_id)
-
-    def deallocate(self, sequence: Seq):
-        for block_id in reversed(sequence.block_table):
+            sequence.block_table.append(block.block_id)
+
+    def deallocate(self, sequence: Seq, discard_uncached: bool = False):
+        """
+        Args:
+            discard_uncached: the blocks after `num_cached_tokens` were never written
+                (e.g. prefill failed), drop them from the block cache instead of keeping
+                them reusable
+        """
+        for idx in reversed(range(len(sequence.block_table))):
+            block_id = sequence.block_table[idx]
             block = self.blocks[block_id]
             block.ref_cnt -= 1
             if block.ref_cnt == 0:
+                if (
+                    discard_uncached
+                    and idx >= sequence.num_cached_blocks
+                    and block.block_hash is not None
+                ):
+                    if self.block_hash_to_id.get(block.block_hash) == block_id:
+                        del self.block_hash_to_id[block.block_hash]
+                    block.update(None, [])
                 self._deallocate_block(block_id)
 
         sequence.num_cached_tokens = 0
@@ -180,9 +282,7 @@ class KVCacheManager:
 
         if len(sequence) % self.block_size == 1:
             assert last_block.block_hash is not None
-            block_id = self.free_block_ids[0]
-            self._allocate_block(block_id)
-            block_table.append(block_id)
+            block_table.append(self._allocate_free_block().block_id)
         elif len(sequence) % self.block_size == 0:
             assert last_block.block_hash is None
             token_ids = sequence.get_block_tokens(sequence.num_blocks - 1)
@@ -193,10 +293,31 @@ class KVCacheManager:
             )
             block_hash = self.compute_block_hash(token_ids, parent_hash)
             last_block.update(block_hash, token_ids)
-            self.block_hash_to_id[block_hash] = last_block.block_id
+            if sequence.block_hashes is None:
+                self.block_hash_to_id[block_hash] = last_block.block_id
         else:
             assert last_block.block_hash is None
 
+    def load_prefix(self, sequence: Seq, prefix_kv: torch.Tensor):
+        """
+        Write precomputed KV of the first tokens of an allocated sequence into its blocks and mark them as
+        cached, so that prefill only runs the remaining tokens.
+
+        Args:
+            prefix_kv: [2, num_layers, prefix_len, num_heads, head_dim]
+        """
+        prefix_len = prefix_kv.size(2)
+        assert sequence.block_table, "Sequence has no allocated blocks"
+        assert prefix_len < len(sequence), "prefix must leave at least one token to prefill"
+        positions = torch.arange(prefix_len)
+        block_ids = torch.tensor(sequence.block_table, dtype=torch.long)[positions // self.block_size]
+        slots = (block_ids * self.block_size + positions % self.block_size).to(self.kv_cache.device)
+        kv_cache = self.kv_cache.view(
+            2, self.num_layers, self.num_blocks * self.block_size, self.num_heads, self.head_dim
+        )
+        kv_cache[:, :, slots] = prefix_kv.to(device=kv_cache.device, dtype=kv_cache.dtype)
+        sequence.num_cached_tokens = prefix_len
+
     def remove_seq(self, sequence: Seq):
         self.deallocate(sequence)
 
@@ -0,0 +1,267 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import List
+
+import torch
+import torch.nn.functional as F
+
+from indextts.utils.fused_sampling import process_logits
+
+
+class DecodeRequest:
+    """
+    A single GPT decode job submitted to `ContinuousBatchScheduler`.
+    """
+
+    def __init__(self, conds_latent, text_inputs, max_new_tokens, do_sample=True, temperature=1.0,
+                 top_k=0, top_p=1.0, repetition_penalty=1.0, return_latent=False):
+        self.conds_latent = conds_latent  # (1, 32 + 2, dim)
+        self.text_inputs = text_inputs  # (1, L)
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature if do_sample else 1.0
+        self.top_k = top_k or 0
+        self.top_p = top_p if top_p is not None else 1.0
+        self.repetition_penalty = repetition_penalty or 1.0
+        self.return_latent = return_latent
+        self.generated: List[int] = []
+        self.latents: List[torch.Tensor] = []  # (dim,) final_norm hidden state that predicted each token
+        self.future = Future()
+
+
+class ContinuousBatchScheduler:
+    """
+    Continuous-batching GPT decoder shared by concurrent callers.
+
+    Requests are admitted into a running decode batch between steps: each new request is prefilled on its own,
+    then its KV cache is left-padded (or the batch is) so that it can join the batch. All active sequences are then
+    advanced one token per step, and each one is retired as soon as it emits `stop_mel_token` or hits its
+    `max_new_tokens` budget, without waiting for the rest of the batch.
+
+    Only sampling / greedy decoding is supported, beam search (`num_beams > 1`) is not.
+    """
+
+    def __init__(self, gpt, max_batch_size=8, dtype=None):
+        """
+        Args:
+            gpt (UnifiedVoice): the GPT model, `post_init_gpt2_config()` must have been called.
+            max_batch_size (int): maximum number of sequences decoded together.
+            dtype (torch.dtype | None): autocast dtype used for the decode loop, e.g. `torch.float16`.
+        """
+        self.gpt = gpt
+        self.transformer = gpt.inference_model.transformer
+        self.final_norm = gpt.final_norm
+        self.mel_head = gpt.mel_head
+        self.max_batch_size = max_batch_size
+        self.dtype = dtype
+        self.stop_mel_token = gpt.stop_mel_token
+        self.start_mel_token = gpt.start_mel_token
+        self.num_mel_codes = gpt.number_mel_codes
+
+        self._pending: "queue.Queue[DecodeRequest]" = queue.Queue()
+        self._active: List[DecodeRequest] = []
+        self._past = None  # tuple of (k, v) per layer, each (B, H, T, D)
+        self._attention_mask = None  # (B, T)
+        self._seen = None  # (B, V) bool, tokens already emitted per sequence (for the repetition penalty)
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="gpt-continuous-batching", daemon=True)
+        self._thread.start()
+
+    @property
+    def device(self):
+        return self.gpt.mel_head.weight.device
+
+    def submit(self, conds_latent, text_inputs, max_new_tokens, **sampling_kwargs) -> Future:
+        """
+        Queue a request and return a `Future` resolving to the generated codes `(1, n)`, or to
+        `(codes, latent)` with the `(1, n, dim)` decode latents if `return_latent=True` is given.
+        The codes end with `stop_mel_token` unless `max_new_tokens` was exhausted.
+        """
+        assert conds_latent.shape[0] == 1 and text_inputs.shape[0] == 1, "submit one sequence at a time"
+        request = DecodeRequest(conds_latent, text_inputs, max_new_tokens, **sampling_kwargs)
+        self._pending.put(request)
+        return request.future
+
+    def generate(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None,
+                 emo_cond_lengths=None, emo_vec=None, max_generate_length=None, do_sample=True, top_p=0.8,
+                 top_k=30, temperature=1.0, repetition_penalty=10.0, return_latent=False, cond_latent=None,
+                 **kwargs):
+        """
+        Blocking counterpart of `UnifiedVoice.inference_speech()` that decodes through the shared batch.
+        Returns:
+            codes: (1, n) generated mel codes
+            speech_conditioning_latent: (1, 32, dim)
+            latent: (1, n, dim) decode latents, only if `return_latent`
+        """
+        conds_latent, speech_conditioning_latent = self.gpt.prepare_conds_latent(
+            speech_condition, text_inputs.size(0), emo_speech_condition,
+            cond_lengths=cond_lengths, emo_cond_lengths=emo_cond_lengths, emo_vec=emo_vec, cond_latent=cond_latent,
+        )
+        max_new_tokens = self.gpt.max_mel_tokens - 1 if max_generate_length is None else max_generate_length
+        future = self.submit(
+            conds_latent.detach(), text_inputs, max_new_tokens,
+            do_sample=do_sample, temperature=temperature, top_k=top_k, top_p=top_p,
+            repetition_penalty=repetition_penalty, return_latent=return_latent,
+        )
+        if return_latent:
+            codes, latent = future.result()
+            return codes, speech_conditioning_latent, latent
+        return future.result(), speech_conditioning_latent
+
+    def shutdown(self):
+        self._stopped.set()
+        self._pending.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        device_type = torch.device(self.device).type
+        with torch.no_grad(), torch.amp.autocast(device_type, enabled=self.dtype is not None, dtype=self.dtype):
+            while not self._stopped.is_set():
+                try:
+                    self._admit(block=not self._active)
+                    if self._active:
+                        self._step()
+                except Exception as e:
+                    for request in self._active:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    self._active = []
+                    self._past = self._attention_mask = self._seen = None
+
+    def _admit(self, block):
+        while len(self._active) < self.max_batch_size:
+            try:
+                request = self._pending.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+            if request is None:
+                return
+            try:
+                self._prefill(request)
+            except Exception as e:
+                request.future.set_exception(e)
+
+    def _prefill(self, request: DecodeRequest):
+        gpt = self.gpt
+        _, inputs_embeds, attention_mask = gpt.prepare_gpt_inputs(request.conds_latent, request.text_inputs)
+        start = torch.tensor([[self.start_mel_token]], device=inputs_embeds.device)
+        start_emb = gpt.mel_embedding(start) + gpt.mel_pos_embedding.emb(torch.zeros_like(start))
+        emb = torch.cat([inputs_embeds, start_emb.to(inputs_embeds.dtype)], dim=1)
+        prefix_kv = gpt.get_prefix_kv(request.conds_latent)
+        if prefix_kv is not None:
+            # 复用缓存的条件前缀 KV，只 prefill 文本部分
+            emb = emb[:, prefix_kv[0][0].shape[-2]:]
+        out = self.transformer(inputs_embeds=emb, past_key_values=prefix_kv, attention_mask=attention_mask,
+                               use_cache=True, return_dict=True)
+        hidden = self.final_norm(out.last_hidden_state[:, -1])
+
+        # match `inference_speech()`: its fake prompt ids (1s + start_mel_token) count as already seen
+        seen = torch.zeros((1, self.num_mel_codes), dtype=torch.bool, device=hidden.device)
+        seen[0, [1, self.start_mel_token]] = True
+        self._join(request, out.past_key_values, attention_mask, seen)
+        self._sample_and_retire(hidden, rows=[len(self._active) - 1])
+
+    def _join(self, request, past, attention_mask, seen):
+        """Append one prefilled sequence to the running batch, left-padding whichever side is shorter."""
+        if not self._active:
+            self._past, self._attention_mask, self._seen = past, attention_mask, seen
+            self._active.append(request)
+            return
+        new_len, cur_len = attention_mask.shape[1], self._attention_mask.shape[1]
+        if new_len < cur_len:
+            past = _left_pad_past(past, cur_len - new_len)
+            attention_mask = F.pad(attention_mask, (cur_len - new_len, 0), value=0)
+        elif new_len > cur_len:
+            self._past = _left_pad_past(self._past, new_len - cur_len)
+            self._attention_mask = F.pad(self._attention_mask, (new_len - cur_len, 0), value=0)
+        self._past = tuple(
+            (torch.cat([k, nk], dim=0), torch.cat([v, nv], dim=0)) for (k, v), (nk, nv) in zip(self._past, past)
+        )
+        self._attention_mask = torch.cat([self._attention_mask, attention_mask], dim=0)
+        self._seen = torch.cat([self._seen, seen], dim=0)
+        self._active.append(request)
+
+    def _step(self):
+        gpt = self.gpt
+        device = self._attention_mask.device
+        last_tokens = torch.tensor([r.generated[-1] for r in self._active], device=device)
+        # mel positions are per sequence, matching `GPT2InferenceModel.forward()`: the start_mel_token sits at 0,
+        # the k-th generated code at k + 1
+        positions = torch.tensor([len(r.generated) + 1 for r in self._active], device=device)
+        emb = gpt.mel_embedding(last_tokens) + gpt.mel_pos_embedding.emb(positions)
+        self._attention_mask = F.pad(self._attention_mask, (0, 1), value=1)
+        out = self.transformer(
+            inputs_embeds=emb.unsqueeze(1),
+            past_key_values=self._past,
+            attention_mask=self._attention_mask,
+            use_cache=True,
+            return_dict=True,
+        )
+        self._past = out.past_key_values
+        hidden = self.final_norm(out.last_hidden_state[:, -1])
+        self._sample_and_retire(hidden, rows=list(range(len(self._active))))
+
+    def _sample_and_retire(self, hidden, rows):
+        requests = [self._active[i] for i in rows]
+        next_tokens = self._sample(self.mel_head(hidden), requests, self._seen[rows])
+        self._seen[torch.tensor(rows, device=self._seen.device), next_tokens] = True
+        finished = []
+        for i, (row, request, token) in enumerate(zip(rows, requests, next_tokens.tolist())):
+            request.generated.append(token)
+            if request.return_latent:
+                request.latents.append(hidden[i])
+            if token == self.stop_mel_token or len(request.generated) >= request.max_new_tokens:
+                finished.append(row)
+        if finished:
+            self._retire(finished)
+
+    def _sample(self, logits, requests, seen):
+        device = logits.device
+        # top-k / top-p sort the vocabulary, skip them when no request uses them
+        top_k = top_p = None
+        if any(r.top_k > 0 for r in requests):
+            top_k = torch.tensor([r.top_k for r in requests], device=device)
+        if any(r.top_p < 1.0 for r in requests):
+            top_p = torch.tensor([r.top_p for r in requests], device=device)
+        logits = process_logits(
+            logits.float(),
+            seen=seen,
+            repetition_penalty=torch.tensor([r.repetition_penalty for r in requests], device=device),
+            temperature=torch.tensor([r.temperature for r in requests], device=device),
+            top_k=top_k,
+            top_p=top_p,
+        )
+        do_sample = torch.tensor([r.do_sample for r in requests], device=device)
+        sampled = torch.multinomial(logits.softmax(dim=-1), num_samples=1).squeeze(1)
+        return torch.where(do_sample, sampled, logits.argmax(dim=-1))
+
+    def _retire(self, rows):
+        keep = [i for i in range(len(self._active)) if i not in rows]
+        for i in rows:
+            request = self._active[i]
+            codes = torch.tensor([request.generated], dtype=torch.long, device=self._attention_mask.device)
+            if request.return_latent:
+                request.future.set_result((codes, torch.stack(request.latents).unsqueeze(0)))
+            else:
+                request.future.set_result(codes)
+        if not keep:
+            self._active = []
+            self._past = self._attention_mask = self._seen = None
+            return
+        index = torch.tensor(keep, device=self._attention_mask.device)
+        self._active = [self._active[i] for i in keep]
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._seen = self._seen.index_select(0, index)
+        # drop left padding columns that no remaining sequence needs any more
+        offset = int((self._attention_mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+        self._attention_mask = self._attention_mask[:, offset:]
+        self._past = tuple(
+            (k.index_select(0, index)[:, :, offset:], v.index_select(0, index)[:, :, offset:]) for k, v in self._past
+        )
+
+
+def _left_pad_past(past, pad):
+    return tuple((F.pad(k, (0, 0, pad, 0)), F.pad(v, (0, 0, pad, 0))) for k, v in past)
@@ -1,4 +1,5 @@
 import functools
+import hashlib
 
 import torch
 import torch.nn as nn
@@ -16,6 +17,8 @@ from transformers.utils.model_parallel_utils import (assert_device_map,
 from indextts.gpt.conformer_encoder import ConformerEncoder
 from indextts.gpt.perceiver import PerceiverResampler
 from indextts.utils.arch_util import AttentionBlock
+from indextts.utils.cond_cache import ConditioningCache
+from indextts.utils.fused_sampling import FusedLogitsProcessor
 from indextts.utils.typical_sampling import TypicalLogitsWarper
 
 
@@ -57,6 +60,11 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.model_parallel = False
         self.device_map = None
         self.cached_mel_emb = None
+        # 条件前缀 `[cond latents + emovec][duration embs]` 的 KV，见 UnifiedVoice.get_prefix_kv()
+        self.cached_prefix_kv = None
+        # 生成时逐步记录 final_norm 后的隐状态，供 inference_speech(return_latent=True) 复用
+        self.capture_latents = False
+        self.captured_latents = []
 
     def parallelize(self, device_map=None):
         self.device_map = (
@@ -87,6 +95,13 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
     def store_mel_emb(self, mel_emb):
         self.cached_mel_emb = mel_emb
 
+    def store_prefix_kv(self, prefix_kv):
+        """
+        KV of the leading conditioning prefix of `cached_mel_emb`, tuple of (k, v) per layer, each
+        (1, heads, prefix_len, head_dim). The prefill then only runs the tokens after the prefix.
+        """
+        self.cached_prefix_kv = prefix_kv
+
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
         token_type_ids = kwargs.get("token_type_ids", None)  # usually None
         if not self.kv_cache:
@@ -142,6 +157,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         )
         # Create embedding
         mel_len = self.cached_mel_emb.shape[1]
+        prefix_len = 0
         if input_ids.shape[1] != 1:
             text_inputs = input_ids[:, mel_len:]
             text_emb = self.embeddings(text_inputs)
@@ -153,6 +169,18 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             else:  # this outcome only occurs once per loop in most cases
                 mel_emb = self.cached_mel_emb
             emb = torch.cat([mel_emb, text_emb], dim=1)
+            if self.cached_prefix_kv is not None and past_key_values is None:
+                # 条件前缀的 KV 已缓存：从缓存开始，只 prefill 前缀之后的 token
+                prefix_len = self.cached_prefix_kv[0][0].shape[-2]
+                emb = emb[:, prefix_len:]
+                past_key_values = tuple(
+                    (k.expand(emb.shape[0], -1, -1, -1), v.expand(emb.shape[0], -1, -1, -1))
+                    for k, v in self.cached_prefix_kv
+                )
+                if position_ids is not None:
+                    position_ids = position_ids[:, prefix_len:]
+                if token_type_ids is not None:
+                    token_type_ids = token_type_ids[:, prefix_len:]
         else:
             emb = self.embeddings(input_ids)
             emb = emb + self.text_pos_embedding.get_fixed_embedding(
@@ -173,6 +201,11 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             return_dict=return_dict,
         )
         hidden_states = transformer_outputs[0]
+        if self.capture_latents:
+            # prefill: positions of start_mel_token (and input_tokens); decode: the newly fed token
+            self.captured_latents.append(
+                self.final_norm(hidden_states[:, mel_len - prefix_len:] if input_ids.shape[1] != 1 else hidden_states)
+            )
 
         # Set device for model parallelism
         if self.model_parallel:
@@ -411,8 +444,23 @@ class UnifiedVoice(nn.Module):
 
         self.use_accel = use_accel
         self.accel_engine = None  # Will be initialized in post_init_gpt2_config
+        self.prefix_cache = None  # conditioning prefix KV cache, see post_init_gpt2_config
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, prefix_cache_max_bytes=0,
+                              accel_backend=None, accel_num_blocks=32, accel_max_graph_batch_size=8):
+        """
+        Args:
+            accel_backend (str | None): attention of the acceleration engine (`use_accel`), "flash" or "sdpa"
+                (pure PyTorch paged attention, also on CPU); None picks "flash" when CUDA and flash_attn are
+                available.
+            accel_num_blocks (int): KV cache blocks of the acceleration engine, 256 tokens each. A sequence of a
+                long text with 1500 mel codes takes 7 to 9 blocks; every block costs
+                2 * layers * 256 * model_dim * 2 bytes (30 MiB for the v2 GPT in fp16).
+            accel_max_graph_batch_size (int): largest decode batch of the acceleration engine replayed from a
+                CUDA graph, larger batches run eagerly.
+            prefix_cache_max_bytes (int): byte budget of the LRU cache of conditioning prefix KV (see
+                `get_prefix_kv()`), <= 0 to disable it. Not used with DeepSpeed, whose kernels own the KV layout.
+        """
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
@@ -425,23 +473,23 @@ class UnifiedVoice(nn.Module):
             use_cache=True,
         )
 
-        if self.use_accel and torch.cuda.is_available():
-            # Check if flash attention is available
-            try:
-                import flash_attn
-            except ImportError:
-                raise ImportError("flash_attn is required for acceleration but not installed. Please install from https://github.com/Dao-AILab/flash-attention/releases/")
+        if self.use_accel:
+            from indextts.accel import GPT2AccelModel, AccelInferenceEngine, resolve_attention_backend
 
-            from indextts.accel import GPT2AccelModel, AccelInferenceEngine
+            device = self.mel_head.weight.device
+            # "flash" on CUDA with flash_attn installed, otherwise the pure PyTorch "sdpa" paged attention
+            accel_backend = resolve_attention_backend(accel_backend, device)
+            if accel_backend != "flash" and device.type == "cuda":
+                print(">> flash_attn not available, the acceleration engine uses the slower sdpa attention. "
+                      "Install it from https://github.com/Dao-AILab/flash-attention/releases/")
 
             # Create accel model
             accel_gpt = GPT2AccelModel(gpt_config)
             accel_gpt.load_state_dict(self.gpt.state_dict(), strict=False)
 
             if half:
-                accel_gpt = accel_gpt.half().cuda()
-            else:
-                accel_gpt = accel_gpt.cuda()
+                accel_gpt = accel_gpt.half()
+            accel_gpt = accel_gpt.to(device)
             accel_gpt.eval()
 
             lm_head_with_norm = nn.Sequential(self.final_norm, self.mel_head)
@@ -452,10 +500,12 @@ class UnifiedVoice(nn.Module):
                 num_heads=self.heads,
                 head_dim=self.model_dim // self.heads,
                 block_size=256,
-                num_blocks=16,  # Reduce to save memory (16*256 = 4096 tokens capacity)
+                num_blocks=accel_num_blocks,
                 use_cuda_graph=True,
+                attention_backend=accel_backend,
+                max_graph_batch_size=accel_max_graph_batch_size,
             )
-            print("acceleration engine initialized")
+            print(f"acceleration engine initialized ({accel_backend} attention)")
         self.inference_model = GPT2InferenceModel(
             gpt_config,
             self.gpt,
@@ -481,6 +531,10 @@ class UnifiedVoice(nn.Module):
             self.inference_model = self.ds_engine.module.eval()
         else:
             self.inference_model = self.inference_model.eval()
+        if prefix_cache_max_bytes > 0 and not (use_deepspeed and torch.cuda.is_available()):
+            self.prefix_cache = ConditioningCache(max_bytes=prefix_cache_max_bytes)
+        else:
+            self.prefix_cache = None
 
         # self.inference_model = PrunedGPT2InferenceModel(gpt_config, self.gpt, self.mel_pos_embedding, self.mel_embedding, self.final_norm, self.mel_head)
         self.gpt.wte = self.mel_embedding
@@ -634,6 +688,7 @@ class UnifiedVoice(nn.Module):
         self,
         conditional_latents: torch.Tensor,
         text_inputs: torch.Tensor,
+        prefix_first: bool = False,
     ):
         
         """
@@ -641,6 +696,9 @@ class UnifiedVoice(nn.Module):
         Args:
             conds_latent: (b, 32, dim) audio conditioning embedding by `get_conditioning()`
             text_inputs: (b, L)
+            prefix_first: put the padding of shorter texts between the conditioning and the text,
+                `[cond][pad][text]`, so that every row starts with the same prefix and can reuse its cached KV.
+                The padding is masked out, so the attention result is the same as with `[pad][cond][text]`.
         Returns:
             input_ids: (b, s+1) the input ids for the GPT2InferenceModel.generate()
             inputs_embeds: (b, s+1, dim) the input embeddings for the GPT2InferenceModel.forward()
@@ -673,8 +731,14 @@ class UnifiedVoice(nn.Module):
             # pad left of [cond][text] -> [pad][cond][text]
             if padding > 0:
                 pad = torch.zeros((padding, conditional_latents.size(-1)), dtype=text_emb.dtype, device=device) # [p, dim]
-                conds_text_emb.insert(0, pad)
-                attention_mask[:padding] = 0
+                if prefix_first:
+                    # [cond][text] -> [cond][pad][text]
+                    cond_len = conditional_latents.shape[1]
+                    conds_text_emb.insert(1, pad)
+                    attention_mask[cond_len:cond_len + padding] = 0
+                else:
+                    conds_text_emb.insert(0, pad)
+                    attention_mask[:padding] = 0
             mel_emb = torch.cat(conds_text_emb) #[s, dim]
             assert mel_emb.shape[0] == target_len, f"mel_emb.shape: {mel_emb.shape}, target_len: {target_len}"
             batched_mel_emb.append(mel_emb)
@@ -695,18 +759,18 @@ class UnifiedVoice(nn.Module):
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
 
-    def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+    def prepare_conds_latent(self, speech_condition, batch_size, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, cond_latent=None):
         """
+        Build the `[cond latents + emovec][duration embs]` prefix that precedes the text tokens.
         Args:
             speech_condition: (b, d, frames) or (d, frames)
-            text_inputs: (b, L)
-            cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
-            input_tokens: additional tokens for generation in shape (b, s) or (s,)
-            max_generate_length: limit the number of generated tokens
-            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
+            batch_size: number of text sequences the prefix is built for
+            cond_latent: precomputed `get_conditioning()` output (b, 32, dim), e.g. from a voice pack
+        Returns:
+            conds_latent: (b, 32 + 2, dim) the conditioning prefix for `prepare_gpt_inputs()`, b is 1 for a single
+                speech condition
+            speech_conditioning_latent: (b, 32, dim) output of `get_conditioning()`
         """
-
         if speech_condition.ndim == 2:
             speech_condition = speech_condition.unsqueeze(0)
         if emo_speech_condition is None:
@@ -716,7 +780,10 @@ class UnifiedVoice(nn.Module):
         if emo_cond_lengths is None:
             emo_cond_lengths = torch.tensor([emo_speech_condition.shape[-1]], device=speech_condition.device) 
 
-        speech_conditioning_latent = self.get_conditioning(speech_condition.transpose(1,2), cond_lengths)
+        if cond_latent is None:
+            speech_conditioning_latent = self.get_conditioning(speech_condition.transpose(1,2), cond_lengths)
+        else:
+            speech_conditioning_latent = cond_latent
         if emo_vec is None:
             print('compute emo vec')
             emo_vec = self.get_emo_conditioning(emo_speech_condition.transpose(1,2), emo_cond_lengths)
@@ -725,11 +792,73 @@ class UnifiedVoice(nn.Module):
         else:
             print('Use the specified emotion vector')
 
-        tmp = torch.zeros(text_inputs.size(0)).to(text_inputs.device)
+        if speech_conditioning_latent.shape[0] == 1:
+            # a single speaker prefix is shared by every text row in `prepare_gpt_inputs()`
+            batch_size = 1
+        tmp = torch.zeros(batch_size).to(speech_condition.device)
         duration_emb =  self.speed_emb(torch.zeros_like(tmp).long())
         duration_emb_half = self.speed_emb(torch.ones_like(tmp).long())
         conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
-        input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
+        return conds_latent, speech_conditioning_latent
+
+    @staticmethod
+    def prefix_cache_key(conds_latent):
+        """
+        Content hash of a conditioning prefix, which covers the speaker latents, the emovec and the duration
+        embeddings, so that every segment and request with the same voice and emotion shares one entry.
+        """
+        data = conds_latent.detach().float().cpu().numpy().tobytes()
+        return tuple(conds_latent.shape), str(conds_latent.dtype), hashlib.sha1(data).hexdigest()
+
+    def get_prefix_kv(self, conds_latent):
+        """
+        Transformer KV of the `[cond latents + emovec][duration embs]` prefix, computed once and reused from
+        `self.prefix_cache`. Causal attention makes it independent of the text that follows.
+        Args:
+            conds_latent: (1, 32 + 2, dim) output of `prepare_conds_latent()`
+        Returns:
+            tuple of (k, v) per layer, each (1, heads, 32 + 2, head_dim), or None if the prefix cache is disabled
+            or the prefix differs per row
+        """
+        if self.prefix_cache is None or conds_latent.shape[0] != 1:
+            return None
+        key = self.prefix_cache_key(conds_latent)
+        prefix_kv = self.prefix_cache.get(key)
+        if prefix_kv is None:
+            with torch.no_grad():
+                out = self.inference_model.transformer(inputs_embeds=conds_latent, use_cache=True, return_dict=True)
+            prefix_kv = tuple((k.detach(), v.detach()) for k, v in out.past_key_values)
+            self.prefix_cache.put(key, prefix_kv)
+        return prefix_kv
+
+    def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, return_latent=False, cond_latent=None, **hf_generate_kwargs):
+        """
+        Args:
+            speech_condition: (b, d, frames) or (d, frames)
+            text_inputs: (b, L)
+            cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
+            input_tokens: additional tokens for generation in shape (b, s) or (s,)
+            max_generate_length: limit the number of generated tokens
+            return_latent: also return the final-layer latents captured while decoding, (b, n, dim) aligned with
+                the returned codes, so that the extra `forward()` pass over the generated codes can be skipped.
+                They are the hidden states the decoder actually attended to, which differ slightly from the
+                `forward()` latents because incremental decoding offsets the mel positions by one.
+            cond_latent: precomputed `get_conditioning()` output, skips the conditioning encoder
+            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
+        """
+
+        conds_latent, speech_conditioning_latent = self.prepare_conds_latent(
+            speech_condition, text_inputs.size(0), emo_speech_condition,
+            cond_lengths=cond_lengths, emo_cond_lengths=emo_cond_lengths, emo_vec=emo_vec, cond_latent=cond_latent,
+        )
+        # the accel engine starts decoding at start_mel_token, extra input_tokens go through HF generate()
+        use_accel = self.accel_engine is not None and input_tokens is None
+        prefix_kv = self.get_prefix_kv(conds_latent)
+        # the accel engine strips the left padding of every row itself
+        input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(
+            conds_latent, text_inputs, prefix_first=prefix_kv is not None and not use_accel,
+        )
         self.inference_model.store_mel_emb(inputs_embeds)
         if input_tokens is None:
             inputs = input_ids
@@ -757,31 +886,89 @@ class UnifiedVoice(nn.Module):
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
         
-        # Use accel engine if available (single sequence only)
-        if self.accel_engine is not None and num_return_sequences == 1:
+        # Use accel engine if available (sampling / greedy only, num_beams is ignored)
+        if use_accel:
+            do_sample = hf_generate_kwargs.get('do_sample', True)
             output = self.accel_engine.generate(
                 inputs,  # fake input_ids (all 1s + start_mel_token)
                 max_new_tokens=max_length - trunc_index,
                 attention_mask=attention_mask,
-                temperature=hf_generate_kwargs.get('temperature', 1),
+                temperature=hf_generate_kwargs.get('temperature', 1) if do_sample else 0,
+                top_k=hf_generate_kwargs.get('top_k', 0),
+                top_p=hf_generate_kwargs.get('top_p', 1.0),
+                repetition_penalty=hf_generate_kwargs.get('repetition_penalty', 1.0),
                 stop_tokens=[self.stop_mel_token],
                 tts_embeddings=inputs_embeds,  # [pad][cond][text] embeddings (87 tokens, NO start_mel_token)
                 tts_mel_embedding=self.inference_model.embeddings,  # mel_embedding layer
                 tts_text_pos_embedding=self.inference_model.text_pos_embedding,  # text_pos_embedding layer
+                return_hidden_states=return_latent,
+                prefix_kv=prefix_kv,
+                num_return_sequences=num_return_sequences,
             )
+            if return_latent:
+                output, hidden_states = output
+                codes = output[:, trunc_index:]
+                latent = self.final_norm(hidden_states)[:, :codes.shape[1]]
+                return codes, speech_conditioning_latent, latent
         else:
-            output = self.inference_model.generate(inputs, 
-                                                bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
-                                                eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
-                                                max_length=max_length, logits_processor=logits_processor,
-                                                num_return_sequences=num_return_sequences,
-                                                **hf_generate_kwargs)
+            if return_latent:
+                self.inference_model.capture_latents = True
+                self.inference_model.captured_latents = []
+                if hf_generate_kwargs.get("num_beams", 1) > 1:
+                    # beam_indices are needed to follow each returned beam back through the captured steps
+                    hf_generate_kwargs.update(return_dict_in_generate=True, output_scores=True)
+            # group / constrained beam search reorder rows without telling the processors
+            plain_search = (hf_generate_kwargs.get("num_beam_groups") or 1) <= 1 and not (
+                hf_generate_kwargs.get("constraints") or hf_generate_kwargs.get("force_words_ids"))
+            if plain_search and not typical_sampling:
+                # penalty / temperature / top-k / top-p in one pass over the vocabulary instead of four processors
+                logits_processor.append(FusedLogitsProcessor.from_generate_kwargs(
+                    hf_generate_kwargs, self.inference_model.generation_config))
+            self.inference_model.store_prefix_kv(prefix_kv)
+            try:
+                output = self.inference_model.generate(inputs,
+                                                    bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
+                                                    eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
+                                                    max_length=max_length, logits_processor=logits_processor,
+                                                    num_return_sequences=num_return_sequences,
+                                                    **hf_generate_kwargs)
+            finally:
+                self.inference_model.store_prefix_kv(None)
+                captured_latents = self.inference_model.captured_latents
+                self.inference_model.capture_latents = False
+                self.inference_model.captured_latents = []
+            if return_latent:
+                sequences = output if isinstance(output, torch.Tensor) else output.sequences
+                codes = sequences[:, trunc_index:]
+                beam_indices = None if isinstance(output, torch.Tensor) else getattr(output, "beam_indices", None)
+                # the last prefill position (start_mel_token or the last input token) predicts the first code
+                latent = self.gather_captured_latents(captured_latents, trunc_index - inputs_embeds.shape[1] - 1,
+                                                      beam_indices=beam_indices)
+                return codes, speech_conditioning_latent, latent[:, :codes.shape[1]]
         if isinstance(output, torch.Tensor):
             return output[:, trunc_index:], speech_conditioning_latent
         # GenerateOutput
         output.sequences = output.sequences[:, trunc_index:]
         return output, speech_conditioning_latent
 
+    @staticmethod
+    def gather_captured_latents(captured_latents, offset, beam_indices=None):
+        """
+        Assemble the latents recorded by `GPT2InferenceModel` during `generate()`.
+        Args:
+            captured_latents: list of (b * num_beams, s, dim), one entry per forward call
+            offset: index of the captured position that predicted the first generated token
+            beam_indices: (b, n) from beam search, -1 padded; row of the beam each token was chosen from
+        Returns:
+            latent: (b, n, dim), latent[:, i] is the hidden state that predicted the i-th generated token
+        """
+        latent = torch.cat(captured_latents, dim=1)[:, offset:]
+        if beam_indices is None:
+            return latent
+        beam_indices = beam_indices[:, :latent.shape[1]].clamp(min=0).to(latent.device)
+        steps = torch.arange(beam_indices.shape[1], device=latent.device)
+        return latent[beam_indices, steps]
+
     def get_emovec(self, emo_speech_conditioning_latent, emo_cond_lengths):
         emo_vec_syn_ori = self.get_emo_conditioning(emo_speech_conditioning_latent.transpose(1,2), emo_cond_lengths)
         emo_vec_syn = self.emovec_layer(emo_vec_syn_ori)
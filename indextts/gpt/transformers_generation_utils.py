@@ -3543,6 +3543,10 @@ class GenerationMixin:
             beam_idx = beam_outputs["next_beam_indices"]
 
             input_ids = torch.cat([input_ids[beam_idx, :], beam_next_tokens.unsqueeze(-1)], dim=-1)
+            # stateful processors (e.g. the seen-token bitmap of FusedLogitsProcessor) follow the beams
+            for processor in logits_processor:
+                if hasattr(processor, "reorder_beams"):
+                    processor.reorder_beams(beam_idx)
 
             # This is needed to properly delete outputs.logits which may be very large for first iteration
             # Otherwise a reference to outputs is kept which keeps the logits alive in the next iteration
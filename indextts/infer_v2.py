@@ -3,54 +3,82 @@ from subprocess import CalledProcessError
 
 os.environ['HF_HUB_CACHE'] = './checkpoints/hf_cache'
 import json
+import math
 import re
+import threading
 import time
-import librosa
+from collections import OrderedDict
+from contextlib import contextmanager
 import torch
-import torchaudio
 from torch.nn.utils.rnn import pad_sequence
+from typing import Dict, List
 
 import warnings
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
-from omegaconf import OmegaConf
+from indextts.gpt.continuous_batching import ContinuousBatchScheduler
+from indextts.utils.cond_cache import ConditioningCache, audio_content_key
+from indextts.utils.pipeline import StagePipeline
+from indextts.utils.mel_codes import remove_long_silence, stop_token_lengths
+from indextts.utils.voice_pack import (EMO_TENSORS, SPK_TENSORS, VOICE_PACK_SUFFIX, is_voice_pack, load_voice_pack,
+                                       read_voice_pack_metadata, save_voice_pack)
 
-from indextts.gpt.model_v2 import UnifiedVoice
-from indextts.utils.maskgct_utils import build_semantic_model, build_semantic_codec
-from indextts.utils.checkpoint import load_checkpoint
-from indextts.utils.front import TextNormalizer, TextTokenizer
-
-from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
-from indextts.s2mel.modules.bigvgan import bigvgan
-from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
-from indextts.s2mel.modules.audio import mel_spectrogram
-
-from transformers import AutoTokenizer
-from modelscope import AutoModelForCausalLM
-from huggingface_hub import hf_hub_download
-import safetensors
-from transformers import SeamlessM4TFeatureExtractor
 import random
 import torch.nn.functional as F
 
+# transformers、modelscope、librosa、torchaudio、omegaconf、s2mel / BigVGAN 等重量级依赖在创建模型或首次使用时才导入，
+# 使 `import indextts.infer_v2`（以及服务入口的健康检查、CLI 参数校验）能够快速完成，见 tests/import_time_test.py
+
 class IndexTTS2:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=False, device=None,
-            use_cuda_kernel=None,use_deepspeed=False, use_accel=False, use_torch_compile=False
+            use_cuda_kernel=None,use_deepspeed=False, use_accel=False, use_torch_compile=False,
+            cond_cache_max_bytes=512 * 1024 ** 2, text_workers=0, use_qwen_emo=True, qwen_emo_idle_unload=None,
+            qwen_emo_cache_path=None, parallel_load=True, gpt_prefix_cache_max_bytes=256 * 1024 ** 2,
+            accel_backend=None, accel_num_blocks=32, accel_max_graph_batch_size=8
     ):
         """
         Args:
             cfg_path (str): path to the config file.
-            model_dir (str): path to the model directory.
+            model_dir (str): path to the model directory, or to a bundle exported by `tools/export_bundle.py`.
             use_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
             use_deepspeed (bool): whether to use DeepSpeed or not.
             use_accel (bool): whether to use acceleration engine for GPT2 or not.
+            accel_backend (str | None): attention of the acceleration engine, "flash" (CUDA + flash_attn) or "sdpa"
+                (pure PyTorch, also on CPU); None picks "flash" when available.
+            accel_num_blocks (int): KV cache blocks of the acceleration engine, 256 tokens each (30 MiB each in fp16),
+                about 4 concurrent long sequences with the default 32.
+            accel_max_graph_batch_size (int): largest decode batch of the acceleration engine replayed from a CUDA graph.
             use_torch_compile (bool): whether to use torch.compile for optimization or not.
+            cond_cache_max_bytes (int): byte budget of the speaker/emotion conditioning LRU cache, <= 0 to disable it.
+            text_workers (int | None): number of processes used to normalize long texts in parallel, None for one per
+                CPU core, <= 1 to normalize in-process.
+            use_qwen_emo (bool): whether the QwenEmotion model for `use_emo_text` is available. It is loaded on first use.
+            qwen_emo_idle_unload (float | None): unload QwenEmotion after this many idle seconds, None to keep it loaded.
+            qwen_emo_cache_path (str | None): JSON file persisting the emotion-text results of QwenEmotion.
+            parallel_load (bool): load the independent model components concurrently in a thread pool.
+            gpt_prefix_cache_max_bytes (int): byte budget of the GPT KV cache of the speaker/emotion conditioning
+                prefix, shared by all segments and requests with the same voice and emotion; <= 0 to disable it.
         """
+        import safetensors.torch
+        from huggingface_hub import hf_hub_download
+        from omegaconf import OmegaConf
+        from transformers import SeamlessM4TFeatureExtractor
+
+        from indextts.gpt.model_v2 import UnifiedVoice
+        from indextts.s2mel.modules.audio import mel_spectrogram
+        from indextts.s2mel.modules.bigvgan import bigvgan
+        from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
+        from indextts.s2mel.modules.commons import MyModel, load_checkpoint2
+        from indextts.utils.bundle import bundle_loaders, is_bundle
+        from indextts.utils.checkpoint import load_checkpoint, load_components, load_state
+        from indextts.utils.front import ParallelTextTokenizer, TextNormalizer, TextTokenizer
+        from indextts.utils.maskgct_utils import build_semantic_codec, build_semantic_model
+
         if device is not None:
             self.device = device
             self.use_fp16 = False if device == "cpu" else use_fp16
@@ -80,17 +108,11 @@ class IndexTTS2:
         self.use_accel = use_accel
         self.use_torch_compile = use_torch_compile
 
-        self.qwen_emo = QwenEmotion(os.path.join(self.model_dir, self.cfg.qwen_emo_path))
-
-        self.gpt = UnifiedVoice(**self.cfg.gpt, use_accel=self.use_accel)
-        self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
-        load_checkpoint(self.gpt, self.gpt_path)
-        self.gpt = self.gpt.to(self.device)
-        if self.use_fp16:
-            self.gpt.eval().half()
-        else:
-            self.gpt.eval()
-        print(">> GPT weights restored from:", self.gpt_path)
+        # 情感文本模型仅在 use_emo_text 时使用，首次使用时才加载
+        self.qwen_emo = QwenEmotion(
+            os.path.join(self.model_dir, self.cfg.qwen_emo_path), idle_unload_seconds=qwen_emo_idle_unload,
+            cache_path=qwen_emo_cache_path
+        ) if use_qwen_emo else None
 
         if use_deepspeed:
             try:
@@ -99,8 +121,6 @@ class IndexTTS2:
                 use_deepspeed = False
                 print(f">> Failed to load DeepSpeed. Falling back to normal inference. Error: {e}")
 
-        self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16)
-
         if self.use_cuda_kernel:
             # preload the CUDA kernel for BigVGAN
             try:
@@ -112,82 +132,128 @@ class IndexTTS2:
                 print(f"{e!r}")
                 self.use_cuda_kernel = False
 
-        self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
-        self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(
-            os.path.join(self.model_dir, self.cfg.w2v_stat))
-        self.semantic_model = self.semantic_model.to(self.device)
-        self.semantic_model.eval()
-        self.semantic_mean = self.semantic_mean.to(self.device)
-        self.semantic_std = self.semantic_std.to(self.device)
-
-        semantic_codec = build_semantic_codec(self.cfg.semantic_codec)
-        semantic_code_ckpt = hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")
-        safetensors.torch.load_model(semantic_codec, semantic_code_ckpt)
-        self.semantic_codec = semantic_codec.to(self.device)
-        self.semantic_codec.eval()
-        print('>> semantic_codec weights restored from: {}'.format(semantic_code_ckpt))
-
-        s2mel_path = os.path.join(self.model_dir, self.cfg.s2mel_checkpoint)
-        s2mel = MyModel(self.cfg.s2mel, use_gpt_latent=True)
-        s2mel, _, _, _ = load_checkpoint2(
-            s2mel,
-            None,
-            s2mel_path,
-            load_only_params=True,
-            ignore_modules=[],
-            is_distributed=False,
-        )
-        self.s2mel = s2mel.to(self.device)
-        self.s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
-        
-        # Enable torch.compile optimization if requested
-        if self.use_torch_compile:
-            print(">> Enabling torch.compile optimization")
-            self.s2mel.enable_torch_compile()
-            print(">> torch.compile optimization enabled successfully")
-        
-        self.s2mel.eval()
-        print(">> s2mel weights restored from:", s2mel_path)
-
-        # load campplus_model
-        campplus_ckpt_path = hf_hub_download(
-            "funasr/campplus", filename="campplus_cn_common.bin"
-        )
-        campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
-        campplus_model.load_state_dict(torch.load(campplus_ckpt_path, map_location="cpu"))
-        self.campplus_model = campplus_model.to(self.device)
-        self.campplus_model.eval()
-        print(">> campplus_model weights restored from:", campplus_ckpt_path)
-
-        bigvgan_name = self.cfg.vocoder.name
-        self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
-        self.bigvgan = self.bigvgan.to(self.device)
-        self.bigvgan.remove_weight_norm()
-        self.bigvgan.eval()
-        print(">> bigvgan weights restored from:", bigvgan_name)
-
-        self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
-        self.normalizer = TextNormalizer(enable_glossary=True)
-        self.normalizer.load()
-        print(">> TextNormalizer loaded")
-        self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
-        print(">> bpe model loaded from:", self.bpe_path)
-
-        # 加载术语词汇表（如果存在）
-        self.glossary_path = os.path.join(self.model_dir, "glossary.yaml")
-        if os.path.exists(self.glossary_path):
-            self.normalizer.load_glossary_from_yaml(self.glossary_path)
-            print(">> Glossary loaded from:", self.glossary_path)
-
-        emo_matrix = torch.load(os.path.join(self.model_dir, self.cfg.emo_matrix))
-        self.emo_matrix = emo_matrix.to(self.device)
-        self.emo_num = list(self.cfg.emo_num)
-
-        spk_matrix = torch.load(os.path.join(self.model_dir, self.cfg.spk_matrix))
-        self.spk_matrix = spk_matrix.to(self.device)
-
-        self.emo_matrix = torch.split(self.emo_matrix, self.emo_num)
-        self.spk_matrix = torch.split(self.spk_matrix, self.emo_num)
+        # 各组件相互独立，在线程池中并行加载（checkpoint 通过 mmap 读取）
+        def load_gpt():
+            self.gpt = UnifiedVoice(**self.cfg.gpt, use_accel=self.use_accel)
+            self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
+            load_checkpoint(self.gpt, self.gpt_path)
+            self.gpt = self.gpt.to(self.device)
+            if self.use_fp16:
+                self.gpt.eval().half()
+            else:
+                self.gpt.eval()
+            print(">> GPT weights restored from:", self.gpt_path)
+
+        def load_semantic_model():
+            self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
+            # 只保留并计算 w2v-BERT 的前 17 层，输出即原 hidden_states[17]
+            self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(
+                os.path.join(self.model_dir, self.cfg.w2v_stat), output_layer=17)
+            self.semantic_model = self.semantic_model.to(self.device)
+            self.semantic_model.eval()
+            self.semantic_mean = self.semantic_mean.to(self.device)
+            self.semantic_std = self.semantic_std.to(self.device)
+
+        def load_semantic_codec():
+            semantic_codec = build_semantic_codec(self.cfg.semantic_codec)
+            semantic_code_ckpt = hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")
+            safetensors.torch.load_model(semantic_codec, semantic_code_ckpt)
+            self.semantic_codec = semantic_codec.to(self.device)
+            self.semantic_codec.eval()
+            print('>> semantic_codec weights restored from: {}'.format(semantic_code_ckpt))
+
+        def load_s2mel():
+            s2mel_path = os.path.join(self.model_dir, self.cfg.s2mel_checkpoint)
+            s2mel = MyModel(self.cfg.s2mel, use_gpt_latent=True)
+            s2mel, _, _, _ = load_checkpoint2(
+                s2mel,
+                None,
+                s2mel_path,
+                load_only_params=True,
+                ignore_modules=[],
+                is_distributed=False,
+            )
+            self.s2mel = s2mel.to(self.device)
+            self.s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
+
+            # Enable torch.compile optimization if requested
+            if self.use_torch_compile:
+                print(">> Enabling torch.compile optimization")
+                self.s2mel.enable_torch_compile()
+                print(">> torch.compile optimization enabled successfully")
+
+            self.s2mel.eval()
+            print(">> s2mel weights restored from:", s2mel_path)
+
+        def load_campplus():
+            campplus_ckpt_path = hf_hub_download(
+                "funasr/campplus", filename="campplus_cn_common.bin"
+            )
+            campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
+            campplus_model.load_state_dict(load_state(campplus_ckpt_path))
+            self.campplus_model = campplus_model.to(self.device)
+            self.campplus_model.eval()
+            print(">> campplus_model weights restored from:", campplus_ckpt_path)
+
+        def load_bigvgan():
+            bigvgan_name = self.cfg.vocoder.name
+            self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
+            self.bigvgan = self.bigvgan.to(self.device)
+            self.bigvgan.remove_weight_norm()
+            self.bigvgan.eval()
+            print(">> bigvgan weights restored from:", bigvgan_name)
+
+        def load_text_frontend():
+            self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
+            self.normalizer = TextNormalizer(enable_glossary=True)
+            self.normalizer.load()
+            print(">> TextNormalizer loaded")
+            self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
+            print(">> bpe model loaded from:", self.bpe_path)
+
+            # 加载术语词汇表（如果存在）
+            self.glossary_path = os.path.join(self.model_dir, "glossary.yaml")
+            if os.path.exists(self.glossary_path):
+                self.normalizer.load_glossary_from_yaml(self.glossary_path)
+                print(">> Glossary loaded from:", self.glossary_path)
+            self.text_frontend = ParallelTextTokenizer(self.tokenizer, num_workers=text_workers)
+            if self.text_frontend.enabled:
+                self.text_frontend.start()
+                print(f">> Text front end started with {self.text_frontend.num_workers} worker processes")
+
+        def load_emo_spk_matrix():
+            emo_matrix = torch.load(os.path.join(self.model_dir, self.cfg.emo_matrix))
+            self.emo_matrix = emo_matrix.to(self.device)
+            self.emo_num = list(self.cfg.emo_num)
+
+            spk_matrix = torch.load(os.path.join(self.model_dir, self.cfg.spk_matrix))
+            self.spk_matrix = spk_matrix.to(self.device)
+
+            self.emo_matrix = torch.split(self.emo_matrix, self.emo_num)
+            self.spk_matrix = torch.split(self.spk_matrix, self.emo_num)
+
+        loaders = {
+            "gpt": load_gpt,
+            "semantic_model": load_semantic_model,
+            "semantic_codec": load_semantic_codec,
+            "s2mel": load_s2mel,
+            "campplus": load_campplus,
+            "bigvgan": load_bigvgan,
+            "text_frontend": load_text_frontend,
+            "emo_spk_matrix": load_emo_spk_matrix,
+        }
+        if is_bundle(self.model_dir):
+            # 预先导出的离线模型包（见 tools/export_bundle.py）：不访问网络，权重已转换好
+            print(">> Loading IndexTTS2 bundle from:", self.model_dir)
+            loaders.update(bundle_loaders(self, self.model_dir))
+        _, self.load_timings = load_components(loaders, parallel=parallel_load)
+        print(">> component load times: " + ", ".join(f"{name} {t:.2f}s" for name, t in self.load_timings.items()))
+
+        # DeepSpeed 初始化放在主线程中
+        self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16,
+                                       prefix_cache_max_bytes=gpt_prefix_cache_max_bytes, accel_backend=accel_backend,
+                                       accel_num_blocks=accel_num_blocks,
+                                       accel_max_graph_batch_size=accel_max_graph_batch_size)
 
         mel_fn_args = {
             "n_fft": self.cfg.s2mel['preprocess_params']['spect_params']['n_fft'],
@@ -201,86 +267,237 @@ class IndexTTS2:
         }
         self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
 
-        # 缓存参考音频：
-        self.cache_spk_cond = None
-        self.cache_s2mel_style = None
-        self.cache_s2mel_prompt = None
-        self.cache_spk_audio_prompt = None
-        self.cache_emo_cond = None
-        self.cache_emo_audio_prompt = None
-        self.cache_mel = None
+        # 缓存参考音频：按音频内容哈希缓存多个说话人/情感参考的条件特征（LRU，按显存字节数限制）
+        self.cond_cache = ConditioningCache(max_bytes=cond_cache_max_bytes)
+        # 并发调用 infer() 时避免重复计算同一参考音频：每个缓存键一把锁，不同参考音频的计算可并行，命中缓存无需加锁
+        self._prompt_cache_lock = threading.Lock()  # 仅保护 _prompt_key_locks
+        self._prompt_key_locks = {}  # cache key -> [lock, 等待/持有者数量]
+        # 连续批处理调度器（可选），见 enable_continuous_batching()
+        self.gpt_scheduler = None
 
         # 进度引用显示（可选）
         self.gr_progress = None
         self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
 
+    def enable_continuous_batching(self, max_batch_size=8):
+        """
+        Route GPT decoding of concurrent `infer()` calls through a shared continuous-batching scheduler.
+        Sequences from different callers are decoded together and each one is retired as soon as it emits
+        `stop_mel_token`. Beam search is not supported in this mode, `num_beams` is ignored.
+        Args:
+            max_batch_size (int): maximum number of sequences decoded together.
+        """
+        if self.gpt_scheduler is not None:
+            self.gpt_scheduler.shutdown()
+        self.gpt_scheduler = ContinuousBatchScheduler(self.gpt, max_batch_size=max_batch_size, dtype=self.dtype)
+        print(f">> Continuous batching enabled, max_batch_size={max_batch_size}")
+
+    def disable_continuous_batching(self):
+        if self.gpt_scheduler is not None:
+            self.gpt_scheduler.shutdown()
+            self.gpt_scheduler = None
+
     @torch.no_grad()
     def get_emb(self, input_features, attention_mask):
-        vq_emb = self.semantic_model(
-            input_features=input_features,
-            attention_mask=attention_mask,
-            output_hidden_states=True,
-        )
-        feat = vq_emb.hidden_states[17]  # (B, T, C)
+        feat = self.semantic_model(input_features, attention_mask)  # (B, T, C), hidden_states[17]
         feat = (feat - self.semantic_mean) / self.semantic_std
         return feat
 
+    def _prompt_key(self, audio_prompt):
+        """
+        Cache key of a reference audio or voice pack: a pack shares the key of the audio it was enrolled from.
+        """
+        if is_voice_pack(audio_prompt):
+            return read_voice_pack_metadata(audio_prompt)["source_key"]
+        return audio_content_key(audio_prompt)
+
+    @contextmanager
+    def _prompt_key_lock(self, key):
+        """
+        Hold the lock of one conditioning cache key: concurrent misses on the same reference audio compute it once,
+        misses on different ones run in parallel.
+        """
+        with self._prompt_cache_lock:
+            entry = self._prompt_key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._prompt_cache_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._prompt_key_locks[key]
+
+    @torch.no_grad()
+    def get_spk_conditioning(self, spk_audio_prompt, verbose=False):
+        """
+        Speaker conditioning bundle of a reference audio (or of a voice pack written by `enroll_voice()`), reused
+        from `self.cond_cache` when the same audio content has been seen before.
+        Returns:
+            dict: `spk_cond` (w2v-BERT features), `s2mel_style` (CAMPPlus style), `s2mel_prompt`
+            (length-regulated prompt condition), `mel` (reference mel spectrogram), `gpt_cond` (GPT conditioning
+            latents), `spk_emovec` (speaker emotion vector) and `spk_matrix_idx` (nearest `spk_matrix` rows).
+        """
+        import torchaudio
+
+        key = ("spk", self._prompt_key(spk_audio_prompt))
+        # ConditioningCache is thread-safe: hits never wait behind another voice's miss
+        bundle = self.cond_cache.get(key)
+        if bundle is not None:
+            return bundle
+        with self._prompt_key_lock(key):
+            bundle = self.cond_cache.get(key)
+            if bundle is not None:
+                return bundle
+            if is_voice_pack(spk_audio_prompt):
+                return self._load_voice_pack(spk_audio_prompt)[0]
+
+            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
+            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
+            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
+
+            inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
+            input_features = inputs["input_features"]
+            attention_mask = inputs["attention_mask"]
+            input_features = input_features.to(self.device)
+            attention_mask = attention_mask.to(self.device)
+            spk_cond_emb = self.get_emb(input_features, attention_mask)
+
+            _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
+            ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
+            ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
+            feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
+                                                     num_mel_bins=80,
+                                                     dither=0,
+                                                     sample_frequency=16000)
+            feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
+            style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
+
+            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
+                                                                     ylens=ref_target_lengths,
+                                                                     n_quantizers=3,
+                                                                     f0=None)[0]
+
+            bundle = self._complete_spk_bundle({
+                "spk_cond": spk_cond_emb,
+                "s2mel_style": style,
+                "s2mel_prompt": prompt_condition,
+                "mel": ref_mel,
+            })
+            self.cond_cache.put(key, bundle)
+            return bundle
+
+    def _complete_spk_bundle(self, bundle):
+        """
+        Fill in the GPT-side speaker tensors missing from a bundle (e.g. one restored from an older disk cache).
+        """
+        spk_cond_emb = bundle["spk_cond"]
+        cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=spk_cond_emb.device)
+        with torch.amp.autocast(spk_cond_emb.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+            if "gpt_cond" not in bundle:
+                bundle["gpt_cond"] = self.gpt.get_conditioning(spk_cond_emb.transpose(1, 2), cond_lengths)
+            if "spk_emovec" not in bundle:
+                bundle["spk_emovec"] = self.gpt.get_emovec(spk_cond_emb, cond_lengths)
+        if "spk_matrix_idx" not in bundle:
+            bundle["spk_matrix_idx"] = torch.stack(
+                [find_most_similar_cosine(bundle["s2mel_style"], tmp) for tmp in self.spk_matrix])
+        return bundle
+
+    @torch.no_grad()
+    def set_spk_conditioning(self, spk_audio_prompt, bundle):
+        """
+        Register a precomputed speaker bundle (see `get_spk_conditioning()`), e.g. restored from a disk cache,
+        so that `infer()` with this reference audio skips feature extraction.
+        """
+        bundle = {name: value.to(self.device) for name, value in bundle.items() if isinstance(value, torch.Tensor)}
+        self.cond_cache.put(("spk", self._prompt_key(spk_audio_prompt)), self._complete_spk_bundle(bundle))
+
+    @torch.no_grad()
+    def get_emo_conditioning(self, emo_audio_prompt, verbose=False):
+        """
+        Emotion conditioning of a reference audio or voice pack, reused from `self.cond_cache` when possible.
+        Returns:
+            dict: `emo_cond` (w2v-BERT features) and `emovec` (GPT emotion vector)
+        """
+        key = ("emo", self._prompt_key(emo_audio_prompt))
+        emo = self.cond_cache.get(key)
+        if emo is not None:
+            return emo
+        with self._prompt_key_lock(key):
+            emo = self.cond_cache.get(key)
+            if emo is not None:
+                return emo
+            if is_voice_pack(emo_audio_prompt):
+                return self._load_voice_pack(emo_audio_prompt)[1]
+
+            emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
+            emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
+            emo_input_features = emo_inputs["input_features"]
+            emo_attention_mask = emo_inputs["attention_mask"]
+            emo_input_features = emo_input_features.to(self.device)
+            emo_attention_mask = emo_attention_mask.to(self.device)
+            emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
+
+            emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=emo_cond_emb.device)
+            with torch.amp.autocast(emo_cond_emb.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                emovec = self.gpt.get_emovec(emo_cond_emb, emo_cond_lengths)
+
+            emo = {"emo_cond": emo_cond_emb, "emovec": emovec}
+            self.cond_cache.put(key, emo)
+            return emo
+
+    def _load_voice_pack(self, path):
+        """
+        Read a voice pack into `self.cond_cache` as both the speaker and the emotion entry of its source audio.
+        Must be called with the `_prompt_key_lock()` of the requested key held.
+        """
+        tensors, metadata = load_voice_pack(path, device=self.device)
+        if metadata.get("model_version") != str(self.model_version):
+            warnings.warn(f"voice pack {path} was enrolled with model version {metadata.get('model_version')}, "
+                          f"current model version is {self.model_version}", RuntimeWarning)
+        gpt_dtype = self.gpt.mel_head.weight.dtype
+        for name in ("gpt_cond", "spk_emovec", "emovec"):
+            tensors[name] = tensors[name].to(gpt_dtype)
+        spk = {name: tensors[name] for name in SPK_TENSORS}
+        emo = {name: tensors[name] for name in EMO_TENSORS}
+        self.cond_cache.put(("spk", metadata["source_key"]), spk)
+        self.cond_cache.put(("emo", metadata["source_key"]), emo)
+        print(f">> Voice pack loaded from: {path}")
+        return spk, emo
+
+    def enroll_voice(self, spk_audio_prompt, output_path, verbose=False):
+        """
+        Compute every speaker-derived conditioning tensor of a reference audio once and save them as a voice pack
+        (a safetensors file), without synthesizing any audio. The pack can be passed as `spk_audio_prompt` (and
+        `emo_audio_prompt`) to `infer()`; on a node that has never seen the voice it is loaded with a single
+        memory-mapped read instead of running w2v-BERT, CAMPPlus and the GPT conditioning encoders.
+        Args:
+            spk_audio_prompt (str): path of the reference audio.
+            output_path (str): path of the voice pack, must end with `.safetensors`.
+        Returns:
+            str: output_path
+        """
+        assert is_voice_pack(output_path), f"voice pack path must end with {VOICE_PACK_SUFFIX}: {output_path}"
+        spk = self.get_spk_conditioning(spk_audio_prompt, verbose)
+        emo = self.get_emo_conditioning(spk_audio_prompt, verbose)
+        tensors = {name: spk[name] for name in SPK_TENSORS}
+        tensors.update({name: emo[name] for name in EMO_TENSORS})
+        save_voice_pack(output_path, tensors, metadata={
+            "source_key": self._prompt_key(spk_audio_prompt),
+            "source_name": os.path.basename(spk_audio_prompt),
+            "model_version": self.model_version,
+        })
+        print(f">> Voice pack saved to: {output_path}")
+        return output_path
+
     def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30):
         """
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
+        return remove_long_silence(codes, self.stop_mel_token, silent_token=silent_token,
+                                   max_consecutive=max_consecutive)
 
     def interval_silence(self, wavs, sampling_rate=22050, interval_silence=200):
         """
@@ -324,6 +541,7 @@ class IndexTTS2:
             self.gr_progress(value, desc=desc)
 
     def _load_and_cut_audio(self,audio_path,max_audio_length_seconds,verbose=False,sr=None):
+        import librosa
         if not sr:
             audio, sr = librosa.load(audio_path)
         else:
@@ -353,46 +571,14 @@ class IndexTTS2:
 
         return emo_vector
 
-    # 原始推理模式
-    def infer(self, spk_audio_prompt, text, output_path,
-              emo_audio_prompt=None, emo_alpha=1.0,
-              emo_vector=None,
-              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
-              verbose=False, max_text_tokens_per_segment=120, stream_return=False, more_segment_before=0, **generation_kwargs):
-        if stream_return:
-            return self.infer_generator(
-                spk_audio_prompt, text, output_path,
-                emo_audio_prompt, emo_alpha,
-                emo_vector,
-                use_emo_text, emo_text, use_random, interval_silence,
-                verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
-            )
-        else:
-            try:
-                return list(self.infer_generator(
-                    spk_audio_prompt, text, output_path,
-                    emo_audio_prompt, emo_alpha,
-                    emo_vector,
-                    use_emo_text, emo_text, use_random, interval_silence,
-                    verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
-                ))[0]
-            except IndexError:
-                return None
-
-    def infer_generator(self, spk_audio_prompt, text, output_path,
-              emo_audio_prompt=None, emo_alpha=1.0,
-              emo_vector=None,
-              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
-              verbose=False, max_text_tokens_per_segment=120, stream_return=False, quick_streaming_tokens=0, **generation_kwargs):
-        print(">> starting inference...")
-        self._set_gr_progress(0, "starting inference...")
-        if verbose:
-            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
-                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
-                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
-                  f"emo_text:{emo_text}")
-        start_time = time.perf_counter()
-
+    def _prepare_conditions(self, spk_audio_prompt, text, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                            use_emo_text=False, emo_text=None, use_random=False, verbose=False):
+        """
+        Speaker and emotion conditioning shared by all segments of one request.
+        Returns:
+            dict: the speaker bundle of `get_spk_conditioning()` plus `emo_cond` (emotion reference features),
+            `emo_alpha`, and `emovec_mat` / `weight_vector` when emotion vectors are used (else None).
+        """
         if use_emo_text or emo_vector is not None:
             # we're using a text or emotion vector guidance; so we must remove
             # "emotion reference voice", to ensure we use correct emotion mixing!
@@ -400,6 +586,8 @@ class IndexTTS2:
 
         if use_emo_text:
             # automatically generate emotion vectors from text prompt
+            if self.qwen_emo is None:
+                raise ValueError("use_emo_text requires the QwenEmotion model, which is disabled (use_qwen_emo=False)")
             if emo_text is None:
                 emo_text = text  # use main text prompt
             emo_dict = self.qwen_emo.inference(emo_text)
@@ -424,57 +612,16 @@ class IndexTTS2:
             # must always use alpha=1.0 when we don't have an external reference voice
             emo_alpha = 1.0
 
-        # 如果参考音频改变了，才需要重新生成, 提升速度
-        if self.cache_spk_cond is None or self.cache_spk_audio_prompt != spk_audio_prompt:
-            if self.cache_spk_cond is not None:
-                self.cache_spk_cond = None
-                self.cache_s2mel_style = None
-                self.cache_s2mel_prompt = None
-                self.cache_mel = None
-                torch.cuda.empty_cache()
-            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
-            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
-
-            inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
-            input_features = inputs["input_features"]
-            attention_mask = inputs["attention_mask"]
-            input_features = input_features.to(self.device)
-            attention_mask = attention_mask.to(self.device)
-            spk_cond_emb = self.get_emb(input_features, attention_mask)
-
-            _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
-            ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
-            ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
-            feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
-                                                     num_mel_bins=80,
-                                                     dither=0,
-                                                     sample_frequency=16000)
-            feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
-            style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
-
-            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
-                                                                     ylens=ref_target_lengths,
-                                                                     n_quantizers=3,
-                                                                     f0=None)[0]
-
-            self.cache_spk_cond = spk_cond_emb
-            self.cache_s2mel_style = style
-            self.cache_s2mel_prompt = prompt_condition
-            self.cache_spk_audio_prompt = spk_audio_prompt
-            self.cache_mel = ref_mel
-        else:
-            style = self.cache_s2mel_style
-            prompt_condition = self.cache_s2mel_prompt
-            spk_cond_emb = self.cache_spk_cond
-            ref_mel = self.cache_mel
+        spk_cond = self.get_spk_conditioning(spk_audio_prompt, verbose)
+        emovec_mat = None
+        weight_vector = None
 
         if emo_vector is not None:
             weight_vector = torch.tensor(emo_vector, device=self.device)
             if use_random:
                 random_index = [random.randint(0, x - 1) for x in self.emo_num]
             else:
-                random_index = [find_most_similar_cosine(style, tmp) for tmp in self.spk_matrix]
+                random_index = spk_cond["spk_matrix_idx"].tolist()
 
             emo_matrix = [tmp[index].unsqueeze(0) for index, tmp in zip(random_index, self.emo_matrix)]
             emo_matrix = torch.cat(emo_matrix, 0)
@@ -482,40 +629,150 @@ class IndexTTS2:
             emovec_mat = torch.sum(emovec_mat, 0)
             emovec_mat = emovec_mat.unsqueeze(0)
 
-        if self.cache_emo_cond is None or self.cache_emo_audio_prompt != emo_audio_prompt:
-            if self.cache_emo_cond is not None:
-                self.cache_emo_cond = None
-                torch.cuda.empty_cache()
-            emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
-            emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
-            emo_input_features = emo_inputs["input_features"]
-            emo_attention_mask = emo_inputs["attention_mask"]
-            emo_input_features = emo_input_features.to(self.device)
-            emo_attention_mask = emo_attention_mask.to(self.device)
-            emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
+        emo = self.get_emo_conditioning(emo_audio_prompt, verbose)
+
+        conds = dict(spk_cond)
+        conds.update(emo_cond=emo["emo_cond"], emo_emovec=emo["emovec"], emo_alpha=emo_alpha,
+                     emovec_mat=emovec_mat, weight_vector=weight_vector)
+        return conds
+
+    def _merge_emovec(self, conds):
+        # same as `UnifiedVoice.merge_emovec()`, from the cached speaker / emotion vectors
+        base_vec = conds["spk_emovec"]
+        emovec = base_vec + conds["emo_alpha"] * (conds["emo_emovec"] - base_vec)
+        if conds["weight_vector"] is not None:
+            emovec = conds["emovec_mat"] + (1 - torch.sum(conds["weight_vector"])) * emovec
+        return emovec
 
-            self.cache_emo_cond = emo_cond_emb
-            self.cache_emo_audio_prompt = emo_audio_prompt
+    # 原始推理模式
+    def infer(self, spk_audio_prompt, text, output_path,
+              emo_audio_prompt=None, emo_alpha=1.0,
+              emo_vector=None,
+              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+              verbose=False, max_text_tokens_per_segment=120, stream_return=False, more_segment_before=0, **generation_kwargs):
+        if stream_return:
+            return self.infer_generator(
+                spk_audio_prompt, text, output_path,
+                emo_audio_prompt, emo_alpha,
+                emo_vector,
+                use_emo_text, emo_text, use_random, interval_silence,
+                verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
+            )
         else:
-            emo_cond_emb = self.cache_emo_cond
+            try:
+                return list(self.infer_generator(
+                    spk_audio_prompt, text, output_path,
+                    emo_audio_prompt, emo_alpha,
+                    emo_vector,
+                    use_emo_text, emo_text, use_random, interval_silence,
+                    verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
+                ))[0]
+            except IndexError:
+                return None
+
+    def bucket_segments(self, segments, bucket_max_size=4) -> List[List[Dict]]:
+        """
+        Segment data bucketing.
+        if ``bucket_max_size=1``, return all segments in one bucket.
+        """
+        outputs: List[Dict] = []
+        for idx, sent in enumerate(segments):
+            outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
+
+        if len(outputs) > bucket_max_size:
+            # split segments into buckets by segment length
+            buckets: List[List[Dict]] = []
+            factor = 1.5
+            last_bucket = None
+            last_bucket_sent_len_median = 0
+
+            for sent in sorted(outputs, key=lambda x: x["len"]):
+                current_sent_len = sent["len"]
+                if current_sent_len == 0:
+                    print(">> skip empty segment")
+                    continue
+                if last_bucket is None \
+                        or current_sent_len >= int(last_bucket_sent_len_median * factor) \
+                        or len(last_bucket) >= bucket_max_size:
+                    # new bucket
+                    buckets.append([sent])
+                    last_bucket = buckets[-1]
+                    last_bucket_sent_len_median = current_sent_len
+                else:
+                    # current bucket can hold more segments
+                    last_bucket.append(sent)  # sorted
+                    mid = len(last_bucket) // 2
+                    last_bucket_sent_len_median = last_bucket[mid]["len"]
+            last_bucket = None
+            # merge all buckets with size 1
+            out_buckets: List[List[Dict]] = []
+            only_ones: List[Dict] = []
+            for b in buckets:
+                if len(b) == 1:
+                    only_ones.append(b[0])
+                else:
+                    out_buckets.append(b)
+            if len(only_ones) > 0:
+                # merge into previous buckets if possible
+                for i in range(len(out_buckets)):
+                    b = out_buckets[i]
+                    if len(b) < bucket_max_size:
+                        b.append(only_ones.pop(0))
+                        if len(only_ones) == 0:
+                            break
+                # combined all remaining sized 1 buckets
+                if len(only_ones) > 0:
+                    out_buckets.extend(
+                        [only_ones[i:i + bucket_max_size] for i in range(0, len(only_ones), bucket_max_size)])
+            return out_buckets
+        return [outputs]
+
+    def pad_tokens_cat(self, tokens: List[torch.Tensor]) -> torch.Tensor:
+        # 使用 stop_text_token 右侧填充到最大长度，prepare_gpt_inputs() 会去掉填充并改为左侧填充
+        # [1, N] -> [N,]
+        tokens = [t.squeeze(0) for t in tokens]
+        return pad_sequence(tokens, batch_first=True, padding_value=self.cfg.gpt.stop_text_token)
+
+    # 快速推理：对于“多句长文本”，按长度分桶，桶内分句批量通过 GPT、s2mel 和 BigVGAN
+    def infer_fast(self, spk_audio_prompt, text, output_path,
+                   emo_audio_prompt=None, emo_alpha=1.0,
+                   emo_vector=None,
+                   use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+                   verbose=False, max_text_tokens_per_segment=120, segments_bucket_max_size=4, **generation_kwargs):
+        """
+        Same arguments as `infer()`, plus:
+            ``segments_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
+                - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多
+                - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存更少
+        Output segments are reassembled in their original order.
+        """
+        from indextts.s2mel.modules.commons import sequence_mask
+
+        print(">> starting fast inference...")
+        self._set_gr_progress(0, "starting fast inference...")
+        if verbose:
+            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
+                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
+                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
+                  f"emo_text:{emo_text}")
+        start_time = time.perf_counter()
+
+        conds = self._prepare_conditions(spk_audio_prompt, text, emo_audio_prompt, emo_alpha, emo_vector,
+                                         use_emo_text, emo_text, use_random, verbose)
+        spk_cond_emb = conds["spk_cond"]
+        style = conds["s2mel_style"]
+        prompt_condition = conds["s2mel_prompt"]
+        ref_mel = conds["mel"]
+        emo_cond_emb = conds["emo_cond"]
 
         self._set_gr_progress(0.1, "text processing...")
-        text_tokens_list = self.tokenizer.tokenize(text)
-        segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens)
-        segments_count = len(segments)
-
-        text_token_ids = self.tokenizer.convert_tokens_to_ids(text_tokens_list)
-        if self.tokenizer.unk_token_id in text_token_ids:
-            print(f"  >> Warning: input text contains {text_token_ids.count(self.tokenizer.unk_token_id)} unknown tokens (id={self.tokenizer.unk_token_id}):")
-            print( "     Tokens which can't be encoded: ", [t for t, id in zip(text_tokens_list, text_token_ids) if id == self.tokenizer.unk_token_id])
-            print(f"     Consider updating the BPE model or modifying the text to avoid unknown tokens.")
-                  
+        text_tokens_list = self.text_frontend.tokenize(text)
+        segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
         if verbose:
-            print("text_tokens_list:", text_tokens_list)
-            print("segments count:", segments_count)
-            print("max_text_tokens_per_segment:", max_text_tokens_per_segment)
+            print(">> text token count:", len(text_tokens_list))
+            print("   segments count:", len(segments))
+            print("   max_text_tokens_per_segment:", max_text_tokens_per_segment)
             print(*segments, sep="\n")
-        do_sample = generation_kwargs.pop("do_sample", True)
         top_p = generation_kwargs.pop("top_p", 0.8)
         top_k = generation_kwargs.pop("top_k", 30)
         temperature = generation_kwargs.pop("temperature", 0.8)
@@ -524,50 +781,54 @@ class IndexTTS2:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        reuse_gpt_latent = generation_kwargs.pop("reuse_gpt_latent", False)
+        generation_kwargs.pop("do_sample", None)
         sampling_rate = 22050
+        hop_length = self.cfg.s2mel['preprocess_params']['spect_params']['hop_length']
+        diffusion_steps = generation_kwargs.pop("diffusion_steps", 25)
+        inference_cfg_rate = generation_kwargs.pop("inference_cfg_rate", 0.7)
+        cfm_solver = generation_kwargs.pop("cfm_solver", "euler")
+        cfm_t_schedule = generation_kwargs.pop("cfm_t_schedule", "linear")
+
+        bucket_max_size = segments_bucket_max_size if self.device != "cpu" else 1
+        all_buckets = self.bucket_segments(segments, bucket_max_size=bucket_max_size)
+        bucket_count = len(all_buckets)
+        if verbose:
+            print(">> segments bucket_count:", bucket_count,
+                  "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in all_buckets],
+                  "bucket_max_size:", bucket_max_size)
 
-        wavs = []
+        wavs = [None] * len(segments)
+        all_batch_num = sum(len(s) for s in all_buckets)
+        processed_num = 0
         gpt_gen_time = 0
         gpt_forward_time = 0
         s2mel_time = 0
         bigvgan_time = 0
         has_warned = False
-        silence = None # for stream_return
-        for seg_idx, sent in enumerate(segments):
-            self._set_gr_progress(0.2 + 0.7 * seg_idx / segments_count,
-                                  f"speech synthesis {seg_idx + 1}/{segments_count}...")
-
-            text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
-            text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
-            if verbose:
-                print(text_tokens)
-                print(f"text_tokens shape: {text_tokens.shape}, text_tokens type: {text_tokens.dtype}")
-                # debug tokenizer
-                text_token_syms = self.tokenizer.convert_ids_to_tokens(text_tokens[0].tolist())
-                print("text_token_syms is same as segment tokens", text_token_syms == sent)
+        for bucket in all_buckets:
+            bucket_tokens = [
+                torch.tensor(self.tokenizer.convert_tokens_to_ids(item["sent"]), dtype=torch.int32,
+                             device=self.device).unsqueeze(0)
+                for item in bucket
+            ]
+            batch_text_tokens = self.pad_tokens_cat(bucket_tokens) if len(bucket_tokens) > 1 else bucket_tokens[0]
+            processed_num += len(bucket)
+            self._set_gr_progress(0.1 + 0.8 * processed_num / all_batch_num,
+                                  f"speech synthesis {processed_num}/{all_batch_num}...")
 
             m_start_time = time.perf_counter()
             with torch.no_grad():
-                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    emovec = self.gpt.merge_emovec(
+                with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    emovec = self._merge_emovec(conds)
+                    gpt_outputs = self.gpt.inference_speech(
                         spk_cond_emb,
+                        batch_text_tokens,
                         emo_cond_emb,
-                        torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        alpha=emo_alpha
-                    )
-
-                    if emo_vector is not None:
-                        emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
-                        # emovec = emovec_mat
-
-                    codes, speech_conditioning_latent = self.gpt.inference_speech(
-                        spk_cond_emb,
-                        text_tokens,
-                        emo_cond_emb,
-                        cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                        cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=self.device),
+                        emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=self.device),
                         emo_vec=emovec,
+                        cond_latent=conds["gpt_cond"],
                         do_sample=True,
                         top_p=top_p,
                         top_k=top_k,
@@ -577,8 +838,285 @@ class IndexTTS2:
                         num_beams=num_beams,
                         repetition_penalty=repetition_penalty,
                         max_generate_length=max_mel_tokens,
+                        return_latent=reuse_gpt_latent,
                         **generation_kwargs
                     )
+                batch_codes = gpt_outputs[0]
+                gpt_gen_time += time.perf_counter() - m_start_time
+
+                # 每个分句单独计算 GPT latent 与 s2mel 条件（长度各不相同）
+                cat_conditions = []
+                # 一次同步取回整批的 stop token 位置
+                batch_code_lens = stop_token_lengths(batch_codes, self.stop_mel_token).tolist()
+                for i, text_tokens in enumerate(bucket_tokens):
+                    codes = batch_codes[i]
+                    code_len = batch_code_lens[i]
+                    if code_len == batch_codes.size(1):
+                        if not has_warned:
+                            warnings.warn(
+                                f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                                f"Consider reducing `max_text_tokens_per_segment`({max_text_tokens_per_segment}) or increasing `max_mel_tokens`.",
+                                category=RuntimeWarning
+                            )
+                            has_warned = True
+                    codes = codes[:code_len].unsqueeze(0)
+                    code_lens = torch.tensor([code_len], dtype=torch.long, device=self.device)
+                    if verbose:
+                        print(f"segment {bucket[i]['idx']} codes:", codes.shape)
+
+                    m_start_time = time.perf_counter()
+                    if reuse_gpt_latent:
+                        latent = gpt_outputs[2][i:i + 1, :code_len]
+                    else:
+                        use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
+                        with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                            latent = self.gpt(
+                                gpt_outputs[1],
+                                text_tokens,
+                                torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
+                                codes,
+                                torch.tensor([codes.shape[-1]], device=text_tokens.device),
+                                emo_cond_emb,
+                                cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                                emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                                emo_vec=emovec,
+                                use_speed=use_speed,
+                            )
+                    gpt_forward_time += time.perf_counter() - m_start_time
+
+                    m_start_time = time.perf_counter()
+                    latent = self.s2mel.models['gpt_layer'](latent)
+                    S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
+                    S_infer = S_infer.transpose(1, 2)
+                    S_infer = S_infer + latent
+                    target_lengths = (code_lens * 1.72).long()
+                    cond = self.s2mel.models['length_regulator'](S_infer,
+                                                                 ylens=target_lengths,
+                                                                 n_quantizers=3,
+                                                                 f0=None)[0]
+                    cat_conditions.append(torch.cat([prompt_condition, cond], dim=1).squeeze(0))
+                    s2mel_time += time.perf_counter() - m_start_time
+
+                # CFM 与 BigVGAN 对整个桶批量推理，填充部分由 x_lens 屏蔽并在输出时裁掉
+                m_start_time = time.perf_counter()
+                batch_size = len(cat_conditions)
+                x_lens = torch.tensor([c.size(0) for c in cat_conditions], dtype=torch.long, device=self.device)
+                mu = pad_sequence(cat_conditions, batch_first=True)
+                vc_target = self.s2mel.models['cfm'].inference(mu, x_lens,
+                                                               ref_mel, style.expand(batch_size, -1), None,
+                                                               diffusion_steps,
+                                                               inference_cfg_rate=inference_cfg_rate,
+                                                               solver=cfm_solver, t_schedule=cfm_t_schedule)
+                vc_target = vc_target[:, :, ref_mel.size(-1):]
+                mel_lens = x_lens - ref_mel.size(-1)
+                # 填充帧设为静音（log(1e-5)），避免影响各分句结尾
+                vc_target = vc_target.masked_fill(~sequence_mask(mel_lens, vc_target.size(-1)).unsqueeze(1), math.log(1e-5))
+                s2mel_time += time.perf_counter() - m_start_time
+
+                m_start_time = time.perf_counter()
+                batch_wav = self.bigvgan(vc_target.float())
+                bigvgan_time += time.perf_counter() - m_start_time
+                batch_wav = torch.clamp(32767 * batch_wav, -32767.0, 32767.0)
+                for i, item in enumerate(bucket):
+                    # [B, 1, T] -> [1, T]
+                    wavs[item["idx"]] = batch_wav[i, :, :mel_lens[i].item() * hop_length].cpu()
+        end_time = time.perf_counter()
+
+        self._set_gr_progress(0.9, "saving audio...")
+        wavs = [wav for wav in wavs if wav is not None]
+        wavs = self.insert_interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
+        wav = torch.cat(wavs, dim=1)
+        wav_length = wav.shape[-1] / sampling_rate
+        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
+        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
+        print(f">> s2mel_time: {s2mel_time:.2f} seconds")
+        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
+        print(f">> Total fast inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Generated audio length: {wav_length:.2f} seconds")
+        print(f">> [fast] batch_num: {all_batch_num} bucket_max_size: {bucket_max_size}",
+              f"bucket_count: {bucket_count}" if bucket_max_size > 1 else "")
+        print(f">> [fast] RTF: {(end_time - start_time) / wav_length:.4f}")
+
+        # save audio
+        wav = wav.cpu()  # to cpu
+        if output_path:
+            # 直接保存音频到指定路径中
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+                print(">> remove old wav file:", output_path)
+            if os.path.dirname(output_path) != "":
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            import torchaudio
+            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
+            print(">> wav file saved to:", output_path)
+            return output_path
+        else:
+            # 返回以符合Gradio的格式要求
+            wav_data = wav.type(torch.int16)
+            wav_data = wav_data.numpy().T
+            return (sampling_rate, wav_data)
+
+    def _stream_segments(self, fragments, max_text_tokens_per_segment, quick_streaming_tokens, verbose=False):
+        """
+        Generator of text segments from an iterable of text fragments, each segment is yielded as soon as its
+        sentence is complete.
+        """
+        from indextts.utils.front import TextStreamSegmenter
+
+        segmenter = TextStreamSegmenter(self.tokenizer, max_text_tokens_per_segment, quick_streaming_tokens)
+        for fragment in fragments:
+            for segment in segmenter.push(fragment):
+                if verbose:
+                    print("stream segment:", segment)
+                yield segment
+        for segment in segmenter.flush():
+            if verbose:
+                print("stream segment:", segment)
+            yield segment
+
+    def infer_generator(self, spk_audio_prompt, text, output_path,
+              emo_audio_prompt=None, emo_alpha=1.0,
+              emo_vector=None,
+              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+              verbose=False, max_text_tokens_per_segment=120, stream_return=False, quick_streaming_tokens=0, **generation_kwargs):
+        """
+        `text` is either the full text, or an iterable of text fragments (e.g. tokens streamed from an LLM): each
+        sentence is then synthesized as soon as it is complete, see `TextStreamSegmenter`.
+        """
+        print(">> starting inference...")
+        self._set_gr_progress(0, "starting inference...")
+        if verbose:
+            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
+                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
+                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
+                  f"emo_text:{emo_text}")
+        start_time = time.perf_counter()
+
+        text_stream = not isinstance(text, str)
+        if text_stream and use_emo_text and emo_text is None:
+            raise ValueError("emo_text is required for use_emo_text when text is a stream of fragments")
+        conds = self._prepare_conditions(spk_audio_prompt, None if text_stream else text, emo_audio_prompt, emo_alpha,
+                                         emo_vector, use_emo_text, emo_text, use_random, verbose)
+        spk_cond_emb = conds["spk_cond"]
+        style = conds["s2mel_style"]
+        prompt_condition = conds["s2mel_prompt"]
+        ref_mel = conds["mel"]
+        emo_cond_emb = conds["emo_cond"]
+
+        self._set_gr_progress(0.1, "text processing...")
+        if text_stream:
+            # 流式文本：分句在文本到达时逐个产生，总数未知
+            segments = self._stream_segments(text, max_text_tokens_per_segment, quick_streaming_tokens, verbose)
+            segments_count = None
+        else:
+            text_tokens_list = self.text_frontend.tokenize(text)
+            segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens)
+            segments_count = len(segments)
+
+            text_token_ids = self.tokenizer.convert_tokens_to_ids(text_tokens_list)
+            if self.tokenizer.unk_token_id in text_token_ids:
+                print(f"  >> Warning: input text contains {text_token_ids.count(self.tokenizer.unk_token_id)} unknown tokens (id={self.tokenizer.unk_token_id}):")
+                print( "     Tokens which can't be encoded: ", [t for t, id in zip(text_tokens_list, text_token_ids) if id == self.tokenizer.unk_token_id])
+                print(f"     Consider updating the BPE model or modifying the text to avoid unknown tokens.")
+
+            if verbose:
+                print("text_tokens_list:", text_tokens_list)
+                print("segments count:", segments_count)
+                print("max_text_tokens_per_segment:", max_text_tokens_per_segment)
+                print(*segments, sep="\n")
+        do_sample = generation_kwargs.pop("do_sample", True)
+        top_p = generation_kwargs.pop("top_p", 0.8)
+        top_k = generation_kwargs.pop("top_k", 30)
+        temperature = generation_kwargs.pop("temperature", 0.8)
+        autoregressive_batch_size = 1
+        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
+        num_beams = generation_kwargs.pop("num_beams", 3)
+        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        # 复用 GPT 解码时的隐状态作为 s2mel 的 latent，跳过对生成结果的第二次完整 GPT 前向
+        reuse_gpt_latent = generation_kwargs.pop("reuse_gpt_latent", False)
+        # CFM 采样：步数、CFG 强度、ODE 求解器（euler/heun/midpoint/rk4/dpm_multistep）与时间步调度（linear/cosine）
+        diffusion_steps = generation_kwargs.pop("diffusion_steps", 25)
+        inference_cfg_rate = generation_kwargs.pop("inference_cfg_rate", 0.7)
+        cfm_solver = generation_kwargs.pop("cfm_solver", "euler")
+        cfm_t_schedule = generation_kwargs.pop("cfm_t_schedule", "linear")
+        # 分句流水线：GPT 解码与 s2mel/声码器重叠执行，队列长度限制 GPT 领先的分句数
+        pipeline_stages = generation_kwargs.pop("pipeline_stages", False)
+        pipeline_queue_size = generation_kwargs.pop("pipeline_queue_size", 2)
+        sampling_rate = 22050
+
+        wavs = []
+        gpt_gen_time = 0
+        gpt_forward_time = 0
+        s2mel_time = 0
+        bigvgan_time = 0
+        has_warned = False
+        silence = None # for stream_return
+
+        # 阶段一：GPT 生成 codes 与 latent
+        def gpt_stage(item):
+            nonlocal gpt_gen_time, gpt_forward_time, has_warned
+            seg_idx, sent = item
+            if segments_count:
+                self._set_gr_progress(0.2 + 0.7 * seg_idx / segments_count,
+                                      f"speech synthesis {seg_idx + 1}/{segments_count}...")
+
+            text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
+            text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+            if verbose:
+                print(text_tokens)
+                print(f"text_tokens shape: {text_tokens.shape}, text_tokens type: {text_tokens.dtype}")
+                # debug tokenizer
+                text_token_syms = self.tokenizer.convert_ids_to_tokens(text_tokens[0].tolist())
+                print("text_token_syms is same as segment tokens", text_token_syms == sent)
+
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    emovec = self._merge_emovec(conds)
+
+                    if self.gpt_scheduler is not None:
+                        gpt_outputs = self.gpt_scheduler.generate(
+                            spk_cond_emb,
+                            text_tokens,
+                            emo_cond_emb,
+                            cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_vec=emovec,
+                            cond_latent=conds["gpt_cond"],
+                            do_sample=True,
+                            top_p=top_p,
+                            top_k=top_k,
+                            temperature=temperature,
+                            repetition_penalty=repetition_penalty,
+                            max_generate_length=max_mel_tokens,
+                            return_latent=reuse_gpt_latent,
+                        )
+                    else:
+                        gpt_outputs = self.gpt.inference_speech(
+                            spk_cond_emb,
+                            text_tokens,
+                            emo_cond_emb,
+                            cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_vec=emovec,
+                            cond_latent=conds["gpt_cond"],
+                            do_sample=True,
+                            top_p=top_p,
+                            top_k=top_k,
+                            temperature=temperature,
+                            num_return_sequences=autoregressive_batch_size,
+                            length_penalty=length_penalty,
+                            num_beams=num_beams,
+                            repetition_penalty=repetition_penalty,
+                            max_generate_length=max_mel_tokens,
+                            return_latent=reuse_gpt_latent,
+                            **generation_kwargs
+                        )
+                    if reuse_gpt_latent:
+                        codes, speech_conditioning_latent, gpt_latent = gpt_outputs
+                    else:
+                        codes, speech_conditioning_latent = gpt_outputs
 
                 gpt_gen_time += time.perf_counter() - m_start_time
                 if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
@@ -596,19 +1134,9 @@ class IndexTTS2:
                 #                     print(f"codes shape: {codes.shape}, codes type: {codes.dtype}")
                 #                     print(f"code len: {code_lens}")
 
-                code_lens = []
-                max_code_len = 0
-                for code in codes:
-                    if self.stop_mel_token not in code:
-                        code_len = len(code)
-                    else:
-                        len_ = (code == self.stop_mel_token).nonzero(as_tuple=False)[0]
-                        code_len = len_[0].item() if len_.numel() > 0 else len(code)
-                    code_lens.append(code_len)
-                    max_code_len = max(max_code_len, code_len)
+                code_lens = stop_token_lengths(codes, self.stop_mel_token)
+                max_code_len = int(code_lens.max())
                 codes = codes[:, :max_code_len]
-                code_lens = torch.LongTensor(code_lens)
-                code_lens = code_lens.to(self.device)
                 if verbose:
                     print(codes, type(codes))
                     print(f"fix codes shape: {codes.shape}, codes type: {codes.dtype}")
@@ -616,26 +1144,33 @@ class IndexTTS2:
 
                 m_start_time = time.perf_counter()
                 use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
-                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    latent = self.gpt(
-                        speech_conditioning_latent,
-                        text_tokens,
-                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
-                        codes,
-                        torch.tensor([codes.shape[-1]], device=text_tokens.device),
-                        emo_cond_emb,
-                        cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        use_speed=use_speed,
-                    )
-                    gpt_forward_time += time.perf_counter() - m_start_time
-
+                if reuse_gpt_latent:
+                    latent = gpt_latent[:, :max_code_len]
+                else:
+                    with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        latent = self.gpt(
+                            speech_conditioning_latent,
+                            text_tokens,
+                            torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
+                            codes,
+                            torch.tensor([codes.shape[-1]], device=text_tokens.device),
+                            emo_cond_emb,
+                            cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_vec=emovec,
+                            use_speed=use_speed,
+                        )
+                        gpt_forward_time += time.perf_counter() - m_start_time
+            return codes, code_lens, latent, text_tokens
+
+        # 阶段二：s2mel（length regulator + CFM）与 BigVGAN 声码器
+        def s2mel_stage(gpt_result):
+            nonlocal s2mel_time, bigvgan_time
+            codes, code_lens, latent, text_tokens = gpt_result
+            with torch.no_grad():
                 dtype = None
                 with torch.amp.autocast(text_tokens.device.type, enabled=dtype is not None, dtype=dtype):
                     m_start_time = time.perf_counter()
-                    diffusion_steps = 25
-                    inference_cfg_rate = 0.7
                     latent = self.s2mel.models['gpt_layer'](latent)
                     S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
                     S_infer = S_infer.transpose(1, 2)
@@ -651,7 +1186,8 @@ class IndexTTS2:
                                                                    torch.LongTensor([cat_condition.size(1)]).to(
                                                                        cond.device),
                                                                    ref_mel, style, None, diffusion_steps,
-                                                                   inference_cfg_rate=inference_cfg_rate)
+                                                                   inference_cfg_rate=inference_cfg_rate,
+                                                                   solver=cfm_solver, t_schedule=cfm_t_schedule)
                     vc_target = vc_target[:, :, ref_mel.size(-1):]
                     s2mel_time += time.perf_counter() - m_start_time
 
@@ -664,13 +1200,21 @@ class IndexTTS2:
                 wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
                 if verbose:
                     print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
-                # wavs.append(wav[:, :-512])
-                wavs.append(wav.cpu())  # to cpu before saving
-                if stream_return:
-                    yield wav.cpu()
-                    if silence == None:
-                        silence = self.interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
-                    yield silence
+            return wav.cpu()  # to cpu before saving
+
+        if pipeline_stages and (text_stream or segments_count > 1):
+            # 流水线：GPT 在后台线程生成第 N+1 句的同时，当前线程完成第 N 句的 s2mel 与声码器，输出顺序不变
+            stage_outputs = StagePipeline(gpt_stage, s2mel_stage, max_queue_size=pipeline_queue_size,
+                                          device=self.device).run(enumerate(segments))
+        else:
+            stage_outputs = (s2mel_stage(gpt_stage(item)) for item in enumerate(segments))
+        for wav in stage_outputs:
+            wavs.append(wav)
+            if stream_return:
+                yield wav
+                if silence == None:
+                    silence = self.interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
+                yield silence
         end_time = time.perf_counter()
 
         self._set_gr_progress(0.9, "saving audio...")
@@ -694,6 +1238,7 @@ class IndexTTS2:
                 print(">> remove old wav file:", output_path)
             if os.path.dirname(output_path) != "":
                 os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            import torchaudio
             torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
             print(">> wav file saved to:", output_path)
             if stream_return:
@@ -717,14 +1262,43 @@ def find_most_similar_cosine(query_vector, matrix):
     return most_similar_index
 
 class QwenEmotion:
-    def __init__(self, model_dir):
+    def __init__(self, model_dir, idle_unload_seconds=None, max_new_tokens=128, cache_size=1024, cache_path=None):
+        """
+        Args:
+            model_dir (str): path to the Qwen emotion model. The model is loaded on first use, see `load()`.
+            idle_unload_seconds (float | None): unload the model after this many seconds without use, None to keep it.
+            max_new_tokens (int): decoding limit; decoding also stops at the closing "}" of the JSON answer.
+            cache_size (int): number of emotion texts kept in the in-memory result cache, 0 to disable it.
+            cache_path (str | None): JSON file persisting the result cache across restarts.
+        """
         self.model_dir = model_dir
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_dir,
-            torch_dtype="float16",  # "auto"
-            device_map="auto"
-        )
+        self.idle_unload_seconds = idle_unload_seconds
+        self.max_new_tokens = max_new_tokens
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 写盘在 _cache_lock 之外进行，_cache_file_lock 只串行化写文件，版本号避免旧快照覆盖新快照
+        self._cache_file_lock = threading.Lock()
+        self._cache_version = 0
+        self._cache_written_version = 0
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if not isinstance(cached, dict):
+                    raise ValueError(f"expected a JSON object, got {type(cached).__name__}")
+                self._cache.update(cached)
+            except (OSError, ValueError) as e:  # json.JSONDecodeError is a ValueError
+                warnings.warn(f"ignoring unreadable emotion cache {cache_path}: {e}", RuntimeWarning)
+                self._cache.clear()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self.tokenizer = None
+        self.model = None
+        self._lock = threading.RLock()
+        self._last_used = 0.0
+        self._unload_timer = None
         self.prompt = "文本情感分类"
         self.cn_key_to_en = {
             "高兴": "happy",
@@ -754,6 +1328,55 @@ class QwenEmotion:
         self.max_score = 1.2
         self.min_score = 0.0
 
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def load(self):
+        with self._lock:
+            if self.model is not None:
+                return
+            from modelscope import AutoModelForCausalLM
+            from transformers import AutoTokenizer
+
+            start = time.perf_counter()
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+            # 批量生成时左侧填充
+            self.tokenizer.padding_side = "left"
+            self.model = AutoModelForCausalLM.from_pretrained(
+                self.model_dir,
+                torch_dtype="float16",  # "auto"
+                device_map="auto"
+            )
+            print(f">> QwenEmotion loaded from: {self.model_dir} ({time.perf_counter() - start:.2f}s)")
+
+    def unload(self):
+        with self._lock:
+            if self._unload_timer is not None:
+                self._unload_timer.cancel()
+                self._unload_timer = None
+            if self.model is None:
+                return
+            self.model = None
+            self.tokenizer = None
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            print(">> QwenEmotion unloaded")
+
+    def _schedule_unload(self):
+        if self.idle_unload_seconds is None:
+            return
+        if self._unload_timer is not None:
+            self._unload_timer.cancel()
+        self._unload_timer = threading.Timer(self.idle_unload_seconds, self._unload_if_idle)
+        self._unload_timer.daemon = True
+        self._unload_timer.start()
+
+    def _unload_if_idle(self):
+        with self._lock:
+            if time.monotonic() - self._last_used >= self.idle_unload_seconds:
+                self.unload()
+
     def clamp_score(self, value):
         return max(self.min_score, min(self.max_score, value))
 
@@ -775,28 +1398,99 @@ class QwenEmotion:
 
         return emotion_dict
 
+    @staticmethod
+    def _cache_key(text_input):
+        return " ".join(text_input.split())
+
+    def _cache_get(self, key):
+        if self.cache_size <= 0:
+            return None
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                return dict(result)
+        return None
+
+    def _cache_put(self, results):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            for key, emotion_dict in results.items():
+                self._cache[key] = dict(emotion_dict)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            if not self.cache_path:
+                return
+            self._cache_version += 1
+            version = self._cache_version
+            snapshot = OrderedDict(self._cache)
+        # _cache_get() does not wait for the disk write
+        with self._cache_file_lock:
+            if version <= self._cache_written_version:
+                return  # a newer snapshot is already on disk
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+            self._cache_written_version = version
+
     def inference(self, text_input):
-        start = time.time()
-        messages = [
-            {"role": "system", "content": f"{self.prompt}"},
-            {"role": "user", "content": f"{text_input}"}
+        return self.inference_many([text_input])[0]
+
+    def inference_many(self, texts, batch_size=8):
+        """
+        Emotion vectors of several texts, the texts missing from the result cache are classified in batches.
+        Returns:
+            list[dict]: one emotion dictionary per text, see `convert()`.
+        """
+        keys = [self._cache_key(text) for text in texts]
+        results = {key: self._cache_get(key) for key in keys}
+        missing = [key for key, result in results.items() if result is None]
+        if missing:
+            with self._lock:
+                self.load()
+                try:
+                    detected = {}
+                    for i in range(0, len(missing), batch_size):
+                        batch = missing[i:i + batch_size]
+                        detected.update(zip(batch, self._inference_batch(batch)))
+                finally:
+                    self._last_used = time.monotonic()
+                    self._schedule_unload()
+            self._cache_put(detected)
+            results.update(detected)
+        return [dict(results[key]) for key in keys]
+
+    def _inference_batch(self, texts):
+        prompts = [
+            self.tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": f"{self.prompt}"},
+                    {"role": "user", "content": f"{text_input}"}
+                ],
+                tokenize=False,
+                add_generation_prompt=True,
+                enable_thinking=False,
+            )
+            for text_input in texts
         ]
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
-            enable_thinking=False,
-        )
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+        model_inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
 
-        # conduct text completion
+        # conduct text completion, the answer is a small JSON dict: stop at its closing brace
         generated_ids = self.model.generate(
             **model_inputs,
-            max_new_tokens=32768,
+            max_new_tokens=self.max_new_tokens,
+            stop_strings=["}"],
+            tokenizer=self.tokenizer,
             pad_token_id=self.tokenizer.eos_token_id
         )
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
+        input_length = model_inputs.input_ids.shape[1]
+        return [self._parse_output(text_input, generated_ids[i][input_length:].tolist())
+                for i, text_input in enumerate(texts)]
 
+    def _parse_output(self, text_input, output_ids):
         # parsing thinking content
         try:
             # rindex finding 151668 (</think>)
@@ -8,6 +8,8 @@ import json
 import argparse
 from torch.nn.parallel import DistributedDataParallel as DDP
 
+from indextts.utils.checkpoint import load_state
+
 def str2bool(v):
     if isinstance(v, bool):
         return v
@@ -585,7 +587,7 @@ def load_checkpoint2(
     is_distributed=False,
     load_ema=False,
 ):
-    state = torch.load(path, map_location="cpu")
+    state = load_state(path)
     params = state["net"]
     if load_ema and "ema" in state:
         print("Loading EMA")
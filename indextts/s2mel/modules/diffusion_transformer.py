@@ -1,5 +1,6 @@
 import torch
 from torch import nn
+import torch.nn.functional as F
 import math
 
 from indextts.s2mel.modules.gpt_fast.model import ModelArgs, Transformer
@@ -183,7 +184,36 @@ class DiT(torch.nn.Module):
     def setup_caches(self, max_batch_size, max_seq_length):
         self.transformer.setup_caches(max_batch_size, max_seq_length, use_kv_cache=False)
         
-    def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False):
+    def prepare(self, prompt_x, x_lens, style, cond):
+        """
+        Precompute the parts of `forward()` that only depend on the conditioning, not on `x` or `t`, so that an
+        ODE solver can compute them once and reuse them for all of its steps via `forward(..., prepared=...)`.
+        Only used for inference, `forward()` ignores it when class dropout is active.
+            prompt_x, x_lens, style, cond: same as `forward()`
+        Returns:
+            dict: the `x` slice of the `cond_x_merge_linear` weight, the projected conditioning part of
+            `cond_x_merge_linear`, the style token, `x_mask`, `input_pos` and the key padding attention mask
+        """
+        T = prompt_x.size(-1)
+        # cond_x_merge_linear(cat([x, prompt_x, cond, style])) == x @ W_x^T + (cat([prompt_x, cond, style]) @ W_c^T + b)
+        cond_in = [prompt_x.transpose(1, 2), self.cond_projection(cond)]
+        if self.transformer_style_condition and not self.style_as_token:
+            cond_in.append(style[:, None, :].expand(-1, T, -1))
+        weight = self.cond_x_merge_linear.weight
+        prepared = {
+            "x_weight": weight[:, :self.in_channels],
+            "cond_in": F.linear(torch.cat(cond_in, dim=-1), weight[:, self.in_channels:], self.cond_x_merge_linear.bias),
+        }
+        if self.style_as_token:
+            prepared["style_token"] = self.style_in(style).unsqueeze(1)
+        seq_len = T + self.style_as_token + self.time_as_token
+        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=seq_len).to(prompt_x.device).unsqueeze(1)
+        prepared["x_mask"] = x_mask
+        prepared["input_pos"] = self.input_pos[:seq_len]
+        prepared["attn_mask"] = x_mask[:, None, :] if not self.is_causal else None
+        return prepared
+
+    def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False, prepared=None):
         """
             x (torch.Tensor): random noise
             prompt_x (torch.Tensor): reference mel + zero mel
@@ -196,6 +226,7 @@ class DiT(torch.nn.Module):
                 shape: (batch_size, 192)
             cond (torch.Tensor): semantic info of reference audio and altered audio
                 shape: (batch_size, mel_timesteps(795+1069), 512)
+            prepared (dict): output of `prepare()` for the same prompt_x / x_lens / style / cond, optional
         
         """
         class_dropout = False
@@ -210,33 +241,45 @@ class DiT(torch.nn.Module):
 
 
         t1 = self.t_embedder(t)  # (N, D) # t1 [2, 512]
-        cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
-
         x = x.transpose(1, 2) # [2,1863,80]
-        prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
 
-        x_in = torch.cat([x, prompt_x, cond], dim=-1) # 80+80+512=672 [2, 1863, 672]
-        
-        if self.transformer_style_condition and not self.style_as_token: # True and True
-            x_in = torch.cat([x_in, style[:, None, :].repeat(1, T, 1)], dim=-1) #[2, 1863, 864]
-            
-        if class_dropout: #False
-            x_in[..., self.in_channels:] = x_in[..., self.in_channels:] * 0 # 80维后全置为0
-            
-        x_in = self.cond_x_merge_linear(x_in)  # (N, T, D) [2, 1863, 512]
-        
-        if self.style_as_token: # False
-            style = self.style_in(style)
-            style = torch.zeros_like(style) if class_dropout else style
-            x_in = torch.cat([style.unsqueeze(1), x_in], dim=1)
-            
-        if self.time_as_token: # False
-            x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
-            
-        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=x_in.size(1)).to(x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
-        input_pos = self.input_pos[:x_in.size(1)]  # (T,) range（0，1863）
-        x_mask_expanded = x_mask[:, None, :].repeat(1, 1, x_in.size(1), 1) if not self.is_causal else None # torch.Size([1, 1, 1863, 1863]
-        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, x_mask_expanded) # [2, 1863, 512]
+        if prepared is not None and not class_dropout:
+            # only the x part of cond_x_merge_linear changes between diffusion steps
+            x_in = F.linear(x, prepared["x_weight"]) + prepared["cond_in"]  # (N, T, D)
+            if self.style_as_token:
+                x_in = torch.cat([prepared["style_token"], x_in], dim=1)
+            if self.time_as_token:
+                x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
+            x_mask = prepared["x_mask"]
+            input_pos = prepared["input_pos"]
+            attn_mask = prepared["attn_mask"]
+        else:
+            cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
+            prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
+
+            x_in = torch.cat([x, prompt_x, cond], dim=-1) # 80+80+512=672 [2, 1863, 672]
+
+            if self.transformer_style_condition and not self.style_as_token: # True and True
+                x_in = torch.cat([x_in, style[:, None, :].repeat(1, T, 1)], dim=-1) #[2, 1863, 864]
+
+            if class_dropout: #False
+                x_in[..., self.in_channels:] = x_in[..., self.in_channels:] * 0 # 80维后全置为0
+
+            x_in = self.cond_x_merge_linear(x_in)  # (N, T, D) [2, 1863, 512]
+
+            if self.style_as_token: # False
+                style = self.style_in(style)
+                style = torch.zeros_like(style) if class_dropout else style
+                x_in = torch.cat([style.unsqueeze(1), x_in], dim=1)
+
+            if self.time_as_token: # False
+                x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
+
+            x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=x_in.size(1)).to(x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
+            input_pos = self.input_pos[:x_in.size(1)]  # (T,) range（0，1863）
+            # key padding mask, broadcast over heads and queries by SDPA instead of a dense (B, 1, T, T) copy
+            attn_mask = x_mask[:, None, :] if not self.is_causal else None # torch.Size([1, 1, 1, 1863]
+        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, attn_mask) # [2, 1863, 512]
         x_res = x_res[:, 1:] if self.time_as_token else x_res
         x_res = x_res[:, 1:] if self.style_as_token else x_res
         
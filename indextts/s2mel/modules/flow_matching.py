@@ -8,6 +8,24 @@ from indextts.s2mel.modules.commons import sequence_mask
 
 from tqdm import tqdm
 
+# ODE solvers of `BASECFM.solve()` -> estimator calls per step
+SOLVERS = {"euler": 1, "heun": 2, "midpoint": 2, "rk4": 4, "dpm_multistep": 1}
+T_SCHEDULES = ("linear", "cosine")
+
+
+def get_t_span(n_timesteps, t_schedule="linear", device=None):
+    """
+    Time steps from 0 (noise) to 1 (mel), shape: (n_timesteps + 1,).
+    "cosine" warps them as 1 - cos(pi / 2 * t), i.e. smaller steps near the noise end.
+    """
+    t_span = torch.linspace(0, 1, n_timesteps + 1, device=device)
+    if t_schedule == "cosine":
+        t_span = t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
+    elif t_schedule != "linear":
+        raise ValueError(f"Unknown t_schedule {t_schedule}, expected one of {T_SCHEDULES}")
+    return t_span
+
+
 class BASECFM(torch.nn.Module, ABC):
     def __init__(
         self,
@@ -28,7 +46,8 @@ class BASECFM(torch.nn.Module, ABC):
             self.zero_prompt_speech_token = False
 
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5):
+    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5,
+                  solver="euler", t_schedule="linear"):
         """Forward diffusion
 
         Args:
@@ -43,6 +62,8 @@ class BASECFM(torch.nn.Module, ABC):
             f0: None
             n_timesteps (int): number of diffusion steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
+            solver (str, optional): ODE solver, one of `SOLVERS`. Defaults to "euler".
+            t_schedule (str, optional): time step schedule, one of `T_SCHEDULES`. Defaults to "linear".
 
         Returns:
             sample: generated mel-spectrogram
@@ -50,13 +71,62 @@ class BASECFM(torch.nn.Module, ABC):
         """
         B, T = mu.size(0), mu.size(1)
         z = torch.randn([B, self.in_channels, T], device=mu.device) * temperature
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
-        # t_span = t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
-        return self.solve_euler(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
+        t_span = get_t_span(n_timesteps, t_schedule, device=mu.device)
+        return self.solve(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate, solver=solver)
+
+    def solve(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5, solver="euler"):
+        """
+        Integrate the flow from noise `x` along `t_span` with the given solver, see `SOLVERS`.
+        Note that `x` and `mu` are modified in place.
+        """
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown CFM solver {solver}, expected one of {list(SOLVERS)}")
+        return getattr(self, f"solve_{solver}")(x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
+
+    def _apply_prompt(self, x, prompt, mu):
+        prompt_len = prompt.size(-1)
+        prompt_x = torch.zeros_like(x)
+        prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
+        x[..., :prompt_len] = 0
+        if self.zero_prompt_speech_token:
+            mu[..., :prompt_len] = 0
+        return prompt_x, prompt_len
+
+    def _velocity_fn(self, x_lens, prompt_x, style, mu, inference_cfg_rate):
+        """
+        Returns `velocity(x, t)`, the (classifier-free guided) estimator output dphi/dt at state `x` and time `t`.
+        The step-invariant part of the estimator input is computed once here with `DiT.prepare()`.
+        """
+        if inference_cfg_rate > 0:
+            # Stack original and CFG (null) inputs for batched processing, they do not change between steps
+            stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
+            stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
+            stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
+            stacked_x_lens = torch.cat([x_lens, x_lens], dim=0)
+            prepared = self.estimator.prepare(stacked_prompt_x, stacked_x_lens, stacked_style, stacked_mu)
+
+            def velocity(x, t):
+                stacked_x = torch.cat([x, x], dim=0)
+                stacked_t = t.expand(stacked_x.size(0))
+                # Perform a single forward pass for both original and CFG inputs
+                stacked_dphi_dt = self.estimator(
+                    stacked_x, stacked_prompt_x, stacked_x_lens, stacked_t, stacked_style, stacked_mu,
+                    prepared=prepared,
+                )
+                # Split the output back into the original and CFG components
+                dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
+                # Apply CFG formula
+                return (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
+        else:
+            prepared = self.estimator.prepare(prompt_x, x_lens, style, mu)
+
+            def velocity(x, t):
+                return self.estimator(x, prompt_x, x_lens, t.expand(x.size(0)), style, mu, prepared=prepared)
+        return velocity
 
     def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
         """
-        Fixed euler solver for ODEs.
+        Fixed euler solver for ODEs, 1 estimator call per step.
         Args:
             x (torch.Tensor): random noise
             t_span (torch.Tensor): n_timesteps interpolated
@@ -70,49 +140,87 @@ class BASECFM(torch.nn.Module, ABC):
             style (torch.Tensor): reference global style
                 shape: (batch_size, 192)
         """
-        t, _, _ = t_span[0], t_span[-1], t_span[1] - t_span[0]
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(x_lens, prompt_x, style, mu, inference_cfg_rate)
+        for step in tqdm(range(1, len(t_span))):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            x = x + dt * velocity(x, t)
+            x[:, :, :prompt_len] = 0
+        return x
 
-        # I am storing this because I can later plot it by putting a debugger here and saving it to a file
-        # Or in future might add like a return_all_steps flag
-        sol = []
-        # apply prompt
-        prompt_len = prompt.size(-1)
-        prompt_x = torch.zeros_like(x)
-        prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
-        x[..., :prompt_len] = 0
-        if self.zero_prompt_speech_token:
-            mu[..., :prompt_len] = 0
+    def solve_heun(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """
+        Heun's (explicit trapezoidal) second order solver, 2 estimator calls per step. Same args as `solve_euler()`.
+        """
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(x_lens, prompt_x, style, mu, inference_cfg_rate)
         for step in tqdm(range(1, len(t_span))):
-            dt = t_span[step] - t_span[step - 1]
-            if inference_cfg_rate > 0:
-                # Stack original and CFG (null) inputs for batched processing
-                stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
-                stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
-                stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
-                stacked_x = torch.cat([x, x], dim=0)
-                stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            k1 = velocity(x, t)
+            x_pred = x + dt * k1
+            x_pred[:, :, :prompt_len] = 0
+            k2 = velocity(x_pred, t + dt)
+            x = x + dt * 0.5 * (k1 + k2)
+            x[:, :, :prompt_len] = 0
+        return x
 
-                # Perform a single forward pass for both original and CFG inputs
-                stacked_dphi_dt = self.estimator(
-                    stacked_x, stacked_prompt_x, x_lens, stacked_t, stacked_style, stacked_mu,
-                )
+    def solve_midpoint(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """
+        Explicit midpoint second order solver, 2 estimator calls per step. Same args as `solve_euler()`.
+        """
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(x_lens, prompt_x, style, mu, inference_cfg_rate)
+        for step in tqdm(range(1, len(t_span))):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            x_mid = x + 0.5 * dt * velocity(x, t)
+            x_mid[:, :, :prompt_len] = 0
+            x = x + dt * velocity(x_mid, t + 0.5 * dt)
+            x[:, :, :prompt_len] = 0
+        return x
 
-                # Split the output back into the original and CFG components
-                dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
+    def solve_rk4(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """
+        Classic fourth order Runge-Kutta solver, 4 estimator calls per step. Same args as `solve_euler()`.
+        """
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(x_lens, prompt_x, style, mu, inference_cfg_rate)
 
-                # Apply CFG formula
-                dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
-            else:
-                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+        def shifted(k, scale):
+            y = x + scale * k
+            y[:, :, :prompt_len] = 0
+            return y
 
-            x = x + dt * dphi_dt
-            t = t + dt
-            sol.append(x)
-            if step < len(t_span) - 1:
-                dt = t_span[step + 1] - t
+        for step in tqdm(range(1, len(t_span))):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            k1 = velocity(x, t)
+            k2 = velocity(shifted(k1, 0.5 * dt), t + 0.5 * dt)
+            k3 = velocity(shifted(k2, 0.5 * dt), t + 0.5 * dt)
+            k4 = velocity(shifted(k3, dt), t + dt)
+            x = x + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            x[:, :, :prompt_len] = 0
+        return x
+
+    def solve_dpm_multistep(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """
+        Second order multistep solver in the spirit of DPM-Solver++(2M): the velocity of the previous step is
+        reused (variable step Adams-Bashforth), so it keeps 1 estimator call per step like `solve_euler()`.
+        The first step falls back to euler. Same args as `solve_euler()`.
+        """
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(x_lens, prompt_x, style, mu, inference_cfg_rate)
+        prev_v, prev_dt = None, None
+        for step in tqdm(range(1, len(t_span))):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            v = velocity(x, t)
+            if prev_v is None:
+                x = x + dt * v
+            else:
+                r = dt / prev_dt
+                x = x + dt * ((1 + 0.5 * r) * v - 0.5 * r * prev_v)
             x[:, :, :prompt_len] = 0
+            prev_v, prev_dt = v, dt
+        return x
 
-        return sol[-1]
     def forward(self, x1, x_lens, prompt_lens, mu, style):
         """Computes diffusion loss
 
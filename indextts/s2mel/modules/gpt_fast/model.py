@@ -147,7 +147,6 @@ class Transformer(nn.Module):
 
         self.freqs_cis = precompute_freqs_cis(self.config.block_size, self.config.head_dim,
                                               self.config.rope_base, dtype).to(device)
-        self.causal_mask = torch.tril(torch.ones(self.max_seq_length, self.max_seq_length, dtype=torch.bool)).to(device)
         self.use_kv_cache = use_kv_cache
         self.uvit_skip_connection = self.config.uvit_skip_connection
         if self.uvit_skip_connection:
@@ -168,11 +167,12 @@ class Transformer(nn.Module):
                 ) -> Tensor:
         assert self.freqs_cis is not None, "Caches must be initialized first"
         if mask is None: # in case of non-causal model
+            # causal mask rows for input_pos only, instead of a preallocated (max_seq_length, max_seq_length) one
             if not self.training and self.use_kv_cache:
-                mask = self.causal_mask[None, None, input_pos]
+                key_pos = torch.arange(self.max_seq_length, device=input_pos.device)
             else:
-                mask = self.causal_mask[None, None, input_pos]
-                mask = mask[..., input_pos]
+                key_pos = input_pos
+            mask = (input_pos[:, None] >= key_pos[None, :])[None, None]
         freqs_cis = self.freqs_cis[input_pos]
         if context is not None:
             context_freqs_cis = self.freqs_cis[context_input_pos]
@@ -0,0 +1,49 @@
+import threading
+
+
+class BackgroundModel:
+    """
+    Build a model in a background thread, so that a server can answer health probes while the model loads.
+
+    Attribute access is forwarded to the model and blocks until it is ready, so existing request handlers can use
+    the proxy like the model itself; `ready` / `error` report the loading state without blocking.
+    """
+
+    def __init__(self, factory, name="model"):
+        """
+        Args:
+            factory (callable): builds and returns the model, called once in the background thread.
+        """
+        self._factory = factory
+        self._model = None
+        self._error = None
+        self._loaded = threading.Event()
+        self._thread = threading.Thread(target=self._load, name=f"{name}-loader", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            self._model = self._factory()
+        except BaseException as e:
+            self._error = e
+            raise
+        finally:
+            self._loaded.set()
+
+    @property
+    def ready(self):
+        return self._loaded.is_set() and self._error is None
+
+    @property
+    def error(self):
+        return self._error
+
+    def get(self, timeout=None):
+        if not self._loaded.wait(timeout):
+            raise TimeoutError("model is still loading")
+        if self._error is not None:
+            raise RuntimeError("model failed to load") from self._error
+        return self._model
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import shutil
+
+import torch
+from omegaconf import OmegaConf
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+BUNDLE_FORMAT = "indextts2-bundle"
+BUNDLE_VERSION = "1"
+MANIFEST_NAME = "manifest.json"
+WEIGHTS_NAME = "model.safetensors"
+# 模型组件，各组件的权重以 "<组件名>." 为前缀保存在 WEIGHTS_NAME 中
+COMPONENTS = ("gpt", "semantic_model", "semantic_codec", "s2mel", "campplus", "bigvgan")
+# 不属于任何模块的张量
+EXTRA_TENSORS = ("semantic_mean", "semantic_std", "emo_matrix", "spk_matrix")
+W2V_BERT_DIR = "w2v_bert"
+BIGVGAN_CONFIG = "bigvgan_config.json"
+
+
+def is_bundle(model_dir):
+    return os.path.isfile(os.path.join(model_dir, MANIFEST_NAME))
+
+
+def read_manifest(model_dir):
+    with open(os.path.join(model_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"{model_dir} is not an IndexTTS2 bundle")
+    if manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"unsupported IndexTTS2 bundle version: {manifest.get('version')}")
+    return manifest
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(16 * 1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    # 固定键顺序与格式，保证多次导出的文件逐字节一致
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+
+
+def _module_tensors(name, module):
+    tensors = {}
+    for key, value in module.state_dict().items():
+        if name == "gpt" and key.startswith("inference_model."):
+            # post_init_gpt2_config() 创建的推理封装，与 gpt 共享权重，加载时重新创建
+            continue
+        if name == "gpt" and key.startswith("gpt.wte."):
+            # post_init_gpt2_config() 中 gpt.wte = mel_embedding 的别名，新建的 UnifiedVoice 已删除 wte
+            continue
+        key = key.replace("_orig_mod.", "")  # torch.compile 的封装
+        tensors[f"{name}.{key}"] = value.detach().to("cpu").contiguous().clone()
+    return tensors
+
+
+def export_bundle(tts, output_dir, include_qwen_emo=True):
+    """
+    Export the loaded models of an `IndexTTS2` instance as an offline bundle: one safetensors file with the weights
+    of every component exactly as used for inference (BigVGAN weight norm removed, GPT already cast to fp16 when
+    `tts.use_fp16`), the configs, the BPE model, the glossary and a manifest with the SHA-256 of every file.
+    `IndexTTS2(model_dir=output_dir, cfg_path=f"{output_dir}/config.yaml")` then loads it without network access.
+    The output only depends on the exported weights, so exports of the same models are byte-for-byte identical.
+    Args:
+        tts (IndexTTS2): loaded without `use_torch_compile` / `use_accel`.
+        output_dir (str): bundle directory.
+        include_qwen_emo (bool): copy the QwenEmotion model directory into the bundle.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cfg = tts.cfg
+    modules = {
+        "gpt": tts.gpt,
+        "semantic_model": tts.semantic_model,
+        "semantic_codec": tts.semantic_codec,
+        "s2mel": tts.s2mel,
+        "campplus": tts.campplus_model,
+        "bigvgan": tts.bigvgan,
+    }
+    tensors = {}
+    for name in COMPONENTS:
+        tensors.update(_module_tensors(name, modules[name]))
+    tensors["semantic_mean"] = tts.semantic_mean.detach().to("cpu").contiguous().clone()
+    tensors["semantic_std"] = tts.semantic_std.detach().to("cpu").contiguous().clone()
+    tensors["emo_matrix"] = torch.cat(tts.emo_matrix).to("cpu").contiguous()
+    tensors["spk_matrix"] = torch.cat(tts.spk_matrix).to("cpu").contiguous()
+    weights_path = os.path.join(output_dir, WEIGHTS_NAME)
+    save_file(tensors, f"{weights_path}.tmp", metadata={"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION})
+    os.replace(f"{weights_path}.tmp", weights_path)
+
+    OmegaConf.save(cfg, os.path.join(output_dir, "config.yaml"))
+    w2v_dir = os.path.join(output_dir, W2V_BERT_DIR)
+    os.makedirs(w2v_dir, exist_ok=True)
+    tts.extract_features.save_pretrained(w2v_dir)
+    tts.semantic_model.encoder.config.save_pretrained(w2v_dir)
+    bigvgan_h = {k: v for k, v in tts.bigvgan.h.items() if k != "use_cuda_kernel"}
+    _write_json(os.path.join(output_dir, BIGVGAN_CONFIG), bigvgan_h)
+
+    bpe_target = os.path.join(output_dir, cfg.dataset["bpe_model"])
+    os.makedirs(os.path.dirname(bpe_target), exist_ok=True)
+    shutil.copyfile(tts.bpe_path, bpe_target)
+    if os.path.exists(tts.glossary_path):
+        shutil.copyfile(tts.glossary_path, os.path.join(output_dir, "glossary.yaml"))
+    if include_qwen_emo and tts.qwen_emo is not None:
+        shutil.copytree(tts.qwen_emo.model_dir, os.path.join(output_dir, cfg.qwen_emo_path), dirs_exist_ok=True)
+
+    files = {}
+    for root, _, names in os.walk(output_dir):
+        for file_name in names:
+            path = os.path.join(root, file_name)
+            rel_path = os.path.relpath(path, output_dir).replace(os.sep, "/")
+            if rel_path != MANIFEST_NAME:
+                files[rel_path] = _sha256(path)
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "model_version": str(tts.model_version) if tts.model_version is not None else None,
+        "gpt_dtype": str(tts.gpt.mel_head.weight.dtype).replace("torch.", ""),
+        "semantic_output_layer": tts.semantic_model.output_layer,
+        "components": {name: sum(1 for key in tensors if key.startswith(f"{name}.")) for name in COMPONENTS},
+        "files": files,
+    }
+    _write_json(os.path.join(output_dir, MANIFEST_NAME), manifest)
+    return manifest
+
+
+def verify_bundle(model_dir):
+    """
+    Check the SHA-256 of every bundle file against the manifest. Returns the list of mismatching files.
+    """
+    manifest = read_manifest(model_dir)
+    mismatched = []
+    for rel_path, digest in manifest["files"].items():
+        path = os.path.join(model_dir, rel_path)
+        if not os.path.isfile(path) or _sha256(path) != digest:
+            mismatched.append(rel_path)
+    return mismatched
+
+
+def _load_component(module, weights_path, name):
+    prefix = f"{name}."
+    # safetensors 以 mmap 方式读取；assign=True 直接使用读取的张量，不再拷贝到随机初始化的参数中
+    with safe_open(weights_path, framework="pt", device="cpu") as f:
+        state = {key[len(prefix):]: f.get_tensor(key) for key in f.keys() if key.startswith(prefix)}
+    module.load_state_dict(state, strict=True, assign=True)
+    return module
+
+
+def bundle_loaders(tts, model_dir):
+    """
+    Component loaders of `IndexTTS2.__init__` that read an offline bundle instead of the original checkpoints and
+    model hubs. Returns a dict that replaces the corresponding entries of the default loaders.
+    """
+    from transformers import SeamlessM4TFeatureExtractor, Wav2Vec2BertConfig, Wav2Vec2BertModel
+
+    from indextts.gpt.model_v2 import UnifiedVoice
+    from indextts.s2mel.modules.bigvgan import bigvgan
+    from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
+    from indextts.s2mel.modules.commons import MyModel
+    from indextts.utils.maskgct_utils import TruncatedSemanticModel, build_semantic_codec
+
+    manifest = read_manifest(model_dir)
+    weights_path = os.path.join(model_dir, WEIGHTS_NAME)
+    model_version = tts.cfg.version if hasattr(tts.cfg, "version") else None
+    if model_version is not None and manifest.get("model_version") not in (None, str(model_version)):
+        print(f">> Warning: bundle model_version {manifest.get('model_version')} != config version {model_version}")
+
+    def load_gpt():
+        gpt = UnifiedVoice(**tts.cfg.gpt, use_accel=tts.use_accel)
+        _load_component(gpt, weights_path, "gpt")
+        tts.gpt_path = weights_path
+        tts.gpt = gpt.to(tts.device, dtype=torch.float16 if tts.use_fp16 else torch.float32).eval()
+        print(">> GPT weights restored from:", weights_path)
+
+    def load_semantic_model():
+        w2v_dir = os.path.join(model_dir, W2V_BERT_DIR)
+        tts.extract_features = SeamlessM4TFeatureExtractor.from_pretrained(w2v_dir)
+        output_layer = manifest["semantic_output_layer"]
+        config = Wav2Vec2BertConfig.from_pretrained(w2v_dir)
+        config.num_hidden_layers = output_layer  # 只构建保留的层
+        semantic_model = TruncatedSemanticModel(Wav2Vec2BertModel(config), output_layer)
+        _load_component(semantic_model, weights_path, "semantic_model")
+        tts.semantic_model = semantic_model.to(tts.device).eval()
+        with safe_open(weights_path, framework="pt", device="cpu") as f:
+            tts.semantic_mean = f.get_tensor("semantic_mean").to(tts.device)
+            tts.semantic_std = f.get_tensor("semantic_std").to(tts.device)
+
+    def load_semantic_codec():
+        semantic_codec = build_semantic_codec(tts.cfg.semantic_codec)
+        _load_component(semantic_codec, weights_path, "semantic_codec")
+        tts.semantic_codec = semantic_codec.to(tts.device).eval()
+        print('>> semantic_codec weights restored from: {}'.format(weights_path))
+
+    def load_s2mel():
+        s2mel = MyModel(tts.cfg.s2mel, use_gpt_latent=True)
+        _load_component(s2mel, weights_path, "s2mel")
+        tts.s2mel = s2mel.to(tts.device)
+        tts.s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
+        if tts.use_torch_compile:
+            print(">> Enabling torch.compile optimization")
+            tts.s2mel.enable_torch_compile()
+        tts.s2mel.eval()
+        print(">> s2mel weights restored from:", weights_path)
+
+    def load_campplus():
+        campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
+        _load_component(campplus_model, weights_path, "campplus")
+        tts.campplus_model = campplus_model.to(tts.device).eval()
+        print(">> campplus_model weights restored from:", weights_path)
+
+    def load_bigvgan():
+        h = bigvgan.load_hparams_from_json(os.path.join(model_dir, BIGVGAN_CONFIG))
+        vocoder = bigvgan.BigVGAN(h, use_cuda_kernel=tts.use_cuda_kernel)
+        vocoder.remove_weight_norm()  # 导出的权重已去除 weight norm
+        _load_component(vocoder, weights_path, "bigvgan")
+        tts.bigvgan = vocoder.to(tts.device).eval()
+        print(">> bigvgan weights restored from:", weights_path)
+
+    def load_emo_spk_matrix():
+        tts.emo_num = list(tts.cfg.emo_num)
+        with safe_open(weights_path, framework="pt", device="cpu") as f:
+            tts.emo_matrix = torch.split(f.get_tensor("emo_matrix").to(tts.device), tts.emo_num)
+            tts.spk_matrix = torch.split(f.get_tensor("spk_matrix").to(tts.device), tts.emo_num)
+
+    return {
+        "gpt": load_gpt,
+        "semantic_model": load_semantic_model,
+        "semantic_codec": load_semantic_codec,
+        "s2mel": load_s2mel,
+        "campplus": load_campplus,
+        "bigvgan": load_bigvgan,
+        "emo_spk_matrix": load_emo_spk_matrix,
+    }
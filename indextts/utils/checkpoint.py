@@ -22,8 +22,23 @@ import torch
 import yaml
 
 
+def load_state(path: str, map_location='cpu'):
+    """
+    Load a checkpoint without reading the whole file up front: safetensors files and zip-format torch
+    checkpoints are memory-mapped, legacy torch checkpoints fall back to a regular `torch.load`.
+    """
+    if str(path).endswith('.safetensors'):
+        from safetensors.torch import load_file
+        return load_file(path, device=str(map_location))
+    try:
+        return torch.load(path, map_location=map_location, mmap=True)
+    except RuntimeError:
+        # mmap 仅支持 zip 格式（torch>=1.6 默认）的 checkpoint
+        return torch.load(path, map_location=map_location)
+
+
 def load_checkpoint(model: torch.nn.Module, model_pth: str) -> dict:
-    checkpoint = torch.load(model_pth, map_location='cpu')
+    checkpoint = load_state(model_pth)
     checkpoint = checkpoint['model'] if 'model' in checkpoint else checkpoint
     model.load_state_dict(checkpoint, strict=True)
     info_path = re.sub('.pth$', '.yaml', model_pth)
@@ -32,3 +47,33 @@ def load_checkpoint(model: torch.nn.Module, model_pth: str) -> dict:
         with open(info_path, 'r') as fin:
             configs = yaml.load(fin, Loader=yaml.FullLoader)
     return configs
+
+
+def load_components(loaders: dict, parallel: bool = True, max_workers: int = None):
+    """
+    Run independent model loaders, concurrently in a thread pool when `parallel`. Checkpoint I/O,
+    deserialization and host-to-device copies release the GIL, so threads overlap most of the load time.
+    Args:
+        loaders (dict): component name -> callable without arguments.
+    Returns:
+        (dict, dict): component name -> return value, component name -> load time in seconds
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    timings = {}
+
+    def timed(name):
+        start = time.perf_counter()
+        result = loaders[name]()
+        timings[name] = time.perf_counter() - start
+        return result
+
+    if not parallel:
+        results = {name: timed(name) for name in loaders}
+        return results, timings
+    with ThreadPoolExecutor(max_workers=max_workers or len(loaders), thread_name_prefix="model-loader") as executor:
+        futures = {name: executor.submit(timed, name) for name in loaders}
+        # 按提交顺序取结果，任一组件加载失败时抛出其异常
+        results = {name: future.result() for name, future in futures.items()}
+    return results, timings
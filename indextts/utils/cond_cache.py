@@ -0,0 +1,112 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _tensor_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, dict):
+        return sum(_tensor_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+
+@functools.lru_cache(maxsize=1024)
+def _hash_file(path, mtime_ns, size):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def audio_content_key(audio_path):
+    """
+    Content hash of a reference audio file, so that the same voice uploaded under different paths shares
+    one cache entry. The digest is memoized on (path, mtime, size) to avoid re-reading unchanged files.
+    """
+    path = os.path.abspath(audio_path)
+    st = os.stat(path)
+    return _hash_file(path, st.st_mtime_ns, st.st_size)
+
+
+class ConditioningCache:
+    """
+    Thread-safe LRU of conditioning bundles (tensors or dicts of tensors) bounded by their total tensor size.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        """
+        Args:
+            max_bytes (int): byte budget of all cached tensors, the least recently used entries are evicted first.
+                A value <= 0 disables caching.
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = _tensor_bytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.current_bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
-from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import os
+import threading
 import traceback
 import re
 from typing import List, Union, overload
@@ -10,7 +13,12 @@ from sentencepiece import SentencePieceProcessor
 
 
 class TextNormalizer:
-    def __init__(self, enable_glossary=False):
+    def __init__(self, enable_glossary=False, cache_size=1024):
+        """
+        Args:
+            enable_glossary (bool): apply `term_glossary` before normalization.
+            cache_size (int): number of normalized texts kept in the LRU result cache, 0 to disable it.
+        """
         self.zh_normalizer = None
         self.en_normalizer = None
         self.char_rep_map = {
@@ -73,10 +81,22 @@ class TextNormalizer:
         # }
         self.term_glossary = dict()
 
+        # 预编译的替换正则，在 load() 中生成
+        self._char_rep_pattern = None
+        self._zh_char_rep_pattern = None
+        # 术语词汇表匹配器：所有术语合并为一个正则（长术语优先），term_glossary 变化时自动重建
+        self._glossary_pattern = None
+        self._glossary_terms = dict()  # 小写术语 -> 原术语
+        self._glossary_source = None  # 构建匹配器时的 term_glossary 快照
+        self._glossary_version = 0
+        # normalize() 结果的 LRU 缓存，key 为 (原文本, 术语表版本)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
     def match_email(self, email):
         # 正则表达式匹配邮箱格式：数字英文@数字英文.英文
-        pattern = r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$"
-        return re.match(pattern, email) is not None
+        return TextNormalizer.EMAIL_RE.match(email) is not None
 
     PINYIN_TONE_PATTERN = r"(?<![a-z])((?:[bpmfdtnlgkhjqxzcsryw]|[zcs]h)?(?:[aeiouüv]|[ae]i|u[aio]|ao|ou|i[aue]|[uüv]e|[uvü]ang?|uai|[aeiuv]n|[aeio]ng|ia[no]|i[ao]ng)|ng|er)([1-5])"
     """
@@ -101,21 +121,37 @@ class TextNormalizer:
     # 匹配常见英语缩写 's，仅用于替换为 is，不匹配所有 's
     ENGLISH_CONTRACTION_PATTERN = r"(what|where|who|which|how|t?here|it|s?he|that|this)'s"
 
+    # 预编译正则
+    EMAIL_RE = re.compile(r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$")
+    CHINESE_CHAR_RE = re.compile(r"[\u4e00-\u9fff]")
+    ALPHA_RE = re.compile(r"[a-zA-Z]")
+    PINYIN_TONE_RE = re.compile(PINYIN_TONE_PATTERN, re.IGNORECASE)
+    NAME_RE = re.compile(NAME_PATTERN, re.IGNORECASE)
+    TECH_TERM_RE = re.compile(TECH_TERM_PATTERN)
+    ENGLISH_CONTRACTION_RE = re.compile(ENGLISH_CONTRACTION_PATTERN, re.IGNORECASE)
+    JQX_PINYIN_RE = re.compile(r"([jqx])[uü](n|e|an)*(\d)", re.IGNORECASE)
+    TECH_HYPHEN_PLACEHOLDER_RE = re.compile(r'\s*<H>\s*')
+
 
     def use_chinese(self, s):
-        has_chinese = bool(re.search(r"[\u4e00-\u9fff]", s))
-        has_alpha = bool(re.search(r"[a-zA-Z]", s))
+        has_chinese = bool(TextNormalizer.CHINESE_CHAR_RE.search(s))
+        has_alpha = bool(TextNormalizer.ALPHA_RE.search(s))
         is_email = self.match_email(s)
         if has_chinese or not has_alpha or is_email:
             return True
 
-        has_pinyin = bool(re.search(TextNormalizer.PINYIN_TONE_PATTERN, s, re.IGNORECASE))
+        has_pinyin = bool(TextNormalizer.PINYIN_TONE_RE.search(s))
         return has_pinyin
 
+    def _compile_char_rep_patterns(self):
+        self._char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
+        self._zh_char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
+
     def load(self):
         # print(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
         # sys.path.append(model_dir)
         import platform
+        self._compile_char_rep_patterns()
         if self.zh_normalizer is not None and self.en_normalizer is not None:
             return
         if platform.system() != "Linux":  # Mac and Windows
@@ -137,12 +173,41 @@ class TextNormalizer:
             )
             self.en_normalizer = NormalizerEn(overwrite_cache=False)
 
-    def normalize(self, text: str) -> str:
+    def normalize(self, text: str, use_chinese: bool = None) -> str:
+        """
+        Args:
+            use_chinese (bool | None): force the zh / en normalizer, e.g. when `text` is one chunk of a longer
+                document; None to detect it from `text` with `use_chinese()`.
+        """
         if not self.zh_normalizer or not self.en_normalizer:
             print("Error, text normalizer is not initialized !!!")
             return ""
-        if self.use_chinese(text):
-            text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+        if self.cache_size <= 0:
+            return self._normalize(text, use_chinese)
+        key = (text, use_chinese, self._refresh_glossary() if self.enable_glossary else -1)
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                return result
+        result = self._normalize(text, use_chinese)
+        with self._cache_lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _normalize(self, text: str, use_chinese: bool = None) -> str:
+        if self._char_rep_pattern is None:
+            self._compile_char_rep_patterns()
+        if use_chinese is None:
+            use_chinese = self.use_chinese(text)
+        if use_chinese:
+            text = TextNormalizer.ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
             # 应用术语词汇表（优先级最高，在所有保护之前）
             if self.enable_glossary:
                 text = self.apply_glossary_terms(text, lang="zh")
@@ -162,11 +227,10 @@ class TextNormalizer:
             result = self.restore_pinyin_tones(result, pinyin_list)
             # 恢复技术术语
             result = self.restore_tech_terms(result, tech_list)
-            pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
+            result = self._zh_char_rep_pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
         else:
             try:
-                text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+                text = TextNormalizer.ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
                 # 应用术语词汇表（优先级最高，在所有保护之前）
                 if self.enable_glossary:
                     text = self.apply_glossary_terms(text, lang="en")
@@ -178,8 +242,7 @@ class TextNormalizer:
             except Exception:
                 result = text
                 print(traceback.format_exc())
-            pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.char_rep_map[x.group()], result)
+            result = self._char_rep_pattern.sub(lambda x: self.char_rep_map[x.group()], result)
         return result
 
     def correct_pinyin(self, pinyin: str):
@@ -190,9 +253,8 @@ class TextNormalizer:
         if pinyin[0] not in "jqxJQX":
             return pinyin
         # 匹配 jqx 的韵母为 u/ü 的拼音
-        pattern = r"([jqx])[uü](n|e|an)*(\d)"
         repl = r"\g<1>v\g<2>\g<3>"
-        pinyin = re.sub(pattern, repl, pinyin, flags=re.IGNORECASE)
+        pinyin = TextNormalizer.JQX_PINYIN_RE.sub(repl, pinyin)
         return pinyin.upper()
 
     def save_names(self, original_text):
@@ -201,8 +263,7 @@ class TextNormalizer:
         例如：克里斯托弗·诺兰 -> <n_a>
         """
         # 人名
-        name_pattern = re.compile(TextNormalizer.NAME_PATTERN, re.IGNORECASE)
-        original_name_list = re.findall(name_pattern, original_text)
+        original_name_list = TextNormalizer.NAME_RE.findall(original_text)
         if len(original_name_list) == 0:
             return (original_text, None)
         original_name_list = list(set("".join(n) for n in original_name_list))
@@ -236,8 +297,7 @@ class TextNormalizer:
         例如：GPT-5-nano -> GPT<H>5<H>nano，然后 5 被转换为 五
         最终恢复为：GPT-五-nano
         """
-        tech_pattern = re.compile(TextNormalizer.TECH_TERM_PATTERN)
-        original_tech_list = tech_pattern.findall(original_text)
+        original_tech_list = TextNormalizer.TECH_TERM_RE.findall(original_text)
         if len(original_tech_list) == 0:
             return (original_text, None)
 
@@ -264,7 +324,7 @@ class TextNormalizer:
 
         # 清理 <H> 周围可能的空格，然后恢复为连字符
         # 处理模式: " <H> " -> "-", " <H>" -> "-", "<H> " -> "-", "<H>" -> "-"
-        transformed_text = re.sub(r'\s*<H>\s*', '-', normalized_text)
+        transformed_text = TextNormalizer.TECH_HYPHEN_PLACEHOLDER_RE.sub('-', normalized_text)
         return transformed_text
 
     def apply_glossary_terms(self, text, lang="zh"):
@@ -284,25 +344,44 @@ class TextNormalizer:
         """
         if not self.term_glossary:
             return text
+        self._refresh_glossary()
+        if self._glossary_pattern is None:
+            return text
 
-        # 按术语长度降序排列，避免短术语先匹配导致长术语无法匹配
-        # 例如："PCIe 5.0" 应该在 "PCIe" 之前匹配
-        sorted_terms = sorted(self.term_glossary.keys(), key=len, reverse=True)
-        @lru_cache(maxsize=42)
-        def get_term_pattern(term: str):
-            return re.compile(re.escape(term), re.IGNORECASE)
-        transformed_text = text
-        for term in sorted_terms:
-            term_value = self.term_glossary[term]
+        def replace(match):
+            term = self._glossary_terms.get(match.group().lower())
+            if term is None:
+                return match.group()
+            term_value = self._glossary_source[term]
             if isinstance(term_value, dict):
-                replacement = term_value.get(lang, term_value.get(lang, term))
-            else:
-                replacement = term_value
-            # 使用正则进行大小写不敏感的替换
-            pattern = get_term_pattern(term)
-            transformed_text = pattern.sub(replacement, transformed_text)
+                return term_value.get(lang, term)
+            return term_value
 
-        return transformed_text
+        # 单次扫描，大小写不敏感，替换结果不会被其他术语再次匹配
+        return self._glossary_pattern.sub(replace, text)
+
+    def _refresh_glossary(self):
+        """
+        (Re)build the glossary matcher when `term_glossary` has changed since the last build, e.g. after
+        `load_glossary()` or a direct edit of the dict. Returns the glossary version used in the result cache key.
+        """
+        if self._glossary_source is not None and self._glossary_source == self.term_glossary:
+            return self._glossary_version
+        snapshot = {term: dict(v) if isinstance(v, dict) else v for term, v in self.term_glossary.items() if term}
+        # 按术语长度降序排列，正则分支按顺序尝试，保证长术语优先匹配
+        # 例如："PCIe 5.0" 应该在 "PCIe" 之前匹配
+        sorted_terms = sorted(snapshot.keys(), key=len, reverse=True)
+        glossary_terms = dict()
+        for term in sorted_terms:
+            glossary_terms.setdefault(term.lower(), term)
+        self._glossary_terms = glossary_terms
+        self._glossary_pattern = (
+            re.compile("|".join(re.escape(term) for term in sorted_terms), re.IGNORECASE) if sorted_terms else None
+        )
+        self._glossary_source = snapshot
+        self._glossary_version += 1
+        self.clear_cache()
+        return self._glossary_version
 
     def load_glossary(self, glossary_dict):
         """
@@ -362,8 +441,7 @@ class TextNormalizer:
         例如：xuan4 -> <pinyin_a>
         """
         # 声母韵母+声调数字
-        origin_pinyin_pattern = re.compile(TextNormalizer.PINYIN_TONE_PATTERN, re.IGNORECASE)
-        original_pinyin_list = re.findall(origin_pinyin_pattern, original_text)
+        original_pinyin_list = TextNormalizer.PINYIN_TONE_RE.findall(original_text)
         if len(original_pinyin_list) == 0:
             return (original_text, None)
         original_pinyin_list = list(set("".join(p) for p in original_pinyin_list))
@@ -478,17 +556,18 @@ class TextTokenizer:
             tokens = [tokens]
         return [self.sp_model.PieceToId(token) for token in tokens]
 
-    def tokenize(self, text: str) -> List[str]:
-        return self.encode(text, out_type=str)
+    def tokenize(self, text: str, use_chinese: bool = None) -> List[str]:
+        return self.encode(text, out_type=str, use_chinese=use_chinese)
 
     def encode(self, text: str, **kwargs):
+        use_chinese = kwargs.pop("use_chinese", None)
         if len(text) == 0:
             return []
         if len(text.strip()) == 1:
             return self.sp_model.Encode(text, out_type=kwargs.pop("out_type", int), **kwargs)
         # 预处理
         if self.normalizer:
-            text = self.normalizer.normalize(text)
+            text = self.normalizer.normalize(text, use_chinese=use_chinese)
         if len(self.pre_tokenizers) > 0:
             for pre_tokenizer in self.pre_tokenizers:
                 text = pre_tokenizer(text)
@@ -604,6 +683,192 @@ class TextTokenizer:
         )
 
 
+# 句子：以中英文句末标点（及其后的引号、括号）或换行结尾；英文句点需后接空白，避免切开 "2.5"、"e.g."
+SENTENCE_RE = re.compile(r'.+?(?:[。！？!?；;…\n]+[”’"」』)）]*|\.+[”’"」』)）]*(?=\s)|$)', re.S)
+
+
+def split_document(text: str, max_chars=2000) -> List[str]:
+    """
+    按句子边界将长文本切分为不超过 max_chars 个字符的块（单个超长句子不再切分），
+    所有块按顺序拼接后等于原文本。
+    """
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_RE.findall(text):
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# 文本前端工作进程中的 tokenizer，由 _init_text_worker 在进程启动时创建一次
+_worker_tokenizer = None
+
+
+def _init_text_worker(vocab_file, enable_glossary, term_glossary):
+    global _worker_tokenizer
+    normalizer = TextNormalizer(enable_glossary=enable_glossary)
+    normalizer.term_glossary = term_glossary
+    # TextTokenizer 会调用 normalizer.load()，从 tagger_cache 加载 FST
+    _worker_tokenizer = TextTokenizer(vocab_file, normalizer)
+
+
+def _tokenize_text_chunk(text, use_chinese):
+    return _worker_tokenizer.tokenize(text, use_chinese=use_chinese)
+
+
+class ParallelTextTokenizer:
+    """
+    Document-level text front end for long inputs (e.g. audiobook chapters).
+
+    The WeTextProcessing normalizers are single-threaded, so a long text is split on sentence boundaries into
+    chunks which are normalized and tokenized in a pool of worker processes; every worker loads the normalizers
+    (tagger cache) and the BPE model once. The chunk tokens are concatenated in order, ready for
+    `TextTokenizer.split_segments()`. Short texts are tokenized in-process.
+    """
+
+    def __init__(self, tokenizer: TextTokenizer, num_workers=None, chunk_chars=2000, min_parallel_chars=4000):
+        """
+        Args:
+            tokenizer (TextTokenizer): in-process tokenizer, its vocab file and normalizer settings are used by workers.
+            num_workers (int | None): number of worker processes, None for `os.cpu_count()`, <= 1 to disable the pool.
+            chunk_chars (int): target number of characters per chunk sent to a worker.
+            min_parallel_chars (int): texts shorter than this are tokenized in-process.
+        """
+        self.tokenizer = tokenizer
+        self.num_workers = (os.cpu_count() or 1) if num_workers is None else num_workers
+        self.chunk_chars = chunk_chars
+        self.min_parallel_chars = min_parallel_chars
+        self._executor = None
+        self._executor_glossary = None  # (enable_glossary, term_glossary) the workers were started with
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.num_workers > 1 and self.tokenizer.normalizer is not None
+
+    def _glossary_state(self):
+        normalizer = self.tokenizer.normalizer
+        glossary = {term: dict(v) if isinstance(v, dict) else v for term, v in normalizer.term_glossary.items()}
+        return normalizer.enable_glossary, glossary
+
+    def _get_executor(self):
+        state = self._glossary_state()
+        with self._lock:
+            if self._executor is not None and self._executor_glossary != state:
+                # 术语表已变化，使用新术语表重启工作进程
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    # spawn: 不继承父进程的 CUDA 上下文和模型权重
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_text_worker,
+                    initargs=(self.tokenizer.vocab_file, state[0], state[1]),
+                )
+                self._executor_glossary = state
+            return self._executor
+
+    def start(self):
+        """
+        Start all worker processes ahead of the first long text, loading the normalizers takes a few seconds.
+        """
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        list(executor.map(_tokenize_text_chunk, ["warm up."] * self.num_workers, [False] * self.num_workers))
+
+    def tokenize(self, text: str) -> List[str]:
+        if not self.enabled or len(text) < self.min_parallel_chars:
+            return self.tokenizer.tokenize(text)
+        chunks = split_document(text, self.chunk_chars)
+        if len(chunks) <= 1:
+            return self.tokenizer.tokenize(text)
+        # 语言按整篇文本判断，保证与整段处理时使用同一个 normalizer
+        use_chinese = self.tokenizer.normalizer.use_chinese(text)
+        executor = self._get_executor()
+        tokens = []
+        for chunk_tokens in executor.map(_tokenize_text_chunk, chunks, [use_chinese] * len(chunks)):
+            tokens.extend(chunk_tokens)
+        return tokens
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+                self._executor_glossary = None
+
+
+# 分句（逗号等）边界，仅用于流式输入的首个分句，尽快输出第一段语音
+CLAUSE_RE = re.compile(r'.+?(?:[，,、：:]+|$)', re.S)
+
+
+class TextStreamSegmenter:
+    """
+    Incremental text front end for text that arrives in fragments, e.g. tokens streamed from an LLM.
+
+    `push()` buffers the fragments and returns the segments (lists of BPE tokens, as from
+    `TextTokenizer.split_segments()`) of every sentence that is complete; a sentence counts as complete once the
+    text following its end punctuation has started to arrive. While fewer than `quick_streaming_tokens` tokens have
+    been emitted, clause boundaries (commas) are also used, so that synthesis can start on the first clause.
+    `flush()` returns the segments of the remaining text at the end of the stream.
+    """
+
+    def __init__(self, tokenizer: TextTokenizer, max_text_tokens_per_segment=120, quick_streaming_tokens=0,
+                 max_buffer_chars=None):
+        """
+        Args:
+            tokenizer (TextTokenizer): tokenizer used to normalize, tokenize and split the completed text.
+            max_text_tokens_per_segment (int): see `TextTokenizer.split_segments()`.
+            quick_streaming_tokens (int): token budget of the first segments, see `TextTokenizer.split_segments()`.
+            max_buffer_chars (int | None): emit buffered text without a sentence boundary once it reaches this many
+                characters, None for `2 * max_text_tokens_per_segment`.
+        """
+        self.tokenizer = tokenizer
+        self.max_text_tokens_per_segment = max_text_tokens_per_segment
+        self.quick_streaming_tokens = quick_streaming_tokens
+        self.max_buffer_chars = max_buffer_chars or 2 * max_text_tokens_per_segment
+        self.emitted_tokens = 0
+        self._buffer = ""
+
+    def push(self, fragment: str) -> List[List[str]]:
+        self._buffer += fragment
+        # 最后一句可能尚未结束（如 "2." 后面还有 "5"），保留在缓冲区中
+        ready = SENTENCE_RE.findall(self._buffer)[:-1]
+        if not ready and self.emitted_tokens < self.quick_streaming_tokens:
+            ready = CLAUSE_RE.findall(self._buffer)[:-1]
+        if ready:
+            text = "".join(ready)
+        elif len(self._buffer) >= self.max_buffer_chars:
+            # 过长且没有句子边界：在最后一个空白处切分，避免切开英文单词
+            cut = self._buffer.rfind(" ")
+            text = self._buffer[:cut] if cut > 0 else self._buffer
+        else:
+            return []
+        self._buffer = self._buffer[len(text):]
+        return self._segment(text)
+
+    def flush(self) -> List[List[str]]:
+        text, self._buffer = self._buffer, ""
+        return self._segment(text)
+
+    def _segment(self, text: str) -> List[List[str]]:
+        if not text.strip():
+            return []
+        tokens = self.tokenizer.tokenize(text)
+        segments = self.tokenizer.split_segments(
+            tokens, self.max_text_tokens_per_segment,
+            quick_streaming_tokens=max(0, self.quick_streaming_tokens - self.emitted_tokens)
+        )
+        self.emitted_tokens += len(tokens)
+        return segments
+
+
 if __name__ == "__main__":
     # 测试程序
 
@@ -0,0 +1,141 @@
+import torch
+
+
+def _per_row(value, scores, dtype):
+    """float / int, or a (b,) tensor of per-row values -> broadcastable against (b, vocab) scores."""
+    if isinstance(value, torch.Tensor):
+        return value.to(device=scores.device, dtype=dtype).view(-1, 1)
+    return torch.full((scores.shape[0], 1), value, dtype=dtype, device=scores.device)
+
+
+def seen_from_ids(input_ids, vocab_size):
+    """
+    Args:
+        input_ids: (b, s) token ids
+    Returns:
+        seen: (b, vocab_size) bool bitmap of the tokens in each row
+    """
+    seen = torch.zeros((input_ids.shape[0], vocab_size), dtype=torch.bool, device=input_ids.device)
+    return seen.scatter_(1, input_ids.long(), True)
+
+
+def mark_seen(seen, tokens):
+    """Add the newest token of every row (b,) to the (b, vocab) bitmap, in place."""
+    return seen.scatter_(1, tokens.long().view(-1, 1), True)
+
+
+def process_logits(scores, seen=None, repetition_penalty=None, temperature=None, top_k=None, top_p=None,
+                   min_tokens_to_keep=1):
+    """
+    Repetition penalty, temperature, top-k and top-p of `generate()` in one function, with the semantics and
+    order of HF's `RepetitionPenaltyLogitsProcessor`, `TemperatureLogitsWarper`, `TopKLogitsWarper` and
+    `TopPLogitsWarper`. The penalty is applied through a bitmap of the seen tokens instead of gathering the
+    whole history, and top-k and top-p share a single sort of the vocabulary.
+
+    Every parameter is either a number, a (b,) tensor of per-row values, or None to skip the step;
+    a per-row top_k of 0 keeps all tokens.
+    Args:
+        scores: (b, vocab) logits or log-probabilities
+        seen: (b, vocab) bool, tokens the repetition penalty applies to, see `seen_from_ids()` / `mark_seen()`
+    Returns:
+        (b, vocab) processed scores, the removed tokens are -inf
+    """
+    if repetition_penalty is not None and seen is not None:
+        penalty = _per_row(repetition_penalty, scores, scores.dtype)
+        scores = torch.where(seen, torch.where(scores < 0, scores * penalty, scores / penalty), scores)
+    if temperature is not None:
+        scores = scores / _per_row(temperature, scores, scores.dtype)
+    if top_k is None and top_p is None:
+        return scores
+
+    vocab_size = scores.shape[-1]
+    # ascending, like TopPLogitsWarper: the tokens to keep are at the end
+    sorted_scores, sorted_indices = scores.sort(dim=-1)
+    remove = None
+    if top_k is not None:
+        k = _per_row(top_k, scores, torch.long)
+        k = torch.where(k > 0, k, vocab_size).clamp(min_tokens_to_keep, vocab_size)
+        remove = sorted_scores < sorted_scores.gather(1, vocab_size - k)
+    if top_p is not None:
+        kept = sorted_scores if remove is None else sorted_scores.masked_fill(remove, float("-inf"))
+        cumulative = kept.softmax(dim=-1).cumsum(dim=-1)
+        top_p_remove = cumulative <= (1 - _per_row(top_p, scores, cumulative.dtype))
+        remove = top_p_remove if remove is None else remove | top_p_remove
+    remove[:, vocab_size - min_tokens_to_keep:] = False
+    return scores.masked_fill(remove.scatter(1, sorted_indices, remove), float("-inf"))
+
+
+class FusedLogitsProcessor:
+    """
+    `process_logits()` as a single logits processor for `GPT2InferenceModel.generate()`, replacing the
+    separate repetition penalty / temperature / top-k / top-p passes. A plain callable (not a transformers
+    `LogitsProcessor` subclass) so that this module only needs torch and stays cheap to import.
+
+    The seen-tokens bitmap is built from `input_ids` on the first step and then only updated with the newest
+    token, so use one instance per `generate()` call. Beam search reorders the rows between steps and must
+    call `reorder_beams()`, the vendored `_beam_search()` does.
+    """
+
+    def __init__(self, repetition_penalty=1.0, temperature=1.0, top_k=0, top_p=1.0, min_tokens_to_keep=1):
+        self.repetition_penalty = repetition_penalty
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.min_tokens_to_keep = min_tokens_to_keep
+        self._seen = None
+        self._length = 0
+
+    @classmethod
+    def from_generate_kwargs(cls, generate_kwargs, generation_config):
+        """
+        Take repetition_penalty / temperature / top_k / top_p out of `generate()` kwargs (falling back to
+        `generation_config`) and neutralize them, so that `generate()` does not add its own processors.
+        """
+        def pop(name):
+            value = generate_kwargs.pop(name, None)
+            return getattr(generation_config, name) if value is None else value
+
+        do_sample = generate_kwargs.get("do_sample", generation_config.do_sample)
+        num_beams = generate_kwargs.get("num_beams", generation_config.num_beams) or 1
+        processor = cls(
+            repetition_penalty=pop("repetition_penalty") or 1.0,
+            temperature=pop("temperature") or 1.0,
+            top_k=pop("top_k") or 0,
+            top_p=pop("top_p") or 1.0,
+            # as `generate()`: beam sampling keeps a non-eos token next to the eos token
+            min_tokens_to_keep=2 if num_beams > 1 else 1,
+        )
+        generate_kwargs["repetition_penalty"] = 1.0
+        if do_sample:
+            generate_kwargs.update(temperature=1.0, top_k=0, top_p=1.0)
+        else:
+            # the warpers only apply when sampling
+            processor.temperature, processor.top_k, processor.top_p = 1.0, 0, 1.0
+        return processor
+
+    def reorder_beams(self, beam_idx):
+        if self._seen is not None:
+            self._seen = self._seen.index_select(0, beam_idx.to(self._seen.device))
+
+    def __call__(self, input_ids, scores):
+        seen = None
+        if self.repetition_penalty != 1.0:
+            if (
+                self._seen is None
+                or self._seen.shape[0] != input_ids.shape[0]
+                or input_ids.shape[1] != self._length + 1
+            ):
+                self._seen = seen_from_ids(input_ids, scores.shape[-1])
+            else:
+                mark_seen(self._seen, input_ids[:, -1])
+            self._length = input_ids.shape[1]
+            seen = self._seen
+        return process_logits(
+            scores,
+            seen=seen,
+            repetition_penalty=self.repetition_penalty if seen is not None else None,
+            temperature=self.temperature if self.temperature != 1.0 else None,
+            top_k=self.top_k if self.top_k else None,
+            top_p=self.top_p if self.top_p < 1.0 else None,
+            min_tokens_to_keep=self.min_tokens_to_keep,
+        )
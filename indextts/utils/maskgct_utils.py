@@ -84,8 +84,41 @@ class JsonHParams:
         return self.__dict__.__repr__()
 
 
-def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt'):
+class TruncatedSemanticModel(torch.nn.Module):
+    """
+    w2v-BERT encoder that only runs its first `output_layer` conformer layers and returns the output of the last one,
+    i.e. `Wav2Vec2BertModel(..., output_hidden_states=True).hidden_states[output_layer]`, without computing the
+    remaining layers or keeping all intermediate hidden states. The dropped layers are released.
+    """
+
+    def __init__(self, semantic_model, output_layer=17):
+        super().__init__()
+        assert 0 < output_layer <= len(semantic_model.encoder.layers)
+        self.output_layer = output_layer
+        self.feature_projection = semantic_model.feature_projection
+        self.encoder = semantic_model.encoder
+        self.encoder.layers = self.encoder.layers[:output_layer]
+
+    def forward(self, input_features, attention_mask=None):
+        hidden_states, _ = self.feature_projection(input_features)
+        encoder_outputs = self.encoder(
+            hidden_states,
+            attention_mask=attention_mask,
+            output_hidden_states=False,
+            return_dict=True,
+        )
+        return encoder_outputs.last_hidden_state
+
+
+def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt', output_layer=None):
+    """
+    Args:
+        output_layer (int | None): if given, return a `TruncatedSemanticModel` that outputs
+            `hidden_states[output_layer]` directly, else the full `Wav2Vec2BertModel`.
+    """
     semantic_model = Wav2Vec2BertModel.from_pretrained("facebook/w2v-bert-2.0")
+    if output_layer is not None:
+        semantic_model = TruncatedSemanticModel(semantic_model, output_layer)
     semantic_model.eval()
     stat_mean_var = torch.load(path_)
     semantic_mean = stat_mean_var["mean"]
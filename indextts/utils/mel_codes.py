@@ -0,0 +1,69 @@
+import torch
+
+
+def stop_token_lengths(codes: torch.Tensor, stop_token: int) -> torch.Tensor:
+    """
+    Length of every code sequence up to (excluding) its first `stop_token`, or the full length if it has none.
+    codes: [B, T] -> [B] (long, on the device of `codes`)
+    """
+    is_stop = codes == stop_token
+    # argmax 返回第一个最大值的下标，即第一个 stop token 的位置
+    first_stop = is_stop.int().argmax(dim=1)
+    return torch.where(is_stop.any(dim=1), first_stop, torch.full_like(first_stop, codes.size(1)))
+
+
+def silent_run_positions(codes: torch.Tensor, silent_token: int) -> torch.Tensor:
+    """
+    Position of every `silent_token` within its run of consecutive silent tokens (0 for the first one), -1 for the
+    other tokens. codes: [B, T] -> [B, T]
+    """
+    is_silent = codes == silent_token
+    positions = torch.arange(codes.size(1), device=codes.device).expand_as(codes)
+    # 每个位置之前（含）最后一个非静音 token 的下标
+    last_non_silent = torch.where(is_silent, torch.full_like(positions, -1), positions).cummax(dim=1).values
+    return torch.where(is_silent, positions - last_non_silent - 1, torch.full_like(positions, -1))
+
+
+def pack_codes(codes: torch.Tensor, keep: torch.Tensor, pad_value: int, max_len: int = None):
+    """
+    Move the kept tokens of every sequence to the front, in order, and pad the rest with `pad_value`.
+    Args:
+        codes: [B, T]
+        keep: [B, T] bool mask of the tokens to keep
+        max_len (int | None): output length, None for the longest kept sequence (one host sync).
+    Returns:
+        (Tensor, Tensor): packed codes [B, max_len] and their lengths [B]
+    """
+    lens = keep.sum(dim=1)
+    if max_len is None:
+        max_len = int(lens.max()) if lens.numel() > 0 else 0
+    target = keep.long().cumsum(dim=1) - 1
+    # 丢弃的 token 写入多出的最后一列，随后截掉
+    target = torch.where(keep, target, torch.full_like(target, max_len))
+    packed = torch.full((codes.size(0), max_len + 1), pad_value, dtype=codes.dtype, device=codes.device)
+    packed.scatter_(1, target, codes)
+    return packed[:, :max_len], lens
+
+
+def remove_long_silence(codes: torch.Tensor, stop_token: int, silent_token=52, max_consecutive=30, max_run=10):
+    """
+    Shrink special tokens (silent_token and stop_token) in codes, without per-token Python loops.
+    Sequences with more than `max_consecutive` silent tokens keep at most `max_run` tokens of every silent run;
+    all sequences are cut at their first stop token. Same results as the previous per-token implementation.
+        codes: [B, T]
+    Returns:
+        (Tensor, Tensor): codes [B, max_len] and code_lens [B]
+    """
+    code_lens = stop_token_lengths(codes, stop_token)
+    positions = torch.arange(codes.size(1), device=codes.device)
+    keep = positions[None, :] < code_lens[:, None]
+    # 注意：与原实现一致，静音 token 计数包含 stop token 之后的部分
+    compress = (codes == silent_token).sum(dim=1) > max_consecutive
+    keep_silence = silent_run_positions(codes, silent_token) < max_run
+    keep = keep & (keep_silence | ~compress[:, None])
+    # 一次同步取回是否需要压缩与最大长度
+    any_compress, max_len = torch.stack([compress.any().long(), keep.sum(dim=1).max()]).tolist()
+    if not any_compress:
+        # 无需压缩：只截断到最长的序列，保留原有内容
+        return codes[:, :max_len], code_lens
+    return pack_codes(codes, keep, stop_token, max_len=max_len)
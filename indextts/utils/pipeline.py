@@ -0,0 +1,101 @@
+import queue
+import threading
+from contextlib import nullcontext
+
+import torch
+
+_END = object()
+
+
+def _record_stream(value, stream):
+    """Mark tensors produced on another CUDA stream as used by `stream`, so the allocator does not reuse them early."""
+    if isinstance(value, torch.Tensor):
+        if value.is_cuda:
+            value.record_stream(stream)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _record_stream(v, stream)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _record_stream(v, stream)
+
+
+class StagePipeline:
+    """
+    Two-stage producer / consumer pipeline.
+
+    `produce(item)` runs for each item in a background thread (optionally on its own CUDA stream) and its results are
+    handed to `consume(result)`, which runs in the caller's thread, through a bounded queue. While the consumer
+    works on item N the producer already works on item N + 1, at most `max_queue_size` results ahead.
+    Results are consumed in item order, exceptions of the producer are re-raised in the caller.
+    """
+
+    def __init__(self, produce, consume, max_queue_size=2, device=None):
+        """
+        Args:
+            produce (callable): first stage, called in the producer thread.
+            consume (callable): second stage, called in the caller's thread.
+            max_queue_size (int): maximum number of produced results waiting for the consumer.
+            device (str | torch.device | None): for a CUDA device, the producer runs on a separate CUDA stream so
+                that the kernels of both stages can overlap on the GPU.
+        """
+        self.produce = produce
+        self.consume = consume
+        self.max_queue_size = max(1, max_queue_size)
+        self.device = torch.device(device) if device is not None else None
+
+    def run(self, items):
+        """
+        Generator of `consume(produce(item))` for every item, in order.
+        """
+        results = queue.Queue(maxsize=self.max_queue_size)
+        stopped = threading.Event()
+        use_streams = self.device is not None and self.device.type == "cuda"
+        producer_stream = torch.cuda.Stream(self.device) if use_streams else None
+
+        def put(entry):
+            # a bounded put that gives up once the consumer has gone away
+            while not stopped.is_set():
+                try:
+                    results.put(entry, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker():
+            try:
+                with torch.cuda.stream(producer_stream) if use_streams else nullcontext():
+                    for item in items:
+                        if stopped.is_set():
+                            return
+                        result = self.produce(item)
+                        event = None
+                        if use_streams:
+                            event = torch.cuda.Event()
+                            event.record(producer_stream)
+                        if not put((result, event, None)):
+                            return
+            except BaseException as e:
+                put((None, None, e))
+                return
+            put(_END)
+
+        thread = threading.Thread(target=worker, name="stage-pipeline-producer", daemon=True)
+        thread.start()
+        try:
+            while True:
+                entry = results.get()
+                if entry is _END:
+                    break
+                result, event, error = entry
+                if error is not None:
+                    raise error
+                if event is not None:
+                    consumer_stream = torch.cuda.current_stream(self.device)
+                    consumer_stream.wait_event(event)
+                    _record_stream(result, consumer_stream)
+                yield self.consume(result)
+        finally:
+            stopped.set()
+            thread.join()
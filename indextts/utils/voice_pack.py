@@ -0,0 +1,75 @@
+import functools
+import os
+
+VOICE_PACK_FORMAT = "indextts2-voice-pack"
+VOICE_PACK_VERSION = "1"
+VOICE_PACK_SUFFIX = ".safetensors"
+
+# speaker-derived tensors of `IndexTTS2.get_spk_conditioning()`
+SPK_TENSORS = ("spk_cond", "s2mel_style", "s2mel_prompt", "mel", "gpt_cond", "spk_emovec", "spk_matrix_idx")
+# the speaker audio used as its own emotion reference, see `IndexTTS2.get_emo_conditioning()`
+EMO_TENSORS = ("emo_cond", "emovec")
+
+
+def is_voice_pack(path):
+    return isinstance(path, (str, os.PathLike)) and os.fspath(path).endswith(VOICE_PACK_SUFFIX)
+
+
+def save_voice_pack(path, tensors, metadata=None):
+    """
+    Write a voice pack: every speaker-derived conditioning tensor in one safetensors file.
+    Args:
+        tensors (dict): name -> tensor, see `SPK_TENSORS` and `EMO_TENSORS`.
+        metadata (dict | None): extra str -> str entries stored in the file header.
+    """
+    from safetensors.torch import save_file
+
+    header = {"format": VOICE_PACK_FORMAT, "version": VOICE_PACK_VERSION}
+    header.update({k: str(v) for k, v in (metadata or {}).items()})
+    tensors = {name: t.detach().to("cpu").contiguous() for name, t in tensors.items()}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    save_file(tensors, tmp_path, metadata=header)
+    os.replace(tmp_path, path)  # a half-written pack is never visible to readers
+
+
+@functools.lru_cache(maxsize=1024)
+def _read_metadata(path, mtime_ns, size):
+    from safetensors import safe_open
+
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata() or {}
+    if metadata.get("format") != VOICE_PACK_FORMAT:
+        raise ValueError(f"{path} is not an IndexTTS2 voice pack")
+    return metadata
+
+
+def read_voice_pack_metadata(path):
+    """
+    Header of a voice pack, only the JSON header is read. Memoized on (path, mtime, size).
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return dict(_read_metadata(path, st.st_mtime_ns, st.st_size))
+
+
+def load_voice_pack(path, device="cpu"):
+    """
+    Load all tensors of a voice pack. The file is memory-mapped, so tensors loaded on CPU share pages with the
+    page cache instead of being copied.
+    Returns:
+        (dict, dict): tensors and header metadata
+    """
+    from safetensors import safe_open
+
+    tensors = {}
+    with safe_open(path, framework="pt", device=str(device)) as f:
+        metadata = f.metadata() or {}
+        if metadata.get("format") != VOICE_PACK_FORMAT:
+            raise ValueError(f"{path} is not an IndexTTS2 voice pack")
+        for name in f.keys():
+            tensors[name] = f.get_tensor(name)
+    missing = [name for name in SPK_TENSORS + EMO_TENSORS if name not in tensors]
+    if missing:
+        raise ValueError(f"voice pack {path} is missing tensors: {missing}")
+    return tensors, metadata
@@ -0,0 +1,33 @@
+import struct
+
+import torch
+
+# RIFF / data chunk size used when the total length is unknown: players read until end of stream
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def wav_header(sample_rate, channels=1, bits_per_sample=16, data_size=None):
+    """
+    44-byte RIFF/WAVE header for PCM audio.
+    Args:
+        data_size (int | None): number of PCM bytes that follow; None for a stream of unknown length.
+    """
+    if data_size is None:
+        riff_size = data_size = WAV_UNKNOWN_SIZE
+    else:
+        riff_size = 36 + data_size
+    block_align = channels * bits_per_sample // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits_per_sample,
+        b"data", data_size,
+    )
+
+
+def pcm16_bytes(wav: torch.Tensor):
+    """
+    Interleaved little-endian int16 PCM of a `(channels, samples)` waveform already scaled to the int16 range,
+    as yielded by `IndexTTS2.infer(stream_return=True)`.
+    """
+    return wav.type(torch.int16).t().contiguous().numpy().astype("<i2").tobytes()
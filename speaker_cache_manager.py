@@ -143,6 +143,28 @@ class SpeakerCacheManager:
                         return pickle.load(f)
         return None
     
+    def voice_pack_path(self, speaker_id: str) -> str:
+        """说话人voice pack（safetensors）的存放路径"""
+        return str(self.cache_dir / f"{speaker_id}.safetensors")
+    
+    def register_voice_pack(self, speaker_id: str, pack_path: str):
+        """记录已生成的voice pack（由 IndexTTS2.enroll_voice 写出）"""
+        for md5, info in self.index.items():
+            if info["speaker_id"] == speaker_id:
+                info["voice_pack_path"] = pack_path
+                info["embedding_cached"] = True
+                self._save_index()
+                return
+    
+    def get_voice_pack(self, speaker_id: str) -> Optional[str]:
+        """获取说话人的voice pack路径，可直接作为 spk_audio_prompt 传给 infer()"""
+        for md5, info in self.index.items():
+            if info["speaker_id"] == speaker_id:
+                pack_path = info.get("voice_pack_path")
+                if pack_path and os.path.exists(pack_path):
+                    return pack_path
+        return None
+    
     def list_speakers(self) -> list:
         """列出所有缓存的说话人"""
         speakers = []
@@ -171,9 +193,10 @@ class SpeakerCacheManager:
         if os.path.exists(info["audio_path"]):
             os.remove(info["audio_path"])
         
-        embedding_path = info.get("embedding_path")
-        if embedding_path and os.path.exists(embedding_path):
-            os.remove(embedding_path)
+        for key in ("embedding_path", "voice_pack_path"):
+            path = info.get(key)
+            if path and os.path.exists(path):
+                os.remove(path)
         
         # 从索引中删除
         del self.index[md5_to_delete]
@@ -0,0 +1,177 @@
+import argparse
+import time
+
+import torch
+from torch import nn
+from transformers import GPT2Config
+
+from indextts.accel import ATTENTION_BACKENDS, AccelInferenceEngine, GenerationRequest, GPT2AccelModel
+from indextts.gpt.model_v2 import GPT2InferenceModel, build_hf_gpt_transformer
+
+NUM_CODES = 64
+START_TOKEN = NUM_CODES - 2
+STOP_TOKEN = NUM_CODES - 1
+COND_LEN = 34  # [32 cond latents][2 duration embs]
+
+
+def build_models(args):
+    """A small random GPT with the layout of UnifiedVoice, as the HF inference model and as the accel engine."""
+    torch.manual_seed(args.seed)
+    max_mel, max_text = args.max_new_tokens + 8, 128
+    gpt, mel_pos_embedding, _, _, _ = build_hf_gpt_transformer(args.layers, args.dim, args.heads, max_mel, max_text,
+                                                               checkpointing=False)
+    mel_embedding = nn.Embedding(NUM_CODES, args.dim)
+    final_norm = nn.LayerNorm(args.dim)
+    mel_head = nn.Linear(args.dim, NUM_CODES)
+    gpt.wte = mel_embedding
+    config = GPT2Config(vocab_size=NUM_CODES, n_positions=max_mel + max_text, n_ctx=max_mel + max_text,
+                        n_embd=args.dim, n_layer=args.layers, n_head=args.heads, use_cache=True)
+    hf_model = GPT2InferenceModel(config, gpt, mel_pos_embedding, mel_embedding, final_norm, mel_head, kv_cache=True)
+    hf_model = hf_model.to(args.device).eval()
+
+    accel_gpt = GPT2AccelModel(config)
+    accel_gpt.load_state_dict(gpt.state_dict(), strict=False)
+    accel_gpt = accel_gpt.to(args.device).eval()
+    engine = AccelInferenceEngine(
+        model=accel_gpt,
+        lm_head=nn.Sequential(final_norm, mel_head),
+        num_layers=args.layers,
+        num_heads=args.heads,
+        head_dim=args.dim // args.heads,
+        block_size=args.block_size,
+        num_blocks=args.num_blocks,
+        use_cuda_graph=False,
+        attention_backend=args.backend,
+    )
+    return hf_model, engine
+
+
+def random_prompts(text_lens, dim, device):
+    """Left-padded `[pad][cond][text]` embeddings sharing one conditioning prefix, as `prepare_gpt_inputs()`."""
+    cond = torch.randn(1, COND_LEN, dim, device=device)
+    max_len = COND_LEN + max(text_lens)
+    embeddings = torch.zeros(len(text_lens), max_len, dim, device=device)
+    attention_mask = torch.zeros(len(text_lens), max_len + 1, dtype=torch.long, device=device)
+    for i, text_len in enumerate(text_lens):
+        embeddings[i, max_len - text_len - COND_LEN:] = torch.cat([cond[0], torch.randn(text_len, dim, device=device)])
+        attention_mask[i, max_len - text_len - COND_LEN:] = 1
+    input_ids = torch.ones(len(text_lens), max_len + 1, dtype=torch.long, device=device)
+    input_ids[:, -1] = START_TOKEN
+    return cond, embeddings, attention_mask, input_ids
+
+
+def trim(codes):
+    codes = codes.tolist()
+    return codes[:codes.index(STOP_TOKEN)] if STOP_TOKEN in codes else codes
+
+
+def hf_generate(hf_model, embeddings, attention_mask, input_ids, max_new_tokens, prefix_kv=None):
+    hf_model.store_mel_emb(embeddings)
+    hf_model.store_prefix_kv(prefix_kv)
+    try:
+        output = hf_model.generate(input_ids, bos_token_id=START_TOKEN, pad_token_id=STOP_TOKEN,
+                                   eos_token_id=STOP_TOKEN, attention_mask=attention_mask,
+                                   max_length=input_ids.shape[1] + max_new_tokens, do_sample=False, num_beams=1)
+    finally:
+        hf_model.store_prefix_kv(None)
+    return [trim(row) for row in output[:, input_ids.shape[1]:]]
+
+
+def accel_generate(engine, hf_model, embeddings, attention_mask, input_ids, max_new_tokens, prefix_kv=None):
+    output = engine.generate(input_ids, max_new_tokens=max_new_tokens, temperature=0, stop_tokens=[STOP_TOKEN],
+                             attention_mask=attention_mask, tts_embeddings=embeddings,
+                             tts_mel_embedding=hf_model.embeddings, tts_text_pos_embedding=hf_model.text_pos_embedding,
+                             prefix_kv=prefix_kv)
+    return [trim(row) for row in output[:, input_ids.shape[1]:]]
+
+
+def continuous_generate(engine, hf_model, embeddings, attention_mask, max_new_tokens, join_after=5):
+    """Decode row 0 alone for `join_after` steps, then add the other rows to the running batch."""
+    start = torch.tensor([[START_TOKEN]], device=embeddings.device)
+    start_emb = hf_model.embeddings(start)[0] + hf_model.text_pos_embedding.emb(torch.zeros_like(start))[0]
+    requests = []
+    for i in range(embeddings.shape[0]):
+        prompt_len = int(attention_mask[i].sum())
+        prompt = torch.cat([embeddings[i, embeddings.shape[1] - prompt_len + 1:], start_emb])
+        requests.append(GenerationRequest([1] * (prompt_len - 1) + [START_TOKEN], max_new_tokens=max_new_tokens,
+                                          temperature=0, stop_tokens=[STOP_TOKEN], prompt_embeddings=prompt))
+    layers = dict(tts_mel_embedding=hf_model.embeddings, tts_text_pos_embedding=hf_model.text_pos_embedding)
+    assert engine.can_add(requests), "--num_blocks is too small for the test batch"
+    engine.add_requests(requests[:1], **layers)
+    for _ in range(join_after):
+        engine.step()
+    assert engine.can_add(requests[1:])
+    engine.add_requests(requests[1:], **layers)
+    while engine.num_running:
+        engine.step()
+    assert not engine.kv_manager.used_block_ids, "finished sequences must release their KV blocks"
+    assert engine.num_free_blocks == engine.num_blocks
+    return [r.generated for r in requests]
+
+
+if __name__ == "__main__":
+    """
+    Greedy-decoding parity of the accel engine (paged KV cache + selectable attention backend) against the
+    HF `GPT2InferenceModel.generate()` path, on a small random GPT: single and variable-length batches,
+    a cached conditioning prefix, a second pass that reuses full KV blocks of the first, and sequences
+    joining a running decode batch.
+    No checkpoints are needed; the "sdpa" backend runs on CPU.
+    ```
+    python tests/accel_parity_test.py
+    python tests/accel_parity_test.py --device cuda --backend flash --block_size 256
+    ```
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--backend", default="sdpa", choices=ATTENTION_BACKENDS)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--heads", type=int, default=4)
+    parser.add_argument("--block_size", type=int, default=16)
+    parser.add_argument("--num_blocks", type=int, default=128)
+    parser.add_argument("--max_new_tokens", type=int, default=48)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    hf_model, engine = build_models(args)
+    failed = False
+
+    def check(name, expected, actual):
+        global failed
+        ok = expected == actual
+        failed |= not ok
+        print(f">> {name}: {'OK' if ok else 'MISMATCH'} ({sum(len(c) for c in expected)} tokens)")
+        if not ok:
+            for i, (e, a) in enumerate(zip(expected, actual)):
+                if e != a:
+                    print(f"   row {i}:\n     hf    {e}\n     accel {a}")
+
+    with torch.inference_mode():
+        for name, text_lens in [("single sequence", [40]), ("variable-length batch", [40, 13, 27])]:
+            _, embeddings, attention_mask, input_ids = random_prompts(text_lens, args.dim, args.device)
+            expected = hf_generate(hf_model, embeddings, attention_mask, input_ids, args.max_new_tokens)
+            start = time.perf_counter()
+            actual = accel_generate(engine, hf_model, embeddings, attention_mask, input_ids, args.max_new_tokens)
+            elapsed = time.perf_counter() - start
+            check(f"{name} [{args.backend}, {elapsed:.3f}s]", expected, actual)
+            # the same prompts again: their full blocks are now served from the block cache
+            cached_blocks = len(engine.kv_manager.block_hash_to_id)
+            actual = accel_generate(engine, hf_model, embeddings, attention_mask, input_ids, args.max_new_tokens)
+            check(f"{name}, {cached_blocks} cached blocks", expected, actual)
+            if len(text_lens) > 1:
+                actual = continuous_generate(engine, hf_model, embeddings, attention_mask, args.max_new_tokens)
+                check(f"{name}, rows joining a running batch", expected, actual)
+
+        # conditioning prefix KV computed once, then spliced into both paths
+        cond, embeddings, attention_mask, input_ids = random_prompts([21], args.dim, args.device)
+        expected = hf_generate(hf_model, embeddings, attention_mask, input_ids, args.max_new_tokens)
+        out = hf_model.transformer(inputs_embeds=cond, use_cache=True, return_dict=True)
+        prefix_kv = tuple((k, v) for k, v in out.past_key_values)
+        check("HF with prefix KV", expected,
+              hf_generate(hf_model, embeddings, attention_mask, input_ids, args.max_new_tokens, prefix_kv=prefix_kv))
+        check("accel with prefix KV", expected,
+              accel_generate(engine, hf_model, embeddings, attention_mask, input_ids, args.max_new_tokens,
+                             prefix_kv=prefix_kv))
+
+    print(">> FAIL" if failed else ">> all parity checks passed")
+    raise SystemExit(1 if failed else 0)
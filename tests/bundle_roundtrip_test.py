@@ -0,0 +1,74 @@
+import argparse
+import os
+import tempfile
+
+import torch
+from omegaconf import OmegaConf
+from safetensors.torch import save_file
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.utils.bundle import COMPONENTS, _load_component, _module_tensors
+
+
+def same_tensors(expected, actual):
+    mismatched = sorted(set(expected) ^ set(actual))
+    mismatched += [key for key in expected.keys() & actual.keys() if not torch.equal(expected[key], actual[key])]
+    return mismatched
+
+
+def gpt_roundtrip(gpt_cfg, work_dir):
+    """Export a (small) UnifiedVoice after post_init_gpt2_config() and strictly reload it into a fresh one."""
+    torch.manual_seed(0)
+    gpt = UnifiedVoice(**gpt_cfg).eval()
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    tensors = _module_tensors("gpt", gpt)
+    weights_path = os.path.join(work_dir, "gpt.safetensors")
+    save_file(tensors, weights_path)
+
+    torch.manual_seed(1)
+    restored = _load_component(UnifiedVoice(**gpt_cfg), weights_path, "gpt").eval()
+    restored.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    mismatched = same_tensors(tensors, _module_tensors("gpt", restored))
+    assert not mismatched, mismatched[:10]
+    # post_init_gpt2_config() 重新建立的别名
+    assert restored.gpt.wte is restored.mel_embedding
+    print(f">> gpt round trip passed ({len(tensors)} tensors)")
+
+
+def bundle_roundtrip(model_dir, work_dir):
+    """export_bundle() of the full model, then IndexTTS2 loaded from the bundle must hold the same weights."""
+    from indextts.infer_v2 import IndexTTS2
+    from indextts.utils.bundle import export_bundle, verify_bundle
+
+    tts = IndexTTS2(cfg_path=os.path.join(model_dir, "config.yaml"), model_dir=model_dir, use_fp16=False)
+    bundle_dir = os.path.join(work_dir, "bundle")
+    export_bundle(tts, bundle_dir, include_qwen_emo=False)
+    assert not verify_bundle(bundle_dir)
+    restored = IndexTTS2(cfg_path=os.path.join(bundle_dir, "config.yaml"), model_dir=bundle_dir, use_fp16=False)
+    for name, attr in zip(COMPONENTS, ("gpt", "semantic_model", "semantic_codec", "s2mel", "campplus_model", "bigvgan")):
+        mismatched = same_tensors(_module_tensors(name, getattr(tts, attr)), _module_tensors(name, getattr(restored, attr)))
+        assert not mismatched, (name, mismatched[:10])
+        print(f">> {name} round trip passed")
+
+
+if __name__ == "__main__":
+    """
+    Round trip of the offline bundle format: export the weights, reload them with strict loading and compare.
+    Without --model_dir only a small GPT built from the config is checked, which needs no checkpoints.
+    ```
+    python tests/bundle_roundtrip_test.py
+    python tests/bundle_roundtrip_test.py --model_dir checkpoints
+    ```
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cfg_path", default="checkpoints/config.yaml")
+    parser.add_argument("--model_dir", default=None, help="also export and reload the full model")
+    args = parser.parse_args()
+
+    gpt_cfg = dict(OmegaConf.to_container(OmegaConf.load(args.cfg_path).gpt, resolve=True))
+    # 缩小模型，只保留结构
+    gpt_cfg.update(layers=2, model_dim=128, heads=2, max_mel_tokens=64, max_text_tokens=32, number_text_tokens=256)
+    with tempfile.TemporaryDirectory() as work_dir:
+        gpt_roundtrip(gpt_cfg, work_dir)
+        if args.model_dir:
+            bundle_roundtrip(args.model_dir, work_dir)
@@ -0,0 +1,86 @@
+import argparse
+import time
+
+import torch
+
+from indextts.infer_v2 import IndexTTS2
+from indextts.s2mel.modules.flow_matching import SOLVERS, get_t_span
+
+if __name__ == "__main__":
+    """
+    Offline quality / speed comparison of the CFM ODE solvers.
+    The CFM inputs of one real `infer()` call are captured, then every (solver, t_schedule, steps) configuration
+    is run from the same noise and compared against a high accuracy reference (rk4, 64 steps) by mel L1 error.
+    ```
+    python tests/cfm_solver_test.py checkpoints
+    python tests/cfm_solver_test.py checkpoints --steps 6 8 10 12 25 --solvers euler heun dpm_multistep
+    ```
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_dir", nargs="?", default="checkpoints")
+    parser.add_argument("--prompt", default="tests/sample_prompt.wav")
+    parser.add_argument("--text", default="今天天气真不错，阳光明媚，微风习习。我们一起去公园散步吧。")
+    parser.add_argument("--steps", type=int, nargs="+", default=[4, 6, 8, 10, 12, 16, 25])
+    parser.add_argument("--solvers", nargs="+", default=list(SOLVERS))
+    parser.add_argument("--schedules", nargs="+", default=["linear", "cosine"])
+    parser.add_argument("--cfg_rate", type=float, default=0.7)
+    parser.add_argument("--fp16", action="store_true")
+    args = parser.parse_args()
+
+    tts = IndexTTS2(cfg_path=f"{args.model_dir}/config.yaml", model_dir=args.model_dir, use_fp16=args.fp16)
+    cfm = tts.s2mel.models['cfm']
+
+    # capture the CFM inputs of every segment of a real synthesis
+    captured = []
+    cfm_inference = cfm.inference
+
+    def capture(mu, x_lens, prompt, style, f0, n_timesteps, *a, **kw):
+        captured.append((mu.clone(), x_lens.clone(), prompt.clone(), style.clone()))
+        return cfm_inference(mu, x_lens, prompt, style, f0, n_timesteps, *a, **kw)
+
+    cfm.inference = capture
+    tts.infer(args.prompt, args.text, output_path=None, verbose=False)
+    cfm.inference = cfm_inference
+    print(f">> captured {len(captured)} CFM segment(s)")
+
+    def sync():
+        if tts.device.startswith("cuda"):
+            torch.cuda.synchronize()
+
+    def run(solver, schedule, steps, noises):
+        mels = []
+        sync()
+        start = time.perf_counter()
+        with torch.inference_mode():
+            for (mu, x_lens, prompt, style), z in zip(captured, noises):
+                t_span = get_t_span(steps, schedule, device=mu.device)
+                mel = cfm.solve(z.clone(), x_lens, prompt, mu.clone(), style, None, t_span,
+                                inference_cfg_rate=args.cfg_rate, solver=solver)
+                mels.append(mel[:, :, prompt.size(-1):].float())
+        sync()
+        return mels, time.perf_counter() - start
+
+    torch.manual_seed(0)
+    noises = [torch.randn([mu.size(0), cfm.in_channels, mu.size(1)], device=mu.device) for mu, *_ in captured]
+    reference, _ = run("rk4", "linear", 64, noises)
+
+    results = []
+    for solver in args.solvers:
+        for schedule in args.schedules:
+            for steps in args.steps:
+                mels, elapsed = run(solver, schedule, steps, noises)
+                error = sum((m - r).abs().mean().item() for m, r in zip(mels, reference)) / len(mels)
+                results.append((solver, schedule, steps, steps * SOLVERS[solver], error, elapsed))
+
+    print(f"{'solver':<14}{'schedule':<10}{'steps':>6}{'NFE':>6}{'mel L1':>10}{'time(s)':>10}")
+    for solver, schedule, steps, nfe, error, elapsed in sorted(results, key=lambda r: (r[3], r[4])):
+        print(f"{solver:<14}{schedule:<10}{steps:>6}{nfe:>6}{error:>10.4f}{elapsed:>10.3f}")
+
+    baseline = [r for r in results if r[:3] == ("euler", "linear", 25)]
+    if baseline:
+        budget = baseline[0][4]
+        matching = [r for r in results if r[4] <= budget]
+        best = min(matching, key=lambda r: (r[3], r[5]))
+        print(f">> baseline euler/linear/25: mel L1 {budget:.4f}, {baseline[0][5]:.3f}s")
+        print(f">> fewest estimator calls at <= baseline error: {best[0]}/{best[1]}/{best[2]} steps "
+              f"(NFE {best[3]}), mel L1 {best[4]:.4f}, {best[5]:.3f}s")
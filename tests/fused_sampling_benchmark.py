@@ -0,0 +1,96 @@
+import argparse
+import time
+
+import torch
+from transformers import (LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper,
+                          TopKLogitsWarper, TopPLogitsWarper)
+
+from indextts.utils.fused_sampling import FusedLogitsProcessor
+
+VOCAB_SIZE = 8194
+
+
+def hf_processors(repetition_penalty, temperature, top_k, top_p, min_tokens_to_keep):
+    # 与 generate() 中的构建顺序一致
+    return LogitsProcessorList([
+        RepetitionPenaltyLogitsProcessor(penalty=repetition_penalty),
+        TemperatureLogitsWarper(temperature),
+        TopKLogitsWarper(top_k=top_k, min_tokens_to_keep=min_tokens_to_keep),
+        TopPLogitsWarper(top_p=top_p, min_tokens_to_keep=min_tokens_to_keep),
+    ])
+
+
+def same_scores(expected, actual):
+    finite = torch.isfinite(expected)
+    return torch.equal(finite, torch.isfinite(actual)) and torch.allclose(expected[finite], actual[finite])
+
+
+def run_steps(processor, input_ids, steps, reorder=False):
+    """Feed `steps` decode steps through `processor`, optionally shuffling rows between steps like beam search."""
+    generator = torch.Generator(device=input_ids.device).manual_seed(0)
+    outputs = []
+    for _ in range(steps):
+        scores = torch.randn(input_ids.shape[0], VOCAB_SIZE, device=input_ids.device, generator=generator)
+        outputs.append(processor(input_ids, scores))
+        next_tokens = torch.randint(0, VOCAB_SIZE, (input_ids.shape[0],), device=input_ids.device,
+                                    generator=generator)
+        if reorder:
+            beam_idx = torch.randint(0, input_ids.shape[0], (input_ids.shape[0],), device=input_ids.device,
+                                     generator=generator)
+            input_ids = input_ids[beam_idx]
+            if hasattr(processor, "reorder_beams"):
+                processor.reorder_beams(beam_idx)
+        input_ids = torch.cat([input_ids, next_tokens.unsqueeze(1)], dim=1)
+    return outputs
+
+
+def timed(fn, *args, repeat=3, device="cpu"):
+    fn(*args)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    """
+    Parity check and per-step microbenchmark of `FusedLogitsProcessor` against HF's repetition penalty,
+    temperature, top-k and top-p processors, with the default v2 settings.
+    ```
+    python tests/fused_sampling_benchmark.py
+    python tests/fused_sampling_benchmark.py --device cuda --batch_sizes 1 3 4 12 --history 1500
+    ```
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 3, 4, 12])
+    parser.add_argument("--history", type=int, default=500, help="prompt + generated tokens already seen")
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--repetition_penalty", type=float, default=10.0)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--top_k", type=int, default=30)
+    parser.add_argument("--top_p", type=float, default=0.8)
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    settings = (args.repetition_penalty, args.temperature, args.top_k, args.top_p)
+
+    # 正确性：逐步输出与 HF 处理器一致，包括 beam search 的行重排
+    for min_tokens_to_keep, reorder in ((1, False), (2, True)):
+        for batch_size in (1, 3, 6):
+            input_ids = torch.randint(0, VOCAB_SIZE, (batch_size, 40), device=args.device)
+            expected = run_steps(hf_processors(*settings, min_tokens_to_keep), input_ids, 20, reorder)
+            actual = run_steps(FusedLogitsProcessor(*settings, min_tokens_to_keep), input_ids, 20, reorder)
+            assert all(same_scores(e, a) for e, a in zip(expected, actual)), (batch_size, reorder)
+    print(">> parity check passed")
+
+    print(f"{'batch':>6}{'hf (ms/step)':>16}{'fused (ms/step)':>18}")
+    for batch_size in args.batch_sizes:
+        input_ids = torch.randint(0, VOCAB_SIZE, (batch_size, args.history), device=args.device)
+        hf = timed(lambda: run_steps(hf_processors(*settings, 1), input_ids, args.steps), device=args.device)
+        fused = timed(lambda: run_steps(FusedLogitsProcessor(*settings, 1), input_ids, args.steps),
+                      device=args.device)
+        print(f"{batch_size:>6}{hf / args.steps * 1e3:>16.3f}{fused / args.steps * 1e3:>18.3f}")
@@ -0,0 +1,78 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# 只应在创建模型时导入的重量级模块
+HEAVY_MODULES = [
+    "transformers",
+    "modelscope",
+    "librosa",
+    "torchaudio",
+    "huggingface_hub",
+    "safetensors",
+    "omegaconf",
+    "indextts.s2mel",
+    "indextts.gpt.model_v2",
+    "indextts.utils.front",
+]
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """
+    Cumulative import time of `module` and of everything it imports, from `python -X importtime`.
+    Returns:
+        (float, dict): total seconds, imported module -> cumulative seconds
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times.get(module, 0.0), times
+
+
+def imported_heavy_modules(module):
+    code = f"import sys, {module}; print('\\n'.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    loaded = set(result.stdout.split())
+    return [name for name in HEAVY_MODULES if name in loaded or any(m.startswith(name + ".") for m in loaded)]
+
+
+if __name__ == "__main__":
+    """
+    Import-time benchmark of the entry points: the heavy model dependencies must only be imported when a model is
+    created, so that the servers can answer health probes and the CLI can validate its arguments right away.
+    ```
+    python tests/import_time_test.py
+    python tests/import_time_test.py --budget 3.0 --top 20
+    ```
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=["indextts.infer_v2", "indextts.cli"])
+    parser.add_argument("--top", type=int, default=10, help="show the slowest imports")
+    parser.add_argument("--budget", type=float, default=None, help="fail if an import takes longer (seconds)")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        total, times = import_times(module)
+        print(f">> import {module}: {total:.3f}s")
+        slowest = sorted(((t, name) for name, t in times.items() if name != module), reverse=True)[:args.top]
+        for t, name in slowest:
+            print(f"   {t:8.3f}s  {name}")
+        heavy = imported_heavy_modules(module)
+        if heavy:
+            print(f">> FAIL: import {module} pulls in {heavy}")
+            failed = True
+        if args.budget is not None and total > args.budget:
+            print(f">> FAIL: import {module} took {total:.3f}s > budget {args.budget:.3f}s")
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,119 @@
+import argparse
+import time
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.utils.mel_codes import remove_long_silence, stop_token_lengths
+
+STOP_TOKEN = 8193
+SILENT_TOKEN = 52
+
+
+def reference_remove_long_silence(codes, stop_token=STOP_TOKEN, silent_token=SILENT_TOKEN, max_consecutive=30):
+    # 原逐 token 实现，作为对照
+    code_lens = []
+    codes_list = []
+    isfix = False
+    for i in range(0, codes.shape[0]):
+        code = codes[i]
+        if not torch.any(code == stop_token).item():
+            len_ = code.size(0)
+        else:
+            len_ = (code == stop_token).nonzero(as_tuple=False)[0].item()
+        count = torch.sum(code == silent_token).item()
+        if count > max_consecutive:
+            ncode_idx = []
+            n = 0
+            for k in range(len_):
+                if code[k] != silent_token:
+                    ncode_idx.append(k)
+                    n = 0
+                elif code[k] == silent_token and n < 10:
+                    ncode_idx.append(k)
+                    n += 1
+            len_ = len(ncode_idx)
+            codes_list.append(code[ncode_idx])
+            isfix = True
+        else:
+            codes_list.append(code[:len_])
+        code_lens.append(len_)
+    if isfix:
+        codes = pad_sequence(codes_list, batch_first=True, padding_value=stop_token)
+    max_len = max(code_lens)
+    if max_len < codes.shape[1]:
+        codes = codes[:, :max_len]
+    return codes, torch.tensor(code_lens, dtype=torch.long, device=codes.device)
+
+
+def reference_stop_token_lengths(codes, stop_token=STOP_TOKEN):
+    code_lens = []
+    for code in codes:
+        if stop_token not in code:
+            code_lens.append(len(code))
+        else:
+            code_lens.append((code == stop_token).nonzero(as_tuple=False)[0][0].item())
+    return torch.LongTensor(code_lens).to(codes.device)
+
+
+def random_codes(batch_size, length, silence_ratio, device):
+    codes = torch.randint(0, 8192, (batch_size, length), device=device)
+    # 随机插入静音段与 stop token
+    silent = torch.rand(batch_size, length, device=device) < silence_ratio
+    silent |= torch.roll(silent, 1, dims=1) & (torch.rand(batch_size, length, device=device) < 0.9)
+    codes[silent] = SILENT_TOKEN
+    stops = torch.randint(length // 2, length + 1, (batch_size,), device=device)
+    positions = torch.arange(length, device=device)[None, :]
+    codes[positions >= stops[:, None]] = STOP_TOKEN
+    return codes
+
+
+def timed(fn, *args, repeat=5, device="cpu"):
+    fn(*args)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    """
+    Parity check and microbenchmark of the tensor-level mel code post-processing against the per-token loops.
+    ```
+    python tests/mel_codes_benchmark.py
+    python tests/mel_codes_benchmark.py --device cuda --batch_sizes 1 8 32 --length 1500
+    ```
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--length", type=int, default=1500)
+    parser.add_argument("--silence_ratio", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    torch.manual_seed(0)
+
+    # 正确性：各种批大小、长度、静音比例下与原实现逐元素一致
+    for batch_size in (1, 2, 7):
+        for length in (1, 5, 64, 300):
+            for ratio in (0.0, 0.05, 0.5, 1.0):
+                codes = random_codes(batch_size, length, ratio, args.device)
+                expected, expected_lens = reference_remove_long_silence(codes)
+                actual, actual_lens = remove_long_silence(codes, STOP_TOKEN, silent_token=SILENT_TOKEN)
+                assert torch.equal(actual, expected), (batch_size, length, ratio)
+                assert torch.equal(actual_lens, expected_lens), (batch_size, length, ratio)
+                assert torch.equal(stop_token_lengths(codes, STOP_TOKEN), reference_stop_token_lengths(codes))
+    print(">> parity check passed")
+
+    print(f"{'batch':>6}{'loop remove(s)':>16}{'tensor remove(s)':>18}{'loop lens(s)':>14}{'tensor lens(s)':>16}")
+    for batch_size in args.batch_sizes:
+        codes = random_codes(batch_size, args.length, args.silence_ratio, args.device)
+        loop_remove = timed(reference_remove_long_silence, codes, repeat=args.repeat, device=args.device)
+        tensor_remove = timed(remove_long_silence, codes, STOP_TOKEN, repeat=args.repeat, device=args.device)
+        loop_lens = timed(reference_stop_token_lengths, codes, repeat=args.repeat, device=args.device)
+        tensor_lens = timed(stop_token_lengths, codes, STOP_TOKEN, repeat=args.repeat, device=args.device)
+        print(f"{batch_size:>6}{loop_remove:>16.5f}{tensor_remove:>18.5f}{loop_lens:>14.5f}{tensor_lens:>16.5f}")
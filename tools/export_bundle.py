@@ -0,0 +1,45 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indextts.infer_v2 import IndexTTS2
+from indextts.utils.bundle import export_bundle, verify_bundle
+
+
+def main():
+    """
+    Export IndexTTS2 as a single offline bundle, or verify an exported bundle:
+    ```
+    python tools/export_bundle.py checkpoints bundle --fp16
+    python tools/export_bundle.py --verify bundle
+    ```
+    The bundle directory is then used as `model_dir`:
+    `IndexTTS2(cfg_path="bundle/config.yaml", model_dir="bundle", use_fp16=True)`.
+    """
+    parser = argparse.ArgumentParser(description="Export IndexTTS2 as an offline safetensors bundle")
+    parser.add_argument("model_dir", nargs="?", default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("output_dir", nargs="?", default="bundle", help="Bundle output directory")
+    parser.add_argument("--fp16", action="store_true", default=False, help="Store the GPT weights in float16")
+    parser.add_argument("--device", type=str, default=None, help="Device used to load the models")
+    parser.add_argument("--no_qwen_emo", action="store_true", default=False, help="Do not copy the QwenEmotion model")
+    parser.add_argument("--verify", type=str, default=None, help="Verify the files of an exported bundle and exit")
+    args = parser.parse_args()
+
+    if args.verify:
+        mismatched = verify_bundle(args.verify)
+        if mismatched:
+            print(">> Bundle verification failed for:", *mismatched, sep="\n   ")
+            sys.exit(1)
+        print(">> Bundle verified:", args.verify)
+        return
+
+    tts = IndexTTS2(cfg_path=os.path.join(args.model_dir, "config.yaml"), model_dir=args.model_dir,
+                    use_fp16=args.fp16, device=args.device, use_cuda_kernel=False)
+    manifest = export_bundle(tts, args.output_dir, include_qwen_emo=not args.no_qwen_emo)
+    print(f">> Bundle exported to: {args.output_dir} ({len(manifest['files'])} files, gpt {manifest['gpt_dtype']})")
+
+
+if __name__ == "__main__":
+    main()